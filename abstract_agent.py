@@ -2,11 +2,14 @@ import json
 import asyncio
 import textwrap
 from pathlib import Path
+from contextlib import AbstractAsyncContextManager, nullcontext
 from typing import Dict, Any, List, Optional
 from pydantic_ai import Agent
 from tqdm import tqdm
 
+from profiling import StageProfiler, profile_stage
 from qwen_models import qwen
+from tenants import resolve_document_path
 
 
 class AbstractAgent:
@@ -14,8 +17,18 @@ class AbstractAgent:
     AbstractAgent类实现对processed-docs下的txt文件做摘要，并更新到map.json
     """
 
-    def __init__(self, map_file: str, docs_directory: str, chunk_lines:int=200):
+    def __init__(
+        self,
+        map_file: str,
+        docs_directory: str,
+        chunk_lines:int=200,
+        profiler: Optional[StageProfiler] = None,
+        limiter: Optional[AbstractAsyncContextManager] = None,
+    ):
         self.map_file = Path(map_file)
+        self.profiler = profiler
+        # 多个租户一起摘要时共享全局并发上限（TenantScheduler.limiter），默认不限制
+        self.limiter = limiter or nullcontext()
         self.docs_directory = Path(docs_directory)
         self.chunk_lines = chunk_lines
         # 摘要完成文件记录路径
@@ -119,7 +132,8 @@ class AbstractAgent:
         """
         # 过滤出存在的文档
         valid_docs = [(title, info) for title, info in self.file_map.items() 
-                     if Path(info["txt_path"]).exists() and info["sha1_hash"] not in self.completed_docs]
+                     if resolve_document_path(self.map_file, info["txt_path"]).exists()
+                     and info["sha1_hash"] not in self.completed_docs]
         
         if not valid_docs:
             print("没有找到有效的文档需要处理")
@@ -134,7 +148,7 @@ class AbstractAgent:
         
         tasks = []
         for title, info in valid_docs:
-            txt_path = Path(info["txt_path"])
+            txt_path = resolve_document_path(self.map_file, info["txt_path"])
             # 创建异步任务来处理每个文档，并传递进度条
             task = asyncio.create_task(self._process_single_document(title, txt_path, info["sha1_hash"], overall_pbar))
             tasks.append(task)
@@ -160,9 +174,11 @@ class AbstractAgent:
         """
         处理单个文档
         """
-        print(f"正在处理文档: {title}")
         try:
-            abstract = await self.summarize_document(txt_path)
+            async with self.limiter:
+                print(f"正在处理文档: {title}")
+                with profile_stage(self.profiler, "abstract", title):
+                    abstract = await self.summarize_document(txt_path)
             self.file_map[title]["abstract"] = abstract
             # 记录已完成摘要的文件
             self.completed_docs.add(sha1_hash)
@@ -1,45 +1,52 @@
+from __future__ import annotations
+
 import asyncio
 from contextlib import ExitStack
 from pathlib import Path
-from typing import Any, Callable, Coroutine, Sequence
-
-from prompt_toolkit import PromptSession
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory, Suggestion
-from prompt_toolkit.buffer import Buffer
-from prompt_toolkit.document import Document
-from prompt_toolkit.history import FileHistory
-import pyperclip
-from rich.console import Console, ConsoleOptions, RenderResult
-from rich.live import Live
-from rich.markdown import CodeBlock, Markdown
-from rich.status import Status
-from rich.syntax import Syntax
-from rich.text import Text
+from typing import TYPE_CHECKING, Any, Sequence
+import uuid
 
 from pydantic_ai import Agent, ModelMessage, ModelResponse
 
-from playbook import PlaybookOperator
+from chat_history import ConversationHistory
+from profiling import StageProfiler, profile_stage
+
+# prompt_toolkit、rich和pyperclip只在交互问答时用到，在各自的代码路径中按需导入
+if TYPE_CHECKING:
+    from prompt_toolkit.auto_suggest import AutoSuggest
+    from rich.console import Console
+
+    from answer_cache import AnswerCache, CachedAnswer
+    from playbook import PlaybookOperator
+    from reflection_queue import HandleAfterConversation, ReflectionQueue
 
 PYDANTIC_AI_HOME = Path.home() / '.pydantic-ai'
 PROMPT_HISTORY_FILENAME = 'prompt-history.txt'
+# 退出时等待后台反思任务完成的最长秒数，未完成的任务下次启动时继续处理
+REFLECTION_DRAIN_TIMEOUT = 30
+
+def custom_auto_suggest(special_suggestions: list[str] | None = None) -> AutoSuggest:
+    from prompt_toolkit.auto_suggest import AutoSuggestFromHistory, Suggestion
+    from prompt_toolkit.buffer import Buffer
+    from prompt_toolkit.document import Document
 
-HandleAfterConversation = Callable[[str, list[ModelMessage]], Coroutine[None, Any, None]]
+    class CustomAutoSuggest(AutoSuggestFromHistory):
+        def __init__(self, special_suggestions: list[str] | None = None):
+            super().__init__()
+            self.special_suggestions = special_suggestions or []
 
-class CustomAutoSuggest(AutoSuggestFromHistory):
-    def __init__(self, special_suggestions: list[str] | None = None):
-        super().__init__()
-        self.special_suggestions = special_suggestions or []
+        def get_suggestion(self, buffer: Buffer, document: Document) -> Suggestion | None:  # pragma: no cover
+            # Get the suggestion from history
+            suggestion = super().get_suggestion(buffer, document)
 
-    def get_suggestion(self, buffer: Buffer, document: Document) -> Suggestion | None:  # pragma: no cover
-        # Get the suggestion from history
-        suggestion = super().get_suggestion(buffer, document)
+            # Check for custom suggestions
+            text = document.text_before_cursor.strip()
+            for special in self.special_suggestions:
+                if special.startswith(text):
+                    return Suggestion(special[len(text) :])
+            return suggestion
 
-        # Check for custom suggestions
-        text = document.text_before_cursor.strip()
-        for special in self.special_suggestions:
-            if special.startswith(text):
-                return Suggestion(special[len(text) :])
-        return suggestion
+    return CustomAutoSuggest(special_suggestions)
 
 def get_event_loop():
     try:
@@ -57,19 +64,25 @@ async def run_chat(
     code_theme: str,
     prog_name: str,
     config_dir: Path | None = None,
-    handle_after_conversation: HandleAfterConversation | None = None,
+    reflection_queue: ReflectionQueue | None = None,
+    profiler: StageProfiler | None = None,
+    answer_cache: AnswerCache | None = None,
 ) -> int:
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.history import FileHistory
+
     prompt_history_path = (config_dir or PYDANTIC_AI_HOME) / PROMPT_HISTORY_FILENAME
     prompt_history_path.parent.mkdir(parents=True, exist_ok=True)
     prompt_history_path.touch(exist_ok=True)
     session: PromptSession[Any] = PromptSession(history=FileHistory(str(prompt_history_path)))
 
     multiline = False
-    messages: list[ModelMessage] = []
+    history = ConversationHistory()
+    session_id = uuid.uuid4().hex
+    auto_suggest = custom_auto_suggest(['/markdown', '/multiline', '/exit', '/cp', '/stats'])
 
     while True:
         try:
-            auto_suggest = CustomAutoSuggest(['/markdown', '/multiline', '/exit', '/cp'])
             text = await session.prompt_async(f'{prog_name} ➤ ', auto_suggest=auto_suggest, multiline=multiline)
         except (KeyboardInterrupt, EOFError):  # pragma: no cover
             return 0
@@ -79,13 +92,33 @@ async def run_chat(
 
         ident_prompt = text.lower().strip().replace(' ', '-')
         if ident_prompt.startswith('/'):
-            exit_value, multiline = handle_slash_command(ident_prompt, messages, multiline, console, code_theme)
+            exit_value, multiline = handle_slash_command(
+                ident_prompt, history.trace, multiline, console, code_theme, answer_cache
+            )
             if exit_value is not None:
                 return exit_value
         else:
+            new_messages: list[ModelMessage] = []
             try:
-                prompt = f"执行策略：{playbook_operator.list_policies()}\n\n{text}"
-                messages = await ask_agent(agent, prompt, stream, console, code_theme, messages)
+                message_history = history.for_model()
+                # 缓存的答案不依赖对话上下文，只用于会话中的第一个问题
+                use_cache = answer_cache is not None and not message_history
+                cache_version = answer_cache.version() if use_cache else None
+                cached = answer_cache.get(text) if use_cache else None
+                if cached:
+                    show_cached_answer(cached, console, code_theme)
+                    history.add_answer(text, cached.answer)
+                    continue
+                policies = playbook_operator.relevant_policies(text)
+                prompt = f"执行策略：{policies}\n\n{text}" if policies else text
+                with profile_stage(profiler, "question", text[:40]):
+                    messages = await ask_agent(agent, prompt, stream, console, code_theme, message_history)
+                new_messages = messages[len(message_history):]
+                history.add_turn(text, new_messages)
+                if use_cache:
+                    answer = next((m.text for m in reversed(new_messages) if isinstance(m, ModelResponse) and m.text), None)
+                    if answer:
+                        answer_cache.put(text, answer, cache_version)
             except asyncio.CancelledError:  # pragma: no cover
                 console.print('[dim]Interrupted[/dim]')
             except Exception as e:  # pragma: no cover
@@ -94,9 +127,16 @@ async def run_chat(
                 if cause:
                     console.print(f'[dim]Caused by: {cause}[/dim]')
             finally:
-                if handle_after_conversation:
-                    # 异步执行，不等待完成
-                    asyncio.create_task(handle_after_conversation(text, messages))
+                if reflection_queue and new_messages:
+                    # 放入后台队列，不等待完成
+                    reflection_queue.submit(session_id, text, new_messages)
+
+def show_cached_answer(cached: CachedAnswer, console: Console, code_theme: str):
+    from rich.markdown import Markdown
+
+    console.print(Markdown(cached.answer, code_theme=code_theme))
+    note = f'相似问题“{cached.question}”' if cached.similarity < 1 else '相同问题'
+    console.print(f'[dim]⚡ 缓存答案：{note}，{cached.created_at}回答[/dim]')
 
 async def ask_agent(
     agent: Agent,
@@ -107,6 +147,12 @@ async def ask_agent(
     messages: Sequence[ModelMessage] | None = None,
     handle_after_conversation: HandleAfterConversation | None = None,    
 ) -> list[ModelMessage]:
+    from rich.live import Live
+    from rich.markdown import Markdown
+    from rich.status import Status
+
+    from stream_render import IncrementalMarkdownRenderer
+
     status = Status('[dim]Working on it…[/dim]', console=console)
 
     if not stream:
@@ -125,31 +171,59 @@ async def ask_agent(
                         status.stop()  # stopping multiple times is idempotent
                         stack.enter_context(live)  # entering multiple times is idempotent
 
+                        renderer = IncrementalMarkdownRenderer(live, code_theme)
                         async for content in handle_stream.stream_output(debounce_by=None):
-                            live.update(Markdown(str(content), code_theme=code_theme))
+                            renderer.update(str(content))
+                        renderer.finish()
 
         assert agent_run.result is not None
         return agent_run.result.all_messages()
 
 
-def to_cli_sync(agent: Agent, playbook_operator: PlaybookOperator, handle_after_conversation: HandleAfterConversation | None = None):
+def to_cli_sync(
+    agent: Agent,
+    playbook_operator: PlaybookOperator,
+    reflection_queue: ReflectionQueue | None = None,
+    profiler: StageProfiler | None = None,
+    answer_cache: AnswerCache | None = None,
+):
     return get_event_loop().run_until_complete(
-        to_cli(agent, playbook_operator, handle_after_conversation)
+        to_cli(agent, playbook_operator, reflection_queue, profiler, answer_cache)
     )
 
-async def to_cli(agent: Agent, playbook_operator: PlaybookOperator, handle_after_conversation: HandleAfterConversation | None = None):
+async def to_cli(
+    agent: Agent,
+    playbook_operator: PlaybookOperator,
+    reflection_queue: ReflectionQueue | None = None,
+    profiler: StageProfiler | None = None,
+    answer_cache: AnswerCache | None = None,
+):
+    from rich.console import Console
+
     prettier_code_blocks()
     console = Console()
-    
-    exit_code = await run_chat(
-        stream=True,
-        agent=agent,
-        playbook_operator=playbook_operator,
-        console=console,
-        code_theme='ansi_dark',
-        prog_name='Family Insurance Doc',
-        handle_after_conversation=handle_after_conversation,
-    )
+    if reflection_queue:
+        await reflection_queue.start()
+
+    try:
+        exit_code = await run_chat(
+            stream=True,
+            agent=agent,
+            playbook_operator=playbook_operator,
+            console=console,
+            code_theme='ansi_dark',
+            prog_name='Family Insurance Doc',
+            reflection_queue=reflection_queue,
+            profiler=profiler,
+            answer_cache=answer_cache,
+        )
+    finally:
+        if answer_cache is not None:
+            answer_cache.flush()
+        if reflection_queue:
+            if reflection_queue.pending:
+                console.print(f'[dim]等待{reflection_queue.pending}个后台反思任务完成…[/dim]')
+            await reflection_queue.close(timeout=REFLECTION_DRAIN_TIMEOUT)
     
 
 def prettier_code_blocks():
@@ -157,6 +231,10 @@ def prettier_code_blocks():
 
     From https://github.com/samuelcolvin/aicli/blob/v0.8.0/samuelcolvin_aicli.py#L22
     """
+    from rich.console import Console, ConsoleOptions, RenderResult
+    from rich.markdown import CodeBlock, Markdown
+    from rich.syntax import Syntax
+    from rich.text import Text
 
     class SimpleCodeBlock(CodeBlock):
         def __rich_console__(
@@ -176,9 +254,16 @@ def prettier_code_blocks():
     Markdown.elements['fence'] = SimpleCodeBlock
 
 def handle_slash_command(
-    ident_prompt: str, messages: list[ModelMessage], multiline: bool, console: Console, code_theme: str
+    ident_prompt: str,
+    messages: list[ModelMessage],
+    multiline: bool,
+    console: Console,
+    code_theme: str,
+    answer_cache: AnswerCache | None = None,
 ) -> tuple[int | None, bool]:
     if ident_prompt == '/markdown':
+        from rich.syntax import Syntax
+
         try:
             parts = messages[-1].parts
         except IndexError:
@@ -206,6 +291,15 @@ def handle_slash_command(
         else:
             console.print('Disabling multiline mode.')
         return None, multiline
+    elif ident_prompt == '/stats':
+        if answer_cache is None:
+            console.print('[dim]答案缓存未开启[/dim]')
+        else:
+            stats = answer_cache.stats
+            console.print(
+                f'[dim]答案缓存：{answer_cache.size}条，命中{stats["hits"]}次（相似命中{stats["similar_hits"]}次），'
+                f'未命中{stats["misses"]}次，写入{stats["stores"]}次，因版本变化失效{stats["invalidated"]}条[/dim]'
+            )
     elif ident_prompt == '/exit':
         console.print('[dim]Exiting…[/dim]')
         return 0, multiline
@@ -215,6 +309,8 @@ def handle_slash_command(
         else:
             text_to_copy = messages[-1].text
             if text_to_copy and (text_to_copy := text_to_copy.strip()):
+                import pyperclip
+
                 pyperclip.copy(text_to_copy)
                 console.print('[dim]Copied last output to clipboard.[/dim]')
             else:
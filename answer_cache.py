@@ -0,0 +1,227 @@
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable
+
+from text_utils import normalize_text, to_simplified
+
+ANSWER_CACHE_DIR = './answer-cache'
+CACHE_FILENAME = 'answers.json'
+
+
+def normalize_question(question: str) -> str:
+    """缓存键：繁体转简体，统一全角/半角和大小写，去掉空白和标点"""
+    return normalize_text(to_simplified(question))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    created_at: str
+    # 通过n-gram相似度命中时为相似度，精确命中时为1
+    similarity: float = 1.0
+
+
+class AnswerCache:
+    """
+    问答结果缓存
+
+    以归一化后的问题为键，整个缓存绑定文档目录版本（map.json和facts.json的内容哈希）和策略剧本修订号，
+    任一版本变化时缓存整体失效。只缓存不依赖对话上下文的问题（会话中的第一个问题、批量问答、无会话的服务请求）。
+    similarity_threshold不为None时，精确匹配失败后再按字符n-gram余弦相似度查找最接近的已缓存问题。
+    playbook_revision应使用策略内容的修订号（PlaybookStore.content_revision），反思累加评估计数不会使缓存失效。
+
+    回答问题前用version()取得当前版本，put()时一并传入：回答期间文档目录或策略剧本发生变化时，
+    答案依据的是旧版本的数据，不写入缓存。
+
+    新条目先写入内存，flush_delay秒内的多次写入合并为一次，由后台线程写入文件，不阻塞事件循环；
+    退出前调用flush()写入剩余的条目。
+    """
+
+    def __init__(
+        self,
+        catalog_version: Callable[[], str],
+        playbook_revision: Callable[[], int],
+        directory: str = ANSWER_CACHE_DIR,
+        max_entries: int = 500,
+        similarity_threshold: float | None = None,
+        flush_delay: float = 2.0,
+    ):
+        self.catalog_version = catalog_version
+        self.playbook_revision = playbook_revision
+        self.directory = directory
+        self.path = os.path.join(directory, CACHE_FILENAME)
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.flush_delay = flush_delay
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "invalidated": 0, "stale": 0}
+        self._versions: tuple[str, int] | None = None
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._vectors: dict[str, Any] = {}
+        self._mtime_ns: int | None = None
+        # 批量问答和服务中多个任务共享同一个缓存
+        self._lock = threading.Lock()
+        # 保证后台线程与flush()的写入按快照顺序进行
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._writing = False
+        self._timer: threading.Timer | None = None
+        self._embedder = None
+
+    def _reload_if_changed(self):
+        # 内存中有尚未写入或正在写入的条目时以内存为准
+        if self._dirty or self._writing:
+            return
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns == self._mtime_ns:
+            return
+        if mtime_ns is None:
+            self._versions, self._entries = None, {}
+        else:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._versions = (data["catalog_version"], data["playbook_revision"])
+            self._entries = data["entries"]
+        self._vectors = {}
+        self._mtime_ns = mtime_ns
+
+    def _sync_versions(self):
+        """加载最新的缓存文件，文档目录或策略剧本的版本变化时丢弃所有条目"""
+        self._reload_if_changed()
+        versions = (self.catalog_version(), self.playbook_revision())
+        if versions != self._versions:
+            self.stats["invalidated"] += len(self._entries)
+            self._entries, self._vectors = {}, {}
+            self._versions = versions
+
+    def _write(self, data: dict[str, Any]) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.answers-', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.stat(self.path).st_mtime_ns
+
+    def _vector(self, key: str):
+        if self._embedder is None:
+            from playbook_retrieval import HashedNgramEmbedder
+            self._embedder = HashedNgramEmbedder()
+        if key not in self._vectors:
+            self._vectors[key] = self._embedder.embed(key)
+        return self._vectors[key]
+
+    def _most_similar(self, key: str) -> tuple[str, float] | None:
+        query = self._vector(key)
+        best: tuple[str, float] | None = None
+        for candidate in self._entries:
+            score = float(query @ self._vector(candidate))
+            if best is None or score > best[1]:
+                best = (candidate, score)
+        if best and best[1] >= self.similarity_threshold:
+            return best
+        return None
+
+    def version(self) -> tuple[str, int]:
+        """当前的文档目录版本和策略剧本修订号，回答问题前取得，写入缓存时传给put()"""
+        with self._lock:
+            self._sync_versions()
+            return self._versions
+
+    def get(self, question: str) -> CachedAnswer | None:
+        key = normalize_question(question)
+        if not key:
+            return None
+        with self._lock:
+            self._sync_versions()
+            similarity = 1.0
+            if key not in self._entries and self.similarity_threshold is not None and self._entries:
+                match = self._most_similar(key)
+                if match:
+                    key, similarity = match
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            # 命中的条目移到末尾，淘汰时最后被淘汰
+            self._entries[key] = self._entries.pop(key)
+            self.stats["hits"] += 1
+            if similarity < 1.0:
+                self.stats["similar_hits"] += 1
+            return CachedAnswer(entry["question"], entry["answer"], entry["created_at"], similarity)
+
+    def put(self, question: str, answer: str, version: tuple[str, int] | None = None):
+        """
+        缓存问题的答案
+
+        Args:
+            version (tuple, optional): 回答问题前通过version()取得的版本，与当前版本不同时不写入缓存
+        """
+        key = normalize_question(question)
+        if not key or not answer.strip():
+            return
+        with self._lock:
+            self._sync_versions()
+            if version is not None and version != self._versions:
+                self.stats["stale"] += 1
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "question": question,
+                "answer": answer,
+                "created_at": datetime.now().isoformat(timespec='seconds'),
+            }
+            while len(self._entries) > self.max_entries:
+                evicted = next(iter(self._entries))
+                del self._entries[evicted]
+                self._vectors.pop(evicted, None)
+            self.stats["stores"] += 1
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """把内存中尚未写入的条目写入文件"""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                # 条目写入后不再修改，浅拷贝即可得到一致的快照
+                data = {
+                    "catalog_version": self._versions[0],
+                    "playbook_revision": self._versions[1],
+                    "entries": dict(self._entries),
+                }
+                self._dirty = False
+                self._writing = True
+            try:
+                mtime_ns = self._write(data)
+            except BaseException:
+                with self._lock:
+                    self._dirty, self._writing = True, False
+                raise
+            with self._lock:
+                self._mtime_ns, self._writing = mtime_ns, False
+
+    @property
+    def size(self) -> int:
+        """当前版本下的缓存条目数"""
+        with self._lock:
+            self._sync_versions()
+            return len(self._entries)
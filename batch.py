@@ -0,0 +1,187 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any
+import uuid
+
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from tqdm import tqdm
+
+from answer_cache import AnswerCache
+from playbook import PlaybookOperator
+from reflection_queue import ReflectionQueue
+
+# 这些状态码表示触发了服务商的限流或暂时不可用，稍后重试即可
+RETRY_STATUS_CODES = {429, 502, 503}
+
+
+def make_record(item: dict[str, Any], **fields) -> dict[str, Any]:
+    """结果记录，成功、缓存命中和出错时都包含相同的字段"""
+    return {
+        **item,
+        "answer": None,
+        "latency_seconds": None,
+        "requests": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cached": False,
+        "error": None,
+        **fields,
+    }
+
+
+def read_questions(input_path: str) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """
+    读取问题文件，每行一个json对象，至少包含question字段；
+    缺少id时按行号编号，其余字段原样写入结果
+
+    Returns:
+        tuple: (问题列表, 无法解析的行对应的出错记录)
+    """
+    questions, invalid = [], []
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                invalid.append(make_record({"id": line_no}, error=f"第{line_no}行不是有效的json：{e}"))
+                continue
+            if not isinstance(item, dict) or not isinstance(item.get("question"), str):
+                invalid.append(make_record({"id": line_no}, error=f"第{line_no}行缺少question字段"))
+                continue
+            item.setdefault("id", line_no)
+            questions.append(item)
+    return questions, invalid
+
+
+async def answer_question(
+    agent: Agent,
+    playbook_operator: PlaybookOperator,
+    item: dict[str, Any],
+    max_retries: int = 3,
+    answer_cache: AnswerCache | None = None,
+) -> tuple[dict[str, Any], list]:
+    """回答单个问题，返回结果记录与本次执行的消息（供反思使用，缓存命中时为空）"""
+    question = item["question"]
+    started = time.perf_counter()
+    cache_version = answer_cache.version() if answer_cache is not None else None
+    cached = answer_cache.get(question) if answer_cache is not None else None
+    if cached:
+        record = make_record(
+            item,
+            answer=cached.answer,
+            latency_seconds=round(time.perf_counter() - started, 3),
+            cached=True,
+        )
+        return record, []
+    policies = playbook_operator.relevant_policies(question)
+    prompt = f"执行策略：{policies}\n\n{question}" if policies else question
+    for attempt in range(max_retries + 1):
+        try:
+            result = await agent.run(prompt)
+            break
+        except ModelHTTPError as e:
+            if e.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                raise
+            await asyncio.sleep(2 ** attempt)
+    usage = result.usage()
+    record = make_record(
+        item,
+        answer=str(result.output),
+        latency_seconds=round(time.perf_counter() - started, 3),
+        requests=usage.requests,
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+    )
+    if answer_cache is not None:
+        answer_cache.put(question, record["answer"], cache_version)
+    return record, result.all_messages()
+
+
+async def run_batch(
+    agent: Agent,
+    playbook_operator: PlaybookOperator,
+    input_path: str,
+    output_path: str,
+    concurrency: int = 4,
+    reflection_queue: ReflectionQueue | None = None,
+    answer_cache: AnswerCache | None = None,
+) -> dict[str, Any]:
+    """
+    批量回答问题，结果按完成顺序逐行写入输出文件
+
+    Args:
+        agent (Agent): 共享的问答Agent
+        playbook_operator (PlaybookOperator): 策略剧本
+        input_path (str): 问题文件（jsonl）
+        output_path (str): 结果文件（jsonl）
+        concurrency (int, optional): 同时进行的问答数
+        reflection_queue (ReflectionQueue, optional): 提供时每个问题结束后提交反思
+        answer_cache (AnswerCache, optional): 提供时相同的问题直接返回缓存的答案
+
+    Returns:
+        dict: 汇总统计
+    """
+    questions, invalid = read_questions(input_path)
+    pending: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+    for item in questions:
+        pending.put_nowait(item)
+
+    total = len(questions) + len(invalid)
+    stats = {"questions": total, "errors": len(invalid), "cache_hits": 0, "input_tokens": 0, "output_tokens": 0}
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    pbar = tqdm(total=total, desc="批量问答", unit="question")
+    started = time.perf_counter()
+
+    if reflection_queue:
+        await reflection_queue.start()
+
+    with open(output_path, 'w', encoding='utf-8') as out:
+        # 无法解析的行不中断批量问答，直接写入出错记录
+        for record in invalid:
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        out.flush()
+        pbar.update(len(invalid))
+
+        async def worker():
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                item_started = time.perf_counter()
+                try:
+                    record, messages = await answer_question(agent, playbook_operator, item, answer_cache=answer_cache)
+                    stats["input_tokens"] += record["input_tokens"]
+                    stats["output_tokens"] += record["output_tokens"]
+                    stats["cache_hits"] += record["cached"]
+                    if reflection_queue and messages:
+                        reflection_queue.submit(uuid.uuid4().hex, item["question"], messages)
+                except Exception as e:
+                    record = make_record(
+                        item,
+                        latency_seconds=round(time.perf_counter() - item_started, 3),
+                        error=f"{type(e).__name__}: {e}",
+                    )
+                    stats["errors"] += 1
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                pbar.update(1)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        finally:
+            pbar.close()
+            if answer_cache is not None:
+                answer_cache.flush()
+            if reflection_queue:
+                await reflection_queue.close()
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["questions_per_minute"] = round(total / elapsed * 60, 2) if elapsed > 0 else 0
+    return stats
@@ -0,0 +1,275 @@
+"""
+端到端基准测试
+
+在临时目录中生成合成合同语料，依次测量：
+- convert：PDFToTxtConverter的转换吞吐量（页/秒）
+- search：在processed-docs上执行grep的冷/热缓存延迟
+- abstract：AbstractAgent的摘要吞吐量
+- question：一次问答（含grep工具调用）的延迟
+
+大模型由pydantic-ai的FunctionModel替代，并注入固定延迟，不需要网络和API Key；
+报告中的overhead为扣除注入延迟后的本地开销。结果以JSON输出，可用--baseline与之前的结果对比。
+
+用法：
+    uv run python -m benchmarks.bench_pipeline [--documents 20] [--pages 10] [--model-delay 0.05] \\
+        [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import asyncio
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart, ToolReturnPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from benchmarks.corpus import generate_corpus
+
+STAGES = ("convert", "search", "abstract", "question")
+SEARCH_QUERIES = ["保险金额", "犹豫期", "被保险人", "不承担", "宽限期"]
+QUESTION = "我的重疾险保险金额是多少"
+
+
+@contextmanager
+def _working_directory(path: Path):
+    # map.json中的txt_path是相对于工作目录的，与main.py的运行方式保持一致
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[max(0, int(len(values) * q) - 1)]
+
+
+def _latency_summary(seconds: list[float], prefix: str = "latency") -> dict:
+    return {
+        f"{prefix}_ms_p50": statistics.median(seconds) * 1000,
+        f"{prefix}_ms_p95": _percentile(seconds, 0.95) * 1000,
+        f"{prefix}_ms_max": max(seconds) * 1000,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stub_model(delay: float, tool_file: str | None = None) -> tuple[FunctionModel, dict]:
+    """
+    模拟大模型：每次请求等待delay秒；提供tool_file时先调用一次grep再回答
+
+    Returns:
+        tuple: (FunctionModel, 调用计数)
+    """
+    calls = {"requests": 0}
+
+    async def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        calls["requests"] += 1
+        await asyncio.sleep(delay)
+        called_tool = any(isinstance(part, ToolReturnPart) for message in messages for part in message.parts)
+        if tool_file and not called_tool and any(tool.name == "grep" for tool in info.function_tools):
+            return ModelResponse(parts=[ToolCallPart("grep", {"query": "保险金额", "file_path": tool_file, "context_lines": 5})])
+        return ModelResponse(parts=[TextPart(content="根据合同，保险金额为500000元。")])
+
+    return FunctionModel(respond), calls
+
+
+def bench_convert(workdir: Path, corpus: dict) -> dict:
+    from pdf_converter import PDFToTxtConverter
+
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        PDFToTxtConverter("insurance-docs", "processed-docs", "map.json").process_all_pdfs()
+    elapsed = time.perf_counter() - started
+    txt_bytes = sum(path.stat().st_size for path in (workdir / "processed-docs").glob("*.txt"))
+    return {
+        "documents": corpus["documents"],
+        "pages": corpus["pages"],
+        "elapsed_seconds": elapsed,
+        "pages_per_second": corpus["pages"] / elapsed,
+        "txt_bytes": txt_bytes,
+    }
+
+
+def bench_search(workdir: Path) -> dict:
+    if shutil.which("rg") is None:
+        return {"skipped": "未找到rg命令"}
+    from insurance_agent import InsuranceAgent
+
+    agent = InsuranceAgent("map.json", "processed-docs")
+    files = [str(path.relative_to(workdir)) for path in sorted((workdir / "processed-docs").glob("*.txt"))]
+    cold, warm = [], []
+    for latencies in (cold, warm):
+        if latencies is cold:
+            agent._grep_cache.clear()
+        for file_path in files:
+            for query in SEARCH_QUERIES:
+                started = time.perf_counter()
+                agent.grep(query, file_path)
+                latencies.append(time.perf_counter() - started)
+    return {
+        "searches": len(cold),
+        **_latency_summary(cold, "cold"),
+        **_latency_summary(warm, "warm"),
+    }
+
+
+def bench_abstract(corpus: dict, delay: float) -> dict:
+    from abstract_agent import AbstractAgent
+
+    agent = AbstractAgent("map.json", "processed-docs")
+    agent.agent.model, calls = stub_model(delay)
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        asyncio.run(agent.process_all_documents())
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": corpus["documents"],
+        "model_requests": calls["requests"],
+        "elapsed_seconds": elapsed,
+        "documents_per_second": corpus["documents"] / elapsed,
+        # 各文档并发摘要，文档内的分片依次请求
+        "overhead_seconds": max(0.0, elapsed - delay * calls["requests"] / max(1, corpus["documents"])),
+    }
+
+
+def bench_question(workdir: Path, delay: float, turns: int) -> dict:
+    from batch import answer_question
+    from insurance_agent import InsuranceAgent
+    from playbook import PlaybookOperator, PlaybookStore
+
+    agent = InsuranceAgent("map.json", "processed-docs")
+    files = sorted((workdir / "processed-docs").glob("*.txt"))
+    tool_file = str(files[0].relative_to(workdir)) if files and shutil.which("rg") else None
+    agent.agent.model, calls = stub_model(delay, tool_file)
+    operator = PlaybookOperator(PlaybookStore(str(workdir / "playbook")))
+
+    async def run_turns() -> tuple[list[float], list[float]]:
+        latencies, overheads = [], []
+        for i in range(turns):
+            before = calls["requests"]
+            started = time.perf_counter()
+            await answer_question(agent.agent, operator, {"id": i, "question": QUESTION})
+            elapsed = time.perf_counter() - started
+            latencies.append(elapsed)
+            overheads.append(max(0.0, elapsed - delay * (calls["requests"] - before)))
+        return latencies, overheads
+
+    latencies, overheads = asyncio.run(run_turns())
+    return {
+        "turns": turns,
+        "tool_calls": tool_file is not None,
+        "model_requests": calls["requests"],
+        **_latency_summary(latencies),
+        **_latency_summary(overheads, "overhead"),
+    }
+
+
+def compare(baseline: dict, current: dict) -> dict:
+    """逐项计算 当前值/基准值，只比较两份结果中都存在的数值指标"""
+    ratios = {}
+    for stage, metrics in current.get("stages", {}).items():
+        previous = baseline.get("stages", {}).get(stage, {})
+        stage_ratios = {
+            name: value / previous[name]
+            for name, value in metrics.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+            and isinstance(previous.get(name), (int, float)) and previous[name]
+        }
+        if stage_ratios:
+            ratios[stage] = stage_ratios
+    return ratios
+
+
+def run(
+    documents: int = 20,
+    pages: int = 10,
+    model_delay: float = 0.05,
+    turns: int = 10,
+    stages: tuple[str, ...] = STAGES,
+    seed: int = 0,
+) -> dict:
+    """
+    在临时目录中生成语料并执行各阶段基准测试
+
+    convert总是执行，它产出的processed-docs和map.json是其余阶段的输入
+    """
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"documents": documents, "pages": pages, "model_delay": model_delay, "turns": turns, "seed": seed},
+        "corpus": {},
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        started = time.perf_counter()
+        corpus = generate_corpus(workdir / "insurance-docs", documents, pages, seed)
+        results["corpus"] = {
+            "documents": corpus["documents"],
+            "pages": corpus["pages"],
+            "bytes": corpus["bytes"],
+            "generate_seconds": time.perf_counter() - started,
+        }
+        with _working_directory(workdir):
+            results["stages"]["convert"] = bench_convert(workdir, corpus)
+            if "search" in stages:
+                results["stages"]["search"] = bench_search(workdir)
+            if "abstract" in stages:
+                results["stages"]["abstract"] = bench_abstract(corpus, model_delay)
+            if "question" in stages:
+                results["stages"]["question"] = bench_question(workdir, model_delay, turns)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端基准测试")
+    parser.add_argument("--documents", type=int, default=20, help="合成合同份数")
+    parser.add_argument("--pages", type=int, default=10, help="每份合同的页数")
+    parser.add_argument("--model-delay", type=float, default=0.05, help="模拟模型每次请求的延迟（秒）")
+    parser.add_argument("--turns", type=int, default=10, help="问答轮数")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"要执行的阶段，逗号分隔，可选 {','.join(STAGES)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果文件，默认输出到标准输出")
+    parser.add_argument("--baseline", help="之前的结果文件，输出中附加各指标的比值")
+    args = parser.parse_args()
+
+    stages = tuple(stage.strip() for stage in args.stages.split(",") if stage.strip())
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"未知的阶段：{','.join(sorted(unknown))}")
+
+    results = run(args.documents, args.pages, args.model_delay, args.turns, stages, args.seed)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            results["compared_to"] = compare(json.load(f), results)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+本地问答服务压测
+
+向已启动的 `main.py --serve` 服务并发发送问题，统计首字延迟、完整回答延迟和吞吐量。
+
+用法：
+    uv run python -m benchmarks.bench_server [--port 8765] [--clients 8] [--questions 5] [--question "..."]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+
+async def _post(host: str, port: int, path: str, payload: dict | None = None) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload or {}, ensure_ascii=False).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    await reader.readuntil(b"\r\n\r\n")
+    # writer被回收时会关闭连接，需要返回给调用方持有
+    return reader, writer
+
+
+async def _client(host: str, port: int, questions: list[str]) -> list[dict]:
+    reader, writer = await _post(host, port, "/sessions")
+    session_id = json.loads(await reader.read())["session_id"]
+    writer.close()
+    results = []
+    for question in questions:
+        started = time.perf_counter()
+        first_token = None
+        reader, writer = await _post(host, port, f"/sessions/{session_id}/ask", {"question": question})
+        error = None
+        async for line in reader:
+            line = line.decode("utf-8").strip()
+            if line.startswith("event: delta") and first_token is None:
+                first_token = time.perf_counter() - started
+            elif line.startswith("event: error"):
+                error = True
+        total = time.perf_counter() - started
+        writer.close()
+        results.append({"first_token": first_token if first_token is not None else total, "total": total, "error": error})
+    return results
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[max(0, int(len(values) * q) - 1)]
+
+
+async def run(host: str, port: int, clients: int, questions: list[str]) -> dict:
+    started = time.perf_counter()
+    per_client = await asyncio.gather(*(_client(host, port, questions) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    results = [result for client in per_client for result in client]
+    totals = [r["total"] for r in results]
+    first_tokens = [r["first_token"] for r in results]
+    return {
+        "clients": clients,
+        "answers": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "elapsed_seconds": elapsed,
+        "answers_per_second": len(results) / elapsed,
+        "first_token_p50": statistics.median(first_tokens),
+        "first_token_p95": _percentile(first_tokens, 0.95),
+        "total_p50": statistics.median(totals),
+        "total_p95": _percentile(totals, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地问答服务压测")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=8, help="并发会话数")
+    parser.add_argument("--questions", type=int, default=5, help="每个会话提问次数")
+    parser.add_argument("--question", default="我的重疾险保额是多少", help="提问内容")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.host, args.port, args.clients, [args.question] * args.questions))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+流式回答渲染基准测试
+
+回放一段记录下来的长回答流，对比逐次全量渲染与增量渲染的CPU时间和单次渲染延迟。
+
+用法：
+    uv run python -m benchmarks.bench_stream_render [--stream deltas.jsonl] [--repeat 3]
+
+deltas.jsonl每行一个 {"delta": "..."}，按顺序拼接即为完整回答；未指定时使用内置的合成保单对比回答。
+"""
+import argparse
+import io
+import json
+import random
+import statistics
+import time
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+from stream_render import IncrementalMarkdownRenderer
+
+
+def synthetic_answer(policies: int = 12) -> str:
+    """生成一段类似多份保单对比的长回答"""
+    sections = ["# 家庭保单对比\n", "以下根据已归档的保险合同逐一整理关键信息。\n"]
+    for i in range(1, policies + 1):
+        sections.append(f"## {i}. 保单{i:02d}：某某终身寿险（2017）\n")
+        sections.append(
+            "| 项目 | 内容 |\n|---|---|\n"
+            f"| 投保人 | 张三 |\n| 被保险人 | 李四 |\n| 保险金额 | {i * 10}万元 |\n"
+            f"| 年缴保费 | {i * 1234}元 |\n| 缴费期 | 20年 |\n| 到期日 | 终身 |\n"
+        )
+        sections.append(
+            "- **保障责任**：身故或全残保险金，按基本保险金额与已交保费的较大者给付。\n"
+            "- **免责条款**：投保人故意造成被保险人身故、被保险人故意犯罪等情形不承担给付责任。\n"
+            "- **犹豫期**：自收到保单之日起15日内可无条件解除合同。\n"
+        )
+        sections.append(
+            "```text\n"
+            f"条款摘录（第{i}条）：在本合同有效期内，我们承担下列保险责任……\n"
+            "```\n"
+        )
+    sections.append("综上，建议重点关注缴费期与到期日的衔接，避免保障空窗。\n")
+    return '\n'.join(sections)
+
+
+def split_deltas(text: str, seed: int = 0) -> list[str]:
+    """按模型流式输出的粒度把文本切成2~8字的增量"""
+    rng = random.Random(seed)
+    deltas, i = [], 0
+    while i < len(text):
+        step = rng.randint(2, 8)
+        deltas.append(text[i:i + step])
+        i += step
+    return deltas
+
+
+def load_deltas(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)["delta"] for line in f if line.strip()]
+
+
+def _replay(deltas: list[str], incremental: bool) -> dict:
+    console = Console(file=io.StringIO(), width=100, force_terminal=True, color_system='truecolor')
+    latencies = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with Live('', console=console, auto_refresh=False, vertical_overflow='ellipsis') as live:
+        renderer = IncrementalMarkdownRenderer(live, 'ansi_dark')
+        content = ''
+        for delta in deltas:
+            content += delta
+            started = time.perf_counter()
+            if incremental:
+                renderer.update(content)
+            else:
+                live.update(Markdown(content, code_theme='ansi_dark'))
+            live.refresh()
+            latencies.append(time.perf_counter() - started)
+        if incremental:
+            renderer.finish()
+    latencies.sort()
+    return {
+        "cpu_seconds": time.process_time() - cpu_start,
+        "wall_seconds": time.perf_counter() - wall_start,
+        "updates": len(deltas),
+        "latency_ms_p50": statistics.median(latencies) * 1000,
+        "latency_ms_p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "latency_ms_max": latencies[-1] * 1000,
+    }
+
+
+def run(deltas: list[str], repeat: int = 3) -> dict:
+    """每种模式运行repeat次，取CPU时间最短的一次"""
+    results = {}
+    for mode, incremental in (("full", False), ("incremental", True)):
+        runs = [_replay(deltas, incremental) for _ in range(repeat)]
+        results[mode] = min(runs, key=lambda r: r["cpu_seconds"])
+    results["speedup"] = results["full"]["cpu_seconds"] / max(results["incremental"]["cpu_seconds"], 1e-9)
+    results["answer_chars"] = sum(len(delta) for delta in deltas)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式markdown渲染基准测试")
+    parser.add_argument("--stream", help="记录的增量流文件（jsonl，每行一个delta）")
+    parser.add_argument("--policies", type=int, default=12, help="合成回答中的保单数量")
+    parser.add_argument("--repeat", type=int, default=3, help="每种模式的重复次数")
+    args = parser.parse_args()
+
+    deltas = load_deltas(args.stream) if args.stream else split_deltas(synthetic_answer(args.policies))
+    print(json.dumps(run(deltas, args.repeat), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
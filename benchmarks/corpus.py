@@ -0,0 +1,151 @@
+"""
+合成保险合同语料
+
+生成指定数量和页数的中文保险合同PDF，供基准测试和不依赖私有文档的测试使用。
+PDF使用Adobe预置的STSong-Light字体和UniGB-UTF16-H编码，无需嵌入字体文件，pdfplumber可以直接提取文字。
+
+用法：
+    uv run python -m benchmarks.corpus OUTPUT_DIR [--documents 10] [--pages 5] [--seed 0]
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+
+LINE_CHARS = 38
+LINES_PER_PAGE = 50
+
+_SURNAMES = "张王李赵刘陈杨黄周吴"
+_GIVEN_NAMES = ["伟", "芳", "娜", "敏", "静", "磊", "洋", "艳", "勇", "军", "杰", "娟"]
+_PRODUCTS = ["终身寿险", "重大疾病保险", "医疗保险", "意外伤害保险", "年金保险", "定期寿险"]
+_INSURERS = ["平安", "国寿", "太平洋", "新华", "泰康", "友邦"]
+_CLAUSES = [
+    "在本合同有效期内，我们承担下列保险责任：被保险人身故的，我们按基本保险金额与已交保费的较大者给付身故保险金，本合同终止。",
+    "被保险人经医院确诊初次患有本合同约定的重大疾病的，我们按基本保险金额给付重大疾病保险金。",
+    "因下列情形之一导致被保险人身故的，我们不承担给付保险金的责任：投保人对被保险人的故意杀害、故意伤害；被保险人故意犯罪或者抗拒依法采取的刑事强制措施。",
+    "自您签收本合同次日起，有15日的犹豫期。在此期间请您认真审视本合同，如果您认为本合同与您的需求不相符，您可以在此期间提出解除本合同，我们将无息退还您所支付的全部保险费。",
+    "您支付首期保险费后，除本合同另有约定外，如果您到期未支付保险费，自保险费约定支付日的次日零时起60日为宽限期。",
+    "保险金申请人向我们请求给付保险金的诉讼时效期间为2年，自其知道或者应当知道保险事故发生之日起计算。",
+    "本合同有效期内，您可以申请减少基本保险金额，减少部分视为退保，我们退还减少部分对应的现金价值。",
+    "被保险人在等待期内因疾病导致身故或确诊重大疾病的，我们无息退还已交保险费，本合同终止。",
+]
+
+
+def _wrap(text: str, width: int = LINE_CHARS) -> list[str]:
+    return [text[i:i + width] for i in range(0, len(text), width)] or [""]
+
+
+def contract_lines(index: int, pages: int, rng: random.Random) -> tuple[list[list[str]], dict]:
+    """
+    生成一份合同的分页文本
+
+    Returns:
+        tuple: (每页的文本行, 合同要素)
+    """
+    holder = rng.choice(_SURNAMES) + rng.choice(_GIVEN_NAMES)
+    insured = rng.choice(_SURNAMES) + rng.choice(_GIVEN_NAMES)
+    product = f"{rng.choice(_INSURERS)}{rng.choice(_PRODUCTS)}"
+    facts = {
+        "title": f"{product}合同{index:04d}",
+        "holder": holder,
+        "insured": insured,
+        "product": product,
+        "sum_insured": rng.randint(1, 100) * 10000,
+        "premium": rng.randint(10, 500) * 100,
+        "payment_years": rng.choice([1, 5, 10, 20, 30]),
+        "start_date": f"20{rng.randint(10, 24):02d}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日",
+    }
+    header = [
+        f"{facts['title']}",
+        f"保险单号：P{rng.randint(10 ** 9, 10 ** 10 - 1)}",
+        f"投保人：{holder}",
+        f"被保险人：{insured}",
+        f"保险产品：{product}",
+        f"保险金额：{facts['sum_insured']}元",
+        f"年交保险费：{facts['premium']}元",
+        f"交费期间：{facts['payment_years']}年",
+        f"合同生效日：{facts['start_date']}",
+        "",
+    ]
+    lines = list(header)
+    clause_no = 1
+    while len(lines) < pages * LINES_PER_PAGE:
+        lines.extend(_wrap(f"第{clause_no}条 {rng.choice(_CLAUSES)}"))
+        clause_no += 1
+    lines = lines[:pages * LINES_PER_PAGE]
+    return [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)], facts
+
+
+def build_pdf(pages: list[list[str]]) -> bytes:
+    """把分页文本写成最小的PDF文件"""
+    objects: list[bytes] = [b"", b""]  # 1: Catalog, 2: Pages，页面生成后再填写
+    objects.append(b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UTF16-H "
+                   b"/DescendantFonts [4 0 R] >>")
+    objects.append(b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+                   b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 4 >> "
+                   b"/FontDescriptor 5 0 R /DW 1000 >>")
+    objects.append(b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+                   b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>")
+    kids = []
+    for lines in pages:
+        ops = [b"BT /F1 12 Tf 15 TL 50 800 Td"]
+        for line in lines:
+            ops.append(b"<" + line.encode("utf-16-be").hex().encode("ascii") + b"> Tj T*")
+        ops.append(b"ET")
+        stream = b"\n".join(ops)
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def generate_corpus(directory: str | Path, documents: int = 10, pages: int = 5, seed: int = 0) -> dict:
+    """
+    在directory下生成documents份、每份pages页的合同PDF
+
+    Returns:
+        dict: 文档数、总页数、总字节数和每份合同的要素（可作为问答的标准答案）
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    contracts = []
+    total_bytes = 0
+    for index in range(1, documents + 1):
+        page_lines, facts = contract_lines(index, pages, rng)
+        data = build_pdf(page_lines)
+        path = directory / f"{facts['title']}.pdf"
+        path.write_bytes(data)
+        total_bytes += len(data)
+        contracts.append({**facts, "pdf_path": str(path)})
+    return {"documents": documents, "pages": documents * pages, "bytes": total_bytes, "contracts": contracts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成保险合同PDF")
+    parser.add_argument("output_dir", help="PDF输出目录，例如 insurance-docs")
+    parser.add_argument("--documents", type=int, default=10, help="合同份数")
+    parser.add_argument("--pages", type=int, default=5, help="每份合同的页数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，相同种子生成相同的语料")
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.output_dir, args.documents, args.pages, args.seed)
+    print(json.dumps({k: v for k, v in corpus.items() if k != "contracts"}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field, replace
+
+from pydantic_ai import ModelMessage
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from text_utils import estimate_tokens
+
+
+@dataclass
+class _Turn:
+    question: str
+    messages: list[ModelMessage]
+    answer: str
+    tokens: int = 0
+
+
+def _message_tokens(message: ModelMessage) -> int:
+    tokens = 0
+    for part in message.parts:
+        if isinstance(part, (UserPromptPart, TextPart)) and isinstance(part.content, str):
+            tokens += estimate_tokens(part.content)
+        elif isinstance(part, ToolReturnPart):
+            tokens += estimate_tokens(part.model_response_str())
+        elif isinstance(part, ToolCallPart):
+            tokens += estimate_tokens(part.args_as_json_str())
+    return tokens
+
+
+@dataclass
+class ConversationHistory:
+    """
+    问答会话的消息历史
+
+    trace保存完整的执行轨迹（供/markdown、/cp以及反思器使用），
+    for_model()返回发送给模型的压缩历史：
+    - 用户问题只保留原文，去掉每轮重复注入的策略前缀
+    - 超长的工具输出只保留开头部分，并以tool_call_id作为完整内容在trace中的引用
+    - 历史超过token预算时，较早的轮次折叠为一段问答摘要
+    """
+
+    token_budget: int = 6000
+    max_tool_chars: int = 800
+    keep_recent_turns: int = 2
+    summary_answer_chars: int = 200
+    trace: list[ModelMessage] = field(default_factory=list, init=False)
+    _turns: list[_Turn] = field(default_factory=list, init=False, repr=False)
+    _summary: list[str] = field(default_factory=list, init=False, repr=False)
+
+    def _compact_part(self, part, question: str, is_first_request: bool):
+        if isinstance(part, UserPromptPart) and is_first_request:
+            return replace(part, content=question)
+        if isinstance(part, ToolReturnPart):
+            content = part.model_response_str()
+            if len(content) > self.max_tool_chars:
+                omitted = len(content) - self.max_tool_chars
+                return replace(
+                    part,
+                    content=f"{content[:self.max_tool_chars]}\n…[工具输出过长，已省略{omitted}字符，"
+                            f"引用 {part.tool_call_id}；如需完整内容请重新调用工具]",
+                )
+        return part
+
+    def add_turn(self, question: str, messages: list[ModelMessage]):
+        """
+        记录一轮对话
+
+        Args:
+            question (str): 用户的原始问题（不含策略前缀）
+            messages (list[ModelMessage]): 本轮新增的完整消息
+        """
+        self.trace.extend(messages)
+        compacted = []
+        answer = ""
+        for i, message in enumerate(messages):
+            if isinstance(message, ModelRequest):
+                parts = [self._compact_part(part, question, i == 0) for part in message.parts]
+                compacted.append(replace(message, parts=parts))
+            else:
+                compacted.append(message)
+                if isinstance(message, ModelResponse) and message.text:
+                    answer = message.text
+        turn = _Turn(question=question, messages=compacted, answer=answer)
+        turn.tokens = sum(_message_tokens(message) for message in compacted)
+        self._turns.append(turn)
+        self._fold_old_turns()
+
+    def add_answer(self, question: str, answer: str):
+        """记录一轮没有经过模型的问答（如缓存命中的答案）"""
+        self.add_turn(question, [
+            ModelRequest(parts=[UserPromptPart(content=question)]),
+            ModelResponse(parts=[TextPart(content=answer)]),
+        ])
+
+    def _fold_old_turns(self):
+        while len(self._turns) > self.keep_recent_turns and self.tokens > self.token_budget:
+            turn = self._turns.pop(0)
+            answer = turn.answer.strip()
+            if len(answer) > self.summary_answer_chars:
+                answer = answer[:self.summary_answer_chars] + '…'
+            self._summary.append(f"问：{turn.question}\n答：{answer}")
+        # 摘要本身也不能无限增长，最多占用一半预算
+        while len(self._summary) > 1 and sum(estimate_tokens(line) for line in self._summary) > self.token_budget // 2:
+            self._summary.pop(0)
+
+    @property
+    def tokens(self) -> int:
+        """发送给模型的历史的估算token数"""
+        summary_tokens = sum(estimate_tokens(line) for line in self._summary)
+        return summary_tokens + sum(turn.tokens for turn in self._turns)
+
+    def for_model(self) -> list[ModelMessage]:
+        messages: list[ModelMessage] = []
+        if self._summary:
+            summary = '\n\n'.join(self._summary)
+            messages.append(ModelRequest(parts=[UserPromptPart(content=f"此前对话摘要：\n{summary}")]))
+            messages.append(ModelResponse(parts=[TextPart(content="好的，我已了解此前的对话内容。")]))
+        for turn in self._turns:
+            messages.extend(turn.messages)
+        return messages
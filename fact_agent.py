@@ -0,0 +1,120 @@
+import asyncio
+import json
+import re
+import textwrap
+from contextlib import AbstractAsyncContextManager
+from pathlib import Path
+from typing import Optional
+
+from pydantic_ai import Agent
+from tqdm import tqdm
+
+from fact_table import FactTable, PolicyFacts
+from profiling import StageProfiler, profile_stage
+from qwen_models import qwen
+from tenants import resolve_document_path
+
+# 保单要素通常集中在合同开头的保险单/投保信息部分，其余部分只保留包含关键词的行
+HEAD_CHARS = 4000
+KEYWORD_LINES = 80
+_KEYWORD_RE = re.compile(r"投保人|被保险人|保险金额|保额|保险费|保费|交费|缴费|到期|保险期间|满期|生效")
+
+
+class FactAgent:
+    """
+    FactAgent类从processed-docs下的txt文件中提取保单要素（投保人、被保险人、保险金额、保费、缴费期、到期日），
+    保存到processed-docs/facts.json，供问答时直接筛选和汇总
+    """
+
+    def __init__(
+        self,
+        map_file: str,
+        docs_directory: str,
+        concurrency: int = 4,
+        profiler: Optional[StageProfiler] = None,
+        limiter: Optional[AbstractAsyncContextManager] = None,
+    ):
+        self.map_file = Path(map_file)
+        self.docs_directory = Path(docs_directory)
+        self.concurrency = concurrency
+        # 多个租户一起提取时共享全局并发上限（TenantScheduler.limiter），此时忽略concurrency
+        self.limiter = limiter
+        self.profiler = profiler
+        self.table = FactTable(str(self.docs_directory))
+
+        # 加载map.json文件
+        if self.map_file.exists():
+            with open(self.map_file, 'r', encoding='utf-8') as f:
+                self.file_map = json.load(f)
+        else:
+            self.file_map = {}
+
+        self.agent = Agent(
+            model=qwen("qwen-flash"),
+            output_type=list[PolicyFacts],
+            instructions=(
+                textwrap.dedent("""
+                你是一个保险合同信息提取员，负责从保险合同文本中提取每份保单的关键要素。
+                一份文件可能包含多份保单（如主险和附加险），每份保单输出一条记录。
+                - 金额统一换算为元，如“50万元”填500000
+                - 日期统一为YYYY-MM-DD格式；终身保障的到期日填“终身”
+                - 到期日没有直接写明时，可以根据生效日和保险期间推算
+                - 文本中找不到的要素留空，不要猜测
+                """)
+            ),
+        )
+
+    @staticmethod
+    def select_text(content: str) -> str:
+        """保留合同开头部分和其余部分中包含要素关键词的行，减少发送给模型的内容"""
+        head, rest = content[:HEAD_CHARS], content[HEAD_CHARS:]
+        lines = [line.strip() for line in rest.splitlines() if _KEYWORD_RE.search(line)]
+        if not lines:
+            return head
+        return head + "\n……\n" + "\n".join(lines[:KEYWORD_LINES])
+
+    async def extract_document(self, file_path: Path) -> list[PolicyFacts]:
+        """提取单个文档中的保单要素"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        result = await self.agent.run(f"合同文件：{file_path.stem}\n\n{self.select_text(content)}")
+        return result.output
+
+    async def process_all_documents(self):
+        """
+        提取所有尚未提取过的文档并保存要素表，文档内容变化（SHA1不同）时重新提取，
+        已从map.json中移除的文档的要素一并删除
+        """
+        pruned = self.table.prune(self.file_map)
+        done = self.table.sha1_hashes()
+        pending = [(title, info) for title, info in self.file_map.items()
+                   if resolve_document_path(self.map_file, info["txt_path"]).exists()
+                   and info.get("sha1_hash") not in done]
+
+        if not pending:
+            if pruned:
+                self.table.save()
+                print(f"已删除{pruned}条已移除文档的要素")
+            print("没有需要提取要素的文档")
+            return
+
+        semaphore = self.limiter or asyncio.Semaphore(self.concurrency)
+        pbar = tqdm(total=len(pending), desc="提取保单要素", unit="doc")
+
+        async def extract(title: str, info: dict):
+            async with semaphore:
+                try:
+                    with profile_stage(self.profiler, "facts", title):
+                        policies = await self.extract_document(resolve_document_path(self.map_file, info["txt_path"]))
+                    self.table.replace_document(title, info.get("sha1_hash"), policies)
+                except Exception as e:
+                    print(f"提取文档 {title} 的要素时出错: {e}")
+                finally:
+                    pbar.update(1)
+
+        try:
+            await asyncio.gather(*(extract(title, info) for title, info in pending))
+        finally:
+            pbar.close()
+            self.table.save()
+        print(f"保单要素已写入 {self.table.path}，共{len(self.table)}条")
@@ -0,0 +1,252 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field
+
+FACTS_FILENAME = "facts.json"
+FACTS_FORMAT_VERSION = 1
+
+PaymentFrequency = Literal["年交", "半年交", "季交", "月交", "趸交"]
+# 每年的缴费次数，趸交只缴一次，不计入年缴保费
+_PAYMENTS_PER_YEAR = {"年交": 1, "半年交": 2, "季交": 4, "月交": 12, "趸交": 0}
+
+
+class PolicyFacts(BaseModel):
+    """一份保单的关键要素"""
+    policy_holder: str | None = Field(default=None, description="投保人姓名")
+    insured: str | None = Field(default=None, description="被保险人姓名，多人时用顿号分隔")
+    product: str | None = Field(default=None, description="保险产品名称")
+    sum_insured: float | None = Field(default=None, description="基本保险金额，单位元（如50万元填500000）")
+    premium: float | None = Field(default=None, description="每期保费，单位元")
+    payment_frequency: PaymentFrequency | None = Field(default=None, description="缴费方式")
+    payment_years: int | None = Field(default=None, description="缴费期，单位年；趸交填1")
+    expiry_date: str | None = Field(default=None, description="保险到期日，格式YYYY-MM-DD；终身保障填“终身”")
+
+
+# 列的顺序即facts.json中columns的顺序；annual_premium由premium和payment_frequency计算得出
+FACT_COLUMNS: dict[str, type] = {
+    "title": str,
+    "sha1_hash": str,
+    **{name: float if name in ("sum_insured", "premium") else int if name == "payment_years" else str
+       for name in PolicyFacts.model_fields},
+    "annual_premium": float,
+}
+
+FilterOp = Literal["==", "!=", ">", ">=", "<", "<=", "contains"]
+Aggregate = Literal["count", "sum", "avg", "min", "max"]
+
+
+class FactFilter(BaseModel):
+    column: str = Field(description="列名")
+    op: FilterOp = Field(description="比较方式，contains表示包含子串")
+    value: str | float = Field(description="比较的值；金额为元，日期为YYYY-MM-DD")
+
+
+def annual_premium(facts: PolicyFacts) -> float | None:
+    if facts.premium is None or facts.payment_frequency is None:
+        return None
+    return facts.premium * _PAYMENTS_PER_YEAR[facts.payment_frequency]
+
+
+class FactTable:
+    """
+    保单要素表
+
+    按列存储在 processed-docs/facts.json 中，每行对应一份保单（一个文档可能包含多份保单）；
+    没有提取到保单的文档单独记录SHA1，避免每次重新提取；
+    文件mtime变化时自动重新加载，写入时原子替换文件
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, FACTS_FILENAME)
+        self.columns: dict[str, list[Any]] = {name: [] for name in FACT_COLUMNS}
+        # 标题 -> SHA1，提取过但没有保单要素的文档
+        self.empty_documents: dict[str, str] = {}
+        self._mtime_ns: int | None = None
+        self._lock = threading.Lock()
+        self.reload_if_changed()
+
+    def __len__(self) -> int:
+        return len(self.columns["title"])
+
+    def reload_if_changed(self) -> bool:
+        """facts.json的mtime变化时重新加载，返回是否重新加载"""
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime_ns = None
+            if mtime_ns == self._mtime_ns:
+                return False
+            columns = {name: [] for name in FACT_COLUMNS}
+            empty_documents = {}
+            if mtime_ns is not None:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                stored = data["columns"]
+                rows = len(stored.get("title", []))
+                for name in FACT_COLUMNS:
+                    columns[name] = stored.get(name, [None] * rows)
+                empty_documents = data.get("empty_documents", {})
+            self.columns = columns
+            self.empty_documents = empty_documents
+            self._mtime_ns = mtime_ns
+            return True
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.facts-', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"format": FACTS_FORMAT_VERSION, "columns": self.columns, "empty_documents": self.empty_documents},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def sha1_hashes(self) -> set[str]:
+        """已提取过要素的文档，包括没有提取到保单的文档"""
+        return set(self.columns["sha1_hash"]) | set(self.empty_documents.values())
+
+    def replace_document(self, title: str, sha1_hash: str, policies: list[PolicyFacts]):
+        """用新提取的保单要素替换该文档原有的行"""
+        keep = [i for i, existing in enumerate(self.columns["title"]) if existing != title]
+        columns = {name: [values[i] for i in keep] for name, values in self.columns.items()}
+        for facts in policies:
+            row = {"title": title, "sha1_hash": sha1_hash, **facts.model_dump(), "annual_premium": annual_premium(facts)}
+            for name in FACT_COLUMNS:
+                columns[name].append(row[name])
+        empty_documents = {name: sha1 for name, sha1 in self.empty_documents.items() if name != title}
+        if not policies:
+            empty_documents[title] = sha1_hash
+        self.columns = columns
+        self.empty_documents = empty_documents
+
+    def prune(self, titles) -> int:
+        """删除不在titles中（已从map.json移除）的文档的行，返回删除的行数"""
+        titles = set(titles)
+        keep = [i for i, title in enumerate(self.columns["title"]) if title in titles]
+        removed = len(self) - len(keep)
+        if removed:
+            self.columns = {name: [values[i] for i in keep] for name, values in self.columns.items()}
+        empty_documents = {title: sha1 for title, sha1 in self.empty_documents.items() if title in titles}
+        removed += len(self.empty_documents) - len(empty_documents)
+        self.empty_documents = empty_documents
+        return removed
+
+    @staticmethod
+    def _check_column(name: str):
+        if name not in FACT_COLUMNS:
+            raise ValueError(f"未知的列：{name}，可用的列：{', '.join(FACT_COLUMNS)}")
+
+    def _mask(self, table: dict[str, list[Any]], condition: FactFilter) -> list[bool]:
+        self._check_column(condition.column)
+        values = table[condition.column]
+        numeric = FACT_COLUMNS[condition.column] in (int, float)
+        target: Any = condition.value
+        if numeric:
+            try:
+                target = float(target)
+            except ValueError:
+                raise ValueError(f"列{condition.column}是数值，无法与{condition.value!r}比较")
+        else:
+            target = str(target)
+
+        def match(value: Any) -> bool:
+            if value is None:
+                return condition.op == "!="
+            if condition.op == "contains":
+                return str(target) in str(value)
+            if condition.op == "==":
+                return value == target
+            if condition.op == "!=":
+                return value != target
+            # 日期列为YYYY-MM-DD，按字符串比较即为时间先后；“终身”排在所有日期之后
+            if condition.op == ">":
+                return value > target
+            if condition.op == ">=":
+                return value >= target
+            if condition.op == "<":
+                return value < target
+            return value <= target
+
+        return [match(value) for value in values]
+
+    @staticmethod
+    def _aggregate(aggregate: Aggregate, values: list[Any]) -> float | int | None:
+        if aggregate == "count":
+            return len(values)
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+        if aggregate == "sum":
+            return sum(values)
+        if aggregate == "avg":
+            return sum(values) / len(values)
+        if aggregate == "min":
+            return min(values)
+        return max(values)
+
+    def query(
+        self,
+        filters: list[FactFilter] | None = None,
+        columns: list[str] | None = None,
+        group_by: str | None = None,
+        aggregate: Aggregate | None = None,
+        value_column: str | None = None,
+        order_by: str | None = None,
+        descending: bool = False,
+        limit: int = 100,
+    ) -> list[dict[str, Any]]:
+        """
+        筛选、分组和聚合保单要素
+
+        Returns:
+            list[dict]: 未指定aggregate时为筛选后的行；否则为每个分组（未指定group_by时只有一组）的聚合结果
+        """
+        self.reload_if_changed()
+        # 只使用同一时刻的列，查询过程中重新加载或替换文档不会读到不一致的行
+        with self._lock:
+            table = self.columns
+        for name in [*(columns or []), group_by, value_column, order_by]:
+            if name:
+                self._check_column(name)
+        if aggregate and aggregate != "count" and not value_column:
+            raise ValueError(f"{aggregate}需要指定value_column")
+
+        selected = list(range(len(table["title"])))
+        for condition in filters or []:
+            mask = self._mask(table, condition)
+            selected = [i for i in selected if mask[i]]
+
+        if aggregate:
+            groups: dict[Any, list[int]] = {}
+            for i in selected:
+                groups.setdefault(table[group_by][i] if group_by else None, []).append(i)
+            if not group_by:
+                groups.setdefault(None, [])
+            result = []
+            for key, indices in groups.items():
+                values = [table[value_column][i] for i in indices] if value_column else indices
+                row = {group_by: key} if group_by else {}
+                row[f"{aggregate}({value_column})" if value_column else aggregate] = self._aggregate(aggregate, values)
+                row["count"] = len(indices)
+                result.append(row)
+            result.sort(key=lambda row: (row[group_by] is None, row[group_by]) if group_by else 0)
+            return result[:limit]
+
+        if order_by:
+            # 缺失值总是排在最后
+            present = [i for i in selected if table[order_by][i] is not None]
+            missing = [i for i in selected if table[order_by][i] is None]
+            present.sort(key=lambda i: table[order_by][i], reverse=descending)
+            selected = present + missing
+        names = columns or [name for name in FACT_COLUMNS if name != "sha1_hash"]
+        return [{name: table[name][i] for name in names} for i in selected[:limit]]
@@ -1,9 +1,16 @@
+import hashlib
 import json
+import os
+import threading
 from pathlib import Path
 from pydantic_ai import Agent
 import ripgrepy
 
+from fact_table import FACT_COLUMNS, Aggregate, FactFilter, FactTable
 from qwen_models import qwen
+from tenants import resolve_document_path
+
+GREP_CACHE_SIZE = 1024
 
 class InsuranceAgent:
     """
@@ -13,39 +20,102 @@ class InsuranceAgent:
     def __init__(self, map_file: str, docs_directory: str):
         self.map_file = Path(map_file)
         self.docs_directory = Path(docs_directory)
+        self._docs_root = self.docs_directory.resolve()
         
         # 加载map.json文件
-        if self.map_file.exists():
-            with open(self.map_file, 'r', encoding='utf-8') as f:
-                self.file_map = json.load(f)
-        else:
-            self.file_map = {}
+        self.file_map = {}
+        self._map_mtime_ns: int | None = None
+        self.reload_if_changed()
+
+        # grep结果缓存，批量问答时多个问题共享；键包含文件的mtime，文件更新后自动失效
+        self._grep_cache: dict[tuple[str, str, int, int], str] = {}
+        # 同步工具在线程池中执行，缓存读写需要加锁
+        self._grep_lock = threading.Lock()
+
+        # 保单要素表（--extract-facts生成），汇总类问题一次查询即可回答
+        self.facts = FactTable(str(self.docs_directory))
+        self._catalog_version: tuple[tuple, str] | None = None
             
         # 初始化pydantic-ai Agent
         self.agent = Agent(
             model=qwen("qwen3-max"),
-            instructions=(
-                "You are an insurance expert agent. Your role is to answer questions about insurance policies "
-                "based on the provided documents. You will use a ReAct (Reasoning + Action) approach to solve user queries.\n\n"
-                "Here's how you should approach each question:\n"
-                "1. **Thought**: Analyze the user's question and determine which documents might contain relevant information.\n"
-                "2. **Action**: Use the `grep` tool to search for relevant information in specific document files.\n"
-                "3. **Observation**: Examine the search results from grep to find the most relevant information.\n"
-                "4. **Answer**: Provide a clear, accurate, and helpful response based on the information found.\n\n"
-                "Use the file_map to locate relevant documents. The file_map contains document titles and their file paths.\n"
-                "When using the grep tool, be specific with your search queries to find the most relevant information.\n"
-                "If the initial grep results don't provide enough context, you can increase the context_lines parameter to get more surrounding lines.\n"
-                "Always provide your final answer in a clear and concise manner.\n"
-                f"Here is the file map: {self.file_map}\n\n"
-                "Example interaction pattern:\n"
-                "User: What is the coverage amount for the health insurance policy?\n"
-                "Thought: I need to find information about health insurance coverage amounts. I'll look through the file_map to identify relevant documents.\n"
-                "Action: grep(query='coverage amount', file_path='processed-docs/health_policy.txt', context_lines=10)\n"
-                "Observation: [Results from grep showing relevant lines with more context]\n"
-                "Answer: Based on the health insurance policy document, the coverage amount is $500,000.\n\n"
-                "Remember to always follow this ReAct pattern for optimal results."
-            ),
-            tools=[self.grep], # 注册工具函数
+            instructions=self._instructions,
+            tools=[self.grep, self.query_facts], # 注册工具函数
+        )
+
+    def reload_if_changed(self) -> bool:
+        """map.json的mtime变化时重新加载文件映射，返回是否重新加载"""
+        try:
+            mtime_ns = self.map_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns == self._map_mtime_ns:
+            return False
+        if mtime_ns is None:
+            self.file_map = {}
+        else:
+            with open(self.map_file, 'r', encoding='utf-8') as f:
+                self.file_map = json.load(f)
+        self._map_mtime_ns = mtime_ns
+        return True
+
+    def catalog_version(self) -> str:
+        """
+        文档目录的版本：map.json与facts.json内容的SHA1
+
+        文件的mtime和大小不变时直接返回上次的结果，转换、摘要或要素提取更新文件后版本随之变化
+        """
+        paths = [self.map_file, Path(self.facts.path)]
+        stat_key = tuple((st.st_mtime_ns, st.st_size) if (st := self._stat(path)) else None for path in paths)
+        if self._catalog_version and self._catalog_version[0] == stat_key:
+            return self._catalog_version[1]
+        sha1_hash = hashlib.sha1()
+        for path in paths:
+            if path.exists():
+                sha1_hash.update(path.read_bytes())
+            sha1_hash.update(b'\0')
+        self._catalog_version = (stat_key, sha1_hash.hexdigest())
+        return self._catalog_version[1]
+
+    @staticmethod
+    def _stat(path: Path) -> os.stat_result | None:
+        try:
+            return path.stat()
+        except FileNotFoundError:
+            return None
+
+    def _instructions(self) -> str:
+        # 每次运行时生成，保证长期运行的服务使用最新的文件映射
+        self.reload_if_changed()
+        self.facts.reload_if_changed()
+        facts_hint = (
+            f"A fact table with {len(self.facts)} policies is available through the `query_facts` tool "
+            f"(columns: {', '.join(FACT_COLUMNS)}; amounts in yuan, dates as YYYY-MM-DD). "
+            "For catalog-wide questions such as total annual premium, expiry dates or who is insured under which policy, "
+            "call `query_facts` once instead of grepping every document, and use grep only to verify details or read clauses.\n\n"
+            if len(self.facts) else ""
+        )
+        return (
+            "You are an insurance expert agent. Your role is to answer questions about insurance policies "
+            "based on the provided documents. You will use a ReAct (Reasoning + Action) approach to solve user queries.\n\n"
+            "Here's how you should approach each question:\n"
+            "1. **Thought**: Analyze the user's question and determine which documents might contain relevant information.\n"
+            "2. **Action**: Use the `grep` tool to search for relevant information in specific document files.\n"
+            "3. **Observation**: Examine the search results from grep to find the most relevant information.\n"
+            "4. **Answer**: Provide a clear, accurate, and helpful response based on the information found.\n\n"
+            "Use the file_map to locate relevant documents. The file_map contains document titles and their file paths.\n"
+            "When using the grep tool, be specific with your search queries to find the most relevant information.\n"
+            "If the initial grep results don't provide enough context, you can increase the context_lines parameter to get more surrounding lines.\n"
+            "Always provide your final answer in a clear and concise manner.\n"
+            f"Here is the file map: {self.file_map}\n\n"
+            "Example interaction pattern:\n"
+            "User: What is the coverage amount for the health insurance policy?\n"
+            "Thought: I need to find information about health insurance coverage amounts. I'll look through the file_map to identify relevant documents.\n"
+            "Action: grep(query='coverage amount', file_path='processed-docs/health_policy.txt', context_lines=10)\n"
+            "Observation: [Results from grep showing relevant lines with more context]\n"
+            "Answer: Based on the health insurance policy document, the coverage amount is $500,000.\n\n"
+            "Remember to always follow this ReAct pattern for optimal results.\n\n"
+            f"{facts_hint}"
         )
 
 
@@ -61,5 +131,59 @@ class InsuranceAgent:
         Returns:
             str: 搜索结果，包含匹配行的行号和内容
         """
+        # 文件路径相对于map.json所在目录，只能搜索本家庭（租户）文档目录中的文件
+        resolved = resolve_document_path(self.map_file, file_path)
+        if not resolved.resolve().is_relative_to(self._docs_root):
+            return f"只能搜索文档目录中的文件：{file_path}"
+        file_path = str(resolved)
+        try:
+            mtime_ns = os.stat(file_path).st_mtime_ns
+        except OSError:
+            mtime_ns = 0
+        key = (query, file_path, context_lines, mtime_ns)
+        with self._grep_lock:
+            cached = self._grep_cache.get(key)
+        if cached is not None:
+            return cached
+
         rg = ripgrepy.Ripgrepy(query, file_path)
-        return rg.E("utf-8").C(context_lines).run().as_string
+        result = rg.E("utf-8").C(context_lines).run().as_string
+        with self._grep_lock:
+            if len(self._grep_cache) >= GREP_CACHE_SIZE:
+                # 淘汰最早加入的结果
+                self._grep_cache.pop(next(iter(self._grep_cache)))
+            self._grep_cache[key] = result
+        return result
+
+    def query_facts(
+        self,
+        filters: list[FactFilter] | None = None,
+        columns: list[str] | None = None,
+        group_by: str | None = None,
+        aggregate: Aggregate | None = None,
+        value_column: str | None = None,
+        order_by: str | None = None,
+        descending: bool = False,
+        limit: int = 100,
+    ) -> str:
+        """
+        查询保单要素表，可筛选、排序、分组和聚合
+
+        Args:
+            filters (list[FactFilter], optional): 筛选条件，多个条件同时满足
+            columns (list[str], optional): 返回的列，默认返回全部列
+            group_by (str, optional): 分组的列，如insured
+            aggregate (str, optional): 聚合方式：count、sum、avg、min、max
+            value_column (str, optional): 被聚合的列，如annual_premium
+            order_by (str, optional): 排序的列，如expiry_date
+            descending (bool, optional): 是否降序
+            limit (int, optional): 最多返回的行数
+
+        Returns:
+            str: json格式的查询结果
+        """
+        try:
+            rows = self.facts.query(filters, columns, group_by, aggregate, value_column, order_by, descending, limit)
+        except ValueError as e:
+            return f"查询出错：{e}"
+        return json.dumps(rows, ensure_ascii=False)
@@ -1,20 +1,99 @@
-
 import argparse
 import asyncio
 from datetime import datetime
+from functools import lru_cache, partial
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from tenants import TenantPaths, TenantScheduler, list_tenants, tenant_paths
+
+# 各子命令只导入自己用到的模块，--convert、--help等不涉及大模型的命令无需加载pydantic_ai
+if TYPE_CHECKING:
+    from pydantic_ai import ModelMessage
+
+    from ace import CuratorAgent, ReflectorAgent
+    from answer_cache import AnswerCache
+    from insurance_agent import InsuranceAgent
+    from playbook import PlaybookOperator
+    from playbook_compaction import PlaybookCompactor
+    from profiling import StageProfiler
+    from reflection_queue import ReflectionQueue
+    from server import Tenant
+
+# 策略剧本相关对象按剧本目录（即租户）缓存，多家庭服务时只保留最近使用的租户
+TENANT_CACHE_SIZE = 16
+DEFAULT_PLAYBOOK_DIR = "./playbook"
+
+
+@lru_cache(maxsize=TENANT_CACHE_SIZE)
+def get_playbook_operator(playbook_directory: str = DEFAULT_PLAYBOOK_DIR) -> "PlaybookOperator":
+    from playbook import PlaybookOperator, PlaybookStore
+    return PlaybookOperator(PlaybookStore(playbook_directory))
+
+
+@lru_cache(maxsize=TENANT_CACHE_SIZE)
+def get_playbook_compactor(playbook_directory: str = DEFAULT_PLAYBOOK_DIR) -> "PlaybookCompactor":
+    from playbook_compaction import PlaybookCompactor
+    return PlaybookCompactor(get_playbook_operator(playbook_directory).store)
 
-from pydantic_ai import ModelMessage
 
-from agent2cli import to_cli_sync
-from pdf_converter import PDFToTxtConverter
-from insurance_agent import InsuranceAgent
-from abstract_agent import AbstractAgent
-from ace import ReflectorAgent, CuratorAgent
-from playbook import PlaybookOperator
+@lru_cache(maxsize=TENANT_CACHE_SIZE)
+def get_reflector_agent(playbook_directory: str = DEFAULT_PLAYBOOK_DIR) -> "ReflectorAgent":
+    from ace import ReflectorAgent
+    return ReflectorAgent(get_playbook_operator(playbook_directory))
 
-playbook_operator = PlaybookOperator()
-reflector_agent = ReflectorAgent(playbook_operator)
-curator_agent = CuratorAgent(playbook_operator)
+
+@lru_cache(maxsize=TENANT_CACHE_SIZE)
+def get_curator_agent(playbook_directory: str = DEFAULT_PLAYBOOK_DIR) -> "CuratorAgent":
+    from ace import CuratorAgent
+    return CuratorAgent(get_playbook_operator(playbook_directory))
+
+
+def create_reflection_queue(workers: int, paths: TenantPaths) -> "ReflectionQueue":
+    from reflection_queue import ReflectionQueue
+    return ReflectionQueue(
+        partial(handle_after_conversation, paths=paths),
+        directory=str(paths.reflection_queue_directory),
+        workers=workers,
+    )
+
+
+def create_answer_cache(
+    args: argparse.Namespace, insurance_agent: "InsuranceAgent", paths: TenantPaths
+) -> "AnswerCache | None":
+    if args.no_answer_cache:
+        return None
+    from answer_cache import AnswerCache
+    playbook_directory = str(paths.playbook_directory)
+    return AnswerCache(
+        insurance_agent.catalog_version,
+        lambda: get_playbook_operator(playbook_directory).store.content_revision,
+        directory=str(paths.answer_cache_directory),
+        similarity_threshold=args.cache_similarity,
+    )
+
+
+def load_tenant(args: argparse.Namespace, paths: TenantPaths) -> "Tenant":
+    """加载一个家庭的问答资源，只读取该家庭的文档映射、要素表和策略剧本"""
+    from insurance_agent import InsuranceAgent
+    from server import Tenant
+    if paths.tenant_id is not None and not paths.root.is_dir():
+        raise FileNotFoundError(str(paths.root))
+    agent = InsuranceAgent(str(paths.map_file), str(paths.output_directory))
+    return Tenant(
+        agent,
+        get_playbook_operator(str(paths.playbook_directory)),
+        create_reflection_queue(args.reflect_workers, paths),
+        create_answer_cache(args, agent, paths),
+    )
+
+
+def create_profiler(args: argparse.Namespace) -> "StageProfiler | None":
+    if not args.profile:
+        return None
+    from profiling import StageProfiler
+    return StageProfiler(args.profile, every=args.profile_every, top_n=args.profile_top)
 
 def main():
     parser = argparse.ArgumentParser(description="家庭保险文档处理工具")
@@ -33,39 +112,274 @@ def main():
         action="store_true", 
         help="生成文档摘要并更新map.json"
     )
+    parser.add_argument(
+        "--extract-facts",
+        action="store_true",
+        help="提取保单要素（投保人、被保险人、保险金额、保费、缴费期、到期日）到processed-docs/facts.json"
+    )
+    parser.add_argument(
+        "--compact-playbook",
+        action="store_true",
+        help="合并重复策略并退役有害或过期的策略"
+    )
+    parser.add_argument(
+        "--reflect-workers",
+        type=int,
+        default=1,
+        help="后台执行对话反思与策略整编的并发数"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="QUESTIONS_JSONL",
+        help="批量回答问题文件中的问题（jsonl，每行包含question字段）"
+    )
+    parser.add_argument(
+        "--output",
+        help="批量问答结果文件，默认为<问题文件名>.answers.jsonl"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="批量问答的并发数；与--all-tenants一起使用时为所有家庭摘要和要素提取的全局并发上限"
+    )
+    parser.add_argument(
+        "--reflect",
+        action="store_true",
+        help="批量问答时对每个问题执行ACE反思与策略整编"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="启动本地HTTP/SSE问答服务"
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="问答服务监听地址"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="问答服务监听端口"
+    )
+    parser.add_argument(
+        "--no-answer-cache",
+        action="store_true",
+        help="不使用答案缓存（默认对会话中的第一个问题、批量问答和无会话的服务请求使用缓存）"
+    )
+    parser.add_argument(
+        "--cache-similarity",
+        type=float,
+        metavar="THRESHOLD",
+        help="问题不完全相同时，按字符n-gram相似度不低于THRESHOLD（如0.9）的缓存答案也视为命中"
+    )
+    parser.add_argument(
+        "--tenant",
+        metavar="ID",
+        help="使用tenants/ID下的家庭数据（insurance-docs、processed-docs、map.json、playbook等），默认使用当前目录"
+    )
+    parser.add_argument(
+        "--all-tenants",
+        action="store_true",
+        help="对所有家庭执行--convert、--abstract、--extract-facts或--compact-playbook，摘要和要素提取共享--concurrency的全局并发上限；"
+             "与--serve一起使用时按请求中的tenant字段服务所有家庭"
+    )
+    parser.add_argument(
+        "--tenants-dir",
+        default="./tenants",
+        help="家庭数据的根目录"
+    )
+    parser.add_argument(
+        "--max-loaded-tenants",
+        type=int,
+        default=8,
+        help="多家庭问答服务在内存中保留的家庭数，超出时卸载最久未使用的家庭"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="./profile",
+        metavar="DIR",
+        help="对--convert、--abstract、--extract-facts、--question的每个文档或每轮问答采集cProfile和tracemalloc，结果写入DIR（默认./profile）"
+    )
+    parser.add_argument(
+        "--profile-every",
+        type=int,
+        default=1,
+        help="每N个文档或N轮问答采样一次"
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=20,
+        help="汇总中列出的热点函数和内存分配条数"
+    )
     
     args = parser.parse_args()
     
-    # 定义路径
-    pdf_directory = "insurance-docs"
-    output_directory = "processed-docs"
-    map_file = "map.json"
-    
+    # 定义路径：每个家庭（租户）的数据位于tenants/<ID>下，未指定时使用当前目录
+    if args.tenant and args.all_tenants:
+        parser.error("--tenant和--all-tenants不能同时使用")
+    try:
+        paths = tenant_paths(args.tenant, args.tenants_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    profiler = create_profiler(args)
+    try:
+        if args.all_tenants:
+            run_all_tenants(args, parser, profiler)
+        else:
+            run_mode(args, parser, paths, profiler)
+    finally:
+        if profiler:
+            print(f"性能分析结果已写入 {profiler.write_summary()}")
+
+
+def run_mode(
+    args: argparse.Namespace,
+    parser: argparse.ArgumentParser,
+    paths: TenantPaths,
+    profiler: "StageProfiler | None" = None,
+):
+    pdf_directory = str(paths.pdf_directory)
+    output_directory = str(paths.output_directory)
+    map_file = str(paths.map_file)
+    playbook_directory = str(paths.playbook_directory)
     if args.convert:
         # 创建PDF转换器并处理所有PDF文件
-        converter = PDFToTxtConverter(pdf_directory, output_directory, map_file)
+        from pdf_converter import PDFToTxtConverter
+        converter = PDFToTxtConverter(pdf_directory, output_directory, map_file, profiler)
         converter.process_all_pdfs()
         print("PDF转换完成")
     elif args.question:
         # 创建保险代理并回答问题
-        agent = InsuranceAgent(map_file, output_directory)     
-        to_cli_sync(agent.agent, playbook_operator, handle_after_conversation=handle_after_conversation)
+        from agent2cli import to_cli_sync
+        from insurance_agent import InsuranceAgent
+        agent = InsuranceAgent(map_file, output_directory)
+        reflection_queue = create_reflection_queue(args.reflect_workers, paths)
+        to_cli_sync(
+            agent.agent, get_playbook_operator(playbook_directory), reflection_queue, profiler,
+            create_answer_cache(args, agent, paths),
+        )
     elif args.abstract:
         # 创建摘要代理并处理所有文档
-        agent = AbstractAgent(map_file, output_directory)
+        from abstract_agent import AbstractAgent
+        agent = AbstractAgent(map_file, output_directory, profiler=profiler)
         asyncio.run(agent.process_all_documents())
+    elif args.extract_facts:
+        # 提取保单要素，问答时汇总类问题直接查询要素表
+        from fact_agent import FactAgent
+        agent = FactAgent(map_file, output_directory, profiler=profiler)
+        asyncio.run(agent.process_all_documents())
+    elif args.batch:
+        # 共享同一个保险代理并发回答问题
+        from batch import run_batch
+        from insurance_agent import InsuranceAgent
+        agent = InsuranceAgent(map_file, output_directory)
+        output_path = args.output or str(Path(args.batch).with_suffix('.answers.jsonl'))
+        reflection_queue = create_reflection_queue(args.reflect_workers, paths) if args.reflect else None
+        answer_cache = create_answer_cache(args, agent, paths)
+        stats = asyncio.run(run_batch(
+            agent.agent, get_playbook_operator(playbook_directory), args.batch, output_path, args.concurrency,
+            reflection_queue, answer_cache
+        ))
+        print(f"批量问答完成，结果已写入 {output_path}")
+        print(stats)
+    elif args.serve:
+        # 常驻进程，保持代理、文件映射和策略剧本索引在内存中
+        from server import InsuranceServer
+        try:
+            tenant = load_tenant(args, paths)
+        except FileNotFoundError:
+            parser.error(f"家庭数据不存在：{paths.root}")
+        server = InsuranceServer(
+            tenant.insurance_agent, tenant.playbook_operator, tenant.reflection_queue, answer_cache=tenant.answer_cache
+        )
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            print("服务已停止")
+    elif args.compact_playbook:
+        report = get_playbook_compactor(playbook_directory).compact()
+        print(report)
     else:
         parser.print_help()
 
-async def handle_after_conversation(objective: str, messages: list[ModelMessage]):
+
+def run_all_tenants(
+    args: argparse.Namespace,
+    parser: argparse.ArgumentParser,
+    profiler: "StageProfiler | None" = None,
+):
+    """对tenants目录下的所有家庭执行同一个任务"""
+    if args.serve:
+        # 每个家庭的资源在首次请求时加载，只保留最近使用的家庭
+        from server import InsuranceServer
+        server = InsuranceServer(
+            None, None,
+            tenant_loader=lambda tenant_id: load_tenant(args, tenant_paths(tenant_id, args.tenants_dir)),
+            max_loaded_tenants=args.max_loaded_tenants,
+        )
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            print("服务已停止")
+        return
+    if not (args.convert or args.abstract or args.extract_facts or args.compact_playbook):
+        parser.error("--all-tenants只能与--convert、--abstract、--extract-facts、--compact-playbook或--serve一起使用")
+
+    tenants = [tenant_paths(tenant_id, args.tenants_dir) for tenant_id in list_tenants(args.tenants_dir)]
+    if not tenants:
+        print(f"{args.tenants_dir}下没有家庭数据")
+        return
+    if args.convert:
+        # PDF转换受CPU限制，逐个家庭执行
+        for paths in tenants:
+            print(f"[{paths.label}]")
+            run_mode(args, parser, paths, profiler)
+    elif args.abstract or args.extract_facts:
+        # 所有家庭的文档在同一个事件循环中处理，模型请求数受全局并发上限约束并在家庭之间轮转
+        scheduler = TenantScheduler(args.concurrency)
+        if args.abstract:
+            from abstract_agent import AbstractAgent
+            agents = [
+                AbstractAgent(str(paths.map_file), str(paths.output_directory), profiler=profiler,
+                              limiter=scheduler.limiter(paths.tenant_id))
+                for paths in tenants
+            ]
+        else:
+            from fact_agent import FactAgent
+            agents = [
+                FactAgent(str(paths.map_file), str(paths.output_directory), profiler=profiler,
+                          limiter=scheduler.limiter(paths.tenant_id))
+                for paths in tenants
+            ]
+
+        async def process_all():
+            await asyncio.gather(*(agent.process_all_documents() for agent in agents))
+
+        asyncio.run(process_all())
+    else:
+        for paths in tenants:
+            print(f"[{paths.label}] {get_playbook_compactor(str(paths.playbook_directory)).compact()}")
+
+async def handle_after_conversation(objective: str, messages: "list[ModelMessage]", paths: TenantPaths | None = None):
     """处理每次对话后的消息
     Args:
         objective (str): 对话的目标
         messages (list[ModelMessage]): 对话中的消息列表
+        paths (TenantPaths, optional): 对话所属家庭的存储分片，反思结果只更新该家庭的策略剧本
     """
-    result = await reflector_agent.reflect(objective, messages)
-    curated = await curator_agent.curate(objective, result)
-    with open(f"./reflector/{datetime.now().strftime('%Y%m%d%H%M%S')}.json", "w", encoding="utf-8") as f:
+    paths = paths or tenant_paths()
+    playbook_directory = str(paths.playbook_directory)
+    result = await get_reflector_agent(playbook_directory).reflect(objective, messages)
+    get_playbook_operator(playbook_directory).store.record_evaluations(result.playbook_evaluation)
+    curated = await get_curator_agent(playbook_directory).curate(objective, result)
+    get_playbook_compactor(playbook_directory).maybe_compact()
+    os.makedirs(paths.reflector_directory, exist_ok=True)
+    with open(paths.reflector_directory / f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}.json", "w", encoding="utf-8") as f:
         f.write(result.model_dump_json(indent=2, ensure_ascii=False))
         f.write(curated)
     
@@ -3,14 +3,17 @@ import json
 import hashlib
 from pathlib import Path
 
+from profiling import StageProfiler, profile_stage
+
 
 class PDFToTxtConverter:
     """
     PDFToTxtConverter类封装pdf文本提取相关功能
     """
 
-    def __init__(self, pdf_directory: str, output_directory: str, map_file: str):
+    def __init__(self, pdf_directory: str, output_directory: str, map_file: str, profiler: StageProfiler | None = None):
         self.pdf_directory = Path(pdf_directory)
+        self.profiler = profiler
         self.output_directory = Path(output_directory)
         self.map_file = Path(map_file)
         self.pdf_files = list(self.pdf_directory.glob("*.pdf"))
@@ -98,9 +101,9 @@ class PDFToTxtConverter:
                 continue
 
             # 处理pdf文件
-            txt_path = self.output_directory / (pdf_file.stem + ".txt")
-            txt_path = self.convert_pdf_to_txt(pdf_file)   
-            self.update_map_file(pdf_file, txt_path, pdf_sha1)
+            with profile_stage(self.profiler, "convert", pdf_file.name):
+                txt_path = self.convert_pdf_to_txt(pdf_file)
+                self.update_map_file(pdf_file, txt_path, pdf_sha1)
             print(f"Finished processing {pdf_file.name}")
 
         
\ No newline at end of file
@@ -1,12 +1,17 @@
-from functools import wraps
+from datetime import datetime
+import json
 import os
-from typing import Literal
+import re
+import tempfile
+import threading
+from typing import Any, Literal
 
 from pydantic import BaseModel, Field
-import ripgrepy
 
 PLAYBOOK_DIR = './playbook'
-LIST_FILE = os.path.join(PLAYBOOK_DIR, 'playbook-list.txt')
+STORE_FILENAME = 'playbook.json'
+LOCK_FILENAME = 'playbook.lock'
+STORE_FORMAT_VERSION = 1
 
 class Playbook(BaseModel):
     bullet_id: int = Field(description="策略文件序号")
@@ -16,124 +21,396 @@ class PlaybookEvaluation(BaseModel):
     bullet_id: int = Field(description="策略文件序号")
     impact: Literal["helpful", "harmful", "neutral"] = Field(description="对策略文件的评估")
 
-class PlaybookOperator:
+class PolicyRecord(Playbook):
+    helpful: int = Field(default=0, description="被评估为有帮助的次数")
+    harmful: int = Field(default=0, description="被评估为有害的次数")
+    neutral: int = Field(default=0, description="被评估为中性的次数")
+    created_at: str = Field(description="创建时间")
+    updated_at: str = Field(description="最后修改时间")
+    last_helpful_at: str | None = Field(default=None, description="最近一次被评估为有帮助的时间")
+
+
+class _FileLock:
+    """
+    跨进程的排他文件锁，同时兼顾同一进程内的多线程
+    Windows下使用msvcrt，其他平台使用fcntl
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return self
+        self._fd = open(self.path, 'a+b')
+        if os.name == 'nt':
+            import msvcrt
+            self._fd.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._fd.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK重试10次后仍失败会抛出OSError，继续等待
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._fd.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        try:
+            if self._depth == 0 and self._fd is not None:
+                if os.name == 'nt':
+                    import msvcrt
+                    self._fd.seek(0)
+                    msvcrt.locking(self._fd.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(self._fd.fileno(), fcntl.LOCK_UN)
+                self._fd.close()
+                self._fd = None
+        finally:
+            self._thread_lock.release()
+
+
+class PlaybookStore:
+    """
+    策略剧本存储
+
+    所有策略保存在单个 playbook.json 文件中，进程内维护一份内存索引：
+    - 读取时只比较文件的mtime/size，未变化则直接使用内存索引
+    - 写入时持有文件锁，先重新加载磁盘上的最新内容，再分配序号并原子替换文件
+    - 首次使用时自动导入旧版的 NNNNNNNN.txt 策略文件
+    """
+
+    def __init__(self, directory: str = PLAYBOOK_DIR):
+        self.directory = directory
+        self.store_file = os.path.join(directory, STORE_FILENAME)
+        os.makedirs(directory, exist_ok=True)
+        self._lock = _FileLock(os.path.join(directory, LOCK_FILENAME))
+        self._data: dict[str, Any] = self._empty_data()
+        self._stat_key: tuple[int, int, int] | None = None
+        self._policies_cache: list[Playbook] | None = None
+        if self._file_stat_key() is None and self.has_legacy_files():
+            self.import_legacy()
+        self._refresh()
+
     @staticmethod
-    def ensure_playbook_dir():
-        """确保playbook目录存在的装饰器"""
-        def decorator(func):
-            @wraps(func)
-            def wrapper(*args, **kwargs):
-                # 确保目录存在的逻辑
-                if not os.path.exists(PLAYBOOK_DIR):
-                    os.makedirs(PLAYBOOK_DIR)
-                # 调用原始函数
-                return func(*args, **kwargs)
-            return wrapper
-        return decorator
-
-    @ensure_playbook_dir()
-    def create_policy(self, content: str) -> int:
-        """创建策略文件"""
-        bullet_id = self.get_next_bullet_id()
-        filename = os.path.join(PLAYBOOK_DIR, f'{bullet_id:08d}.txt')
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(content)
-        return self.get_next_bullet_id()
-
-    @ensure_playbook_dir()
-    def get_existing_indices(self) -> list[int]:
-        """获取所有存在的策略文件序号"""
+    def _empty_data() -> dict[str, Any]:
+        return {"format": STORE_FORMAT_VERSION, "next_id": 1, "revision": 0, "content_revision": 0, "policies": {}}
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat(timespec='seconds')
+
+    @staticmethod
+    def _new_record(content: str, created_at: str) -> dict[str, Any]:
+        return {
+            "content": content,
+            "created_at": created_at,
+            "updated_at": created_at,
+            "helpful": 0,
+            "harmful": 0,
+            "neutral": 0,
+            "last_helpful_at": None,
+        }
+
+    def _file_stat_key(self) -> tuple[int, int, int] | None:
+        try:
+            st = os.stat(self.store_file)
+        except FileNotFoundError:
+            return None
+        # 原子替换会生成新的inode，即使mtime精度较粗也能识别出变化
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load(self, stat_key: tuple[int, int, int] | None):
+        if stat_key is None:
+            self._data = self._empty_data()
+        else:
+            with open(self.store_file, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        self._stat_key = stat_key
+        self._policies_cache = None
+
+    def _refresh(self):
+        """如果磁盘上的文件发生了变化（其他进程或任务写入），重新加载内存索引"""
+        stat_key = self._file_stat_key()
+        if stat_key != self._stat_key:
+            self._load(stat_key)
+
+    def _write(self):
+        """原子写入：先写临时文件，再替换正式文件"""
+        fd, tmp_path = tempfile.mkstemp(prefix='.playbook-', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.store_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._stat_key = self._file_stat_key()
+        self._policies_cache = None
+
+    def _commit(self, content_changed: bool = True):
+        self._data["revision"] = self._data.get("revision", 0) + 1
+        if content_changed:
+            self._data["content_revision"] = self._data.get("content_revision", 0) + 1
+        self._write()
+
+    def has_legacy_files(self) -> bool:
+        """目录下是否存在旧版的 NNNNNNNN.txt 策略文件"""
+        return any(self._legacy_ids())
+
+    def _legacy_ids(self) -> list[int]:
         indices = []
-        if os.path.exists(LIST_FILE):
-            with open(LIST_FILE, 'r') as f:
-                for line in f:
-                    try:
-                        bullet_id = int(line.strip())
-                        indices.append(bullet_id)
-                    except ValueError:
-                        continue
+        for filename in os.listdir(self.directory):
+            stem = filename[:-4]
+            if filename.endswith('.txt') and stem.isdigit() and len(stem) == 8:
+                indices.append(int(stem))
         return sorted(indices)
-    
-    @ensure_playbook_dir()
-    def update_playbook_list(self):
-        """更新playbook-list.txt文件"""
-        indices = []
-        for filename in os.listdir(PLAYBOOK_DIR):
-            if filename.endswith('.txt') and filename[:-4].isdigit() and len(filename[:-4]) == 8:
-                try:
-                    bullet_id = int(filename[:-4])
-                    indices.append(bullet_id)
-                except ValueError:
+
+    def import_legacy(self) -> int:
+        """
+        导入旧版的 NNNNNNNN.txt 策略文件，已存在的序号不会被覆盖
+
+        Returns:
+            int: 导入的策略条数
+        """
+        with self._lock:
+            self._refresh()
+            policies = self._data["policies"]
+            imported = 0
+            for bullet_id in self._legacy_ids():
+                if str(bullet_id) in policies:
+                    continue
+                filename = os.path.join(self.directory, f'{bullet_id:08d}.txt')
+                with open(filename, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                created_at = datetime.fromtimestamp(os.path.getmtime(filename)).isoformat(timespec='seconds')
+                policies[str(bullet_id)] = self._new_record(content, created_at)
+                self._data["next_id"] = max(self._data["next_id"], bullet_id + 1)
+                imported += 1
+            if imported or self._stat_key is None:
+                self._commit()
+            return imported
+
+    @property
+    def revision(self) -> int:
+        """存储的修订号，每次写入加一，可作为策略剧本的版本号"""
+        self._refresh()
+        return self._data.get("revision", 0)
+
+    @property
+    def content_revision(self) -> int:
+        """策略内容的修订号，只在新增、修改、删除或退役策略时加一，累加评估计数不改变"""
+        self._refresh()
+        return self._data.get("content_revision", 0)
+
+    def ids(self) -> list[int]:
+        self._refresh()
+        return sorted(int(key) for key in self._data["policies"])
+
+    def next_id(self) -> int:
+        self._refresh()
+        return self._data["next_id"]
+
+    def get(self, bullet_id: int) -> str | None:
+        self._refresh()
+        record = self._data["policies"].get(str(bullet_id))
+        return record["content"] if record else None
+
+    def policies(self) -> list[Playbook]:
+        self._refresh()
+        if self._policies_cache is None:
+            self._policies_cache = [
+                Playbook(bullet_id=int(key), content=record["content"])
+                for key, record in sorted(self._data["policies"].items(), key=lambda item: int(item[0]))
+            ]
+        return list(self._policies_cache)
+
+    def records(self) -> list[PolicyRecord]:
+        """列出所有策略及其评估计数"""
+        self._refresh()
+        return [
+            PolicyRecord(bullet_id=int(key), **record)
+            for key, record in sorted(self._data["policies"].items(), key=lambda item: int(item[0]))
+        ]
+
+    def create(self, content: str) -> int:
+        with self._lock:
+            self._refresh()
+            bullet_id = self._data["next_id"]
+            self._data["policies"][str(bullet_id)] = self._new_record(content, self._now())
+            self._data["next_id"] = bullet_id + 1
+            self._commit()
+            return bullet_id
+
+    def update(self, bullet_id: int, content: str) -> bool:
+        with self._lock:
+            self._refresh()
+            record = self._data["policies"].get(str(bullet_id))
+            if record is None:
+                return False
+            record["content"] = content
+            record["updated_at"] = self._now()
+            self._commit()
+            return True
+
+    def delete(self, bullet_id: int) -> bool:
+        with self._lock:
+            self._refresh()
+            if self._data["policies"].pop(str(bullet_id), None) is None:
+                return False
+            self._commit()
+            return True
+
+    def record_evaluations(self, evaluations: list[PlaybookEvaluation]) -> int:
+        """
+        累加反思器对策略的评估计数，不存在的策略序号会被忽略
+
+        Returns:
+            int: 实际记录的评估条数
+        """
+        if not evaluations:
+            return 0
+        with self._lock:
+            self._refresh()
+            now = self._now()
+            recorded = 0
+            for evaluation in evaluations:
+                record = self._data["policies"].get(str(evaluation.bullet_id))
+                if record is None:
+                    continue
+                record[evaluation.impact] = record.get(evaluation.impact, 0) + 1
+                if evaluation.impact == "helpful":
+                    record["last_helpful_at"] = now
+                recorded += 1
+            if recorded:
+                self._commit(content_changed=False)
+            return recorded
+
+    def merge(self, keep_id: int, duplicate_ids: list[int]) -> bool:
+        """将重复策略的评估计数合并到保留的策略上，并退役重复策略"""
+        with self._lock:
+            self._refresh()
+            policies = self._data["policies"]
+            keep = policies.get(str(keep_id))
+            if keep is None:
+                return False
+            retired = False
+            for bullet_id in duplicate_ids:
+                record = policies.get(str(bullet_id))
+                if record is None or bullet_id == keep_id:
                     continue
-        indices.sort()
-        with open(LIST_FILE, 'w') as f:
-            for bullet_id in indices:
-                f.write(str(bullet_id) + '\n')
+                for impact in ("helpful", "harmful", "neutral"):
+                    keep[impact] = keep.get(impact, 0) + record.get(impact, 0)
+                helpful_times = [t for t in (keep.get("last_helpful_at"), record.get("last_helpful_at")) if t]
+                keep["last_helpful_at"] = max(helpful_times) if helpful_times else None
+                retired = self._retire_locked(bullet_id, f"duplicate of {keep_id}") or retired
+            self._commit(content_changed=retired)
+            return True
+
+    def retire(self, bullet_id: int, reason: str) -> bool:
+        """退役策略：从可用策略中移除，保留在retired中便于追溯"""
+        with self._lock:
+            self._refresh()
+            if not self._retire_locked(bullet_id, reason):
+                return False
+            self._commit()
+            return True
+
+    def _retire_locked(self, bullet_id: int, reason: str) -> bool:
+        record = self._data["policies"].pop(str(bullet_id), None)
+        if record is None:
+            return False
+        record.update(reason=reason, retired_at=self._now())
+        self._data.setdefault("retired", {})[str(bullet_id)] = record
+        return True
+
+    def grep(self, pattern: str, context_lines: int = 5) -> list[Playbook]:
+        """
+        按正则表达式在内存中搜索策略，每个匹配返回包含上下文的片段
+
+        pattern由模型生成，不是合法的正则表达式时按普通文本搜索，不会让调用它的工具出错
+        """
+        try:
+            regex = re.compile(pattern)
+        except re.error:
+            regex = re.compile(re.escape(pattern))
+        results = []
+        for policy in self.policies():
+            lines = policy.content.splitlines()
+            end = -1
+            for i, line in enumerate(lines):
+                if not regex.search(line) or i <= end:
+                    continue
+                start = max(0, i - context_lines)
+                end = min(len(lines) - 1, i + context_lines)
+                results.append(Playbook(bullet_id=policy.bullet_id, content='\n'.join(lines[start:end + 1])))
+        return results
+
+
+class PlaybookOperator:
+    """
+    策略剧本操作接口，方法可直接注册为Agent的工具
+    """
+
+    def __init__(self, store: PlaybookStore | None = None):
+        self.store = store or PlaybookStore()
+        self._retriever = None
+
+    def create_policy(self, content: str) -> int:
+        """创建策略文件，返回新策略的序号"""
+        return self.store.create(content)
+
+    def get_existing_indices(self) -> list[int]:
+        """获取所有存在的策略文件序号"""
+        return self.store.ids()
 
     def get_next_bullet_id(self):
         """获取下一个可用的序号"""
-        indices = self.get_existing_indices()
-        if not indices:
-            return 1
-        return max(indices) + 1
+        return self.store.next_id()
 
-    @ensure_playbook_dir()
     def read_policy(self, bullet_id:int):
         """读取策略文件内容"""
-        filename = os.path.join(PLAYBOOK_DIR, f'{bullet_id:08d}.txt')
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                return f.read()
-        return None
+        return self.store.get(bullet_id)
 
-    @ensure_playbook_dir()
     def modify_policy(self, bullet_id:int, content: str):
         """修改策略文件内容"""
-        filename = os.path.join(PLAYBOOK_DIR, f'{bullet_id:08d}.txt')
-        if os.path.exists(filename):
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(content)
-            self.update_playbook_list()
-            return True
-        return False
+        return self.store.update(bullet_id, content)
 
-    @ensure_playbook_dir()
     def delete_policy(self, bullet_id:int):
         """删除策略文件"""
-        filename = os.path.join(PLAYBOOK_DIR, f'{bullet_id:08d}.txt')
-        if os.path.exists(filename):
-            os.remove(filename)
-            self.update_playbook_list()
-            return True
-        return False
-    
-    @ensure_playbook_dir()
+        return self.store.delete(bullet_id)
+
     def list_policies(self) -> list[Playbook]:
         """列出所有策略文件"""
-        indices = self.get_existing_indices()
-        policies = []
-        for bullet_id in indices:
-            content = self.read_policy(bullet_id)
-            if content is not None:
-                policies.append(Playbook(bullet_id=bullet_id, content=content))
-        return policies
-    
-    @ensure_playbook_dir()
+        return self.store.policies()
+
+    def relevant_policies(self, question: str, top_k: int | None = None, token_budget: int | None = None) -> list[Playbook]:
+        """按向量相似度挑选与问题相关的策略，用于注入问答提示词"""
+        if self._retriever is None:
+            from playbook_retrieval import PlaybookRetriever
+            self._retriever = PlaybookRetriever(self.store)
+        return self._retriever.retrieve(question, top_k=top_k, token_budget=token_budget)
+
     def grep(self, query: str, context_lines: int = 5) -> list[Playbook]:
         """
         搜索相关内容
 
         Args:
-            query (str): 搜索查询的ripgrep表达式
+            query (str): 搜索查询的正则表达式，不合法时按普通文本搜索
             context_lines (int, optional): 上下文行数，默认5行
-    
+
         Returns:
             list[Playbook]: 包含匹配行的Playbook对象列表
         """
-        policies = []        
-        rg = ripgrepy.Ripgrepy(query, PLAYBOOK_DIR).glob("*.txt")
-        for item in rg.E("utf-8").C(context_lines).json().run().as_dict:
-            bullet_id = int(os.path.basename(item['data']['path']['text'])[:-4])
-            policies.append(Playbook(bullet_id=bullet_id, content=item['data']["lines"]['text']))
-        
-        return policies
+        return self.store.grep(query, context_lines)
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+import zlib
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from playbook import PlaybookStore, PolicyRecord
+from text_utils import normalize_text
+
+# 使用梅森素数2^61-1作为模数
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_HASH_MASK = np.uint64(0xFFFFFFFF)
+
+
+class MinHasher:
+    """
+    对文本的字符shingle集合计算MinHash签名，签名相同位置的比例近似于Jaccard相似度
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> set[str]:
+        text = normalize_text(text)
+        if len(text) <= self.shingle_size:
+            return {text} if text else set()
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, _HASH_MASK, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64)
+        # (a*x+b) mod p 截断到32位；a、x均小于2^32，乘积不会溢出uint64
+        permuted = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _HASH_MASK
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def similarity(left: np.ndarray, right: np.ndarray) -> float:
+        return float(np.mean(left == right))
+
+
+class LSHIndex:
+    """
+    MinHash的局部敏感哈希索引：签名切分为若干band，任一band完全相同即成为候选对
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm必须能被bands整除")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: dict[tuple[int, bytes], list[int]] = {}
+
+    def add(self, key: int, signature: np.ndarray):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            self._buckets.setdefault((band, chunk), []).append(key)
+
+    def candidate_pairs(self) -> set[tuple[int, int]]:
+        pairs = set()
+        for keys in self._buckets.values():
+            for i, left in enumerate(keys):
+                for right in keys[i + 1:]:
+                    pairs.add((min(left, right), max(left, right)))
+        return pairs
+
+
+def find_near_duplicates(
+    policies: dict[int, str],
+    threshold: float = 0.7,
+    hasher: MinHasher | None = None,
+    bands: int = 16,
+) -> list[list[int]]:
+    """
+    查找近似重复的策略
+
+    Args:
+        policies (dict[int, str]): 策略序号到策略内容的映射
+        threshold (float, optional): 估计的Jaccard相似度阈值
+
+    Returns:
+        list[list[int]]: 重复分组，每组至少两个策略序号，组内按序号排序
+    """
+    hasher = hasher or MinHasher()
+    index = LSHIndex(hasher.num_perm, bands)
+    signatures = {}
+    for bullet_id, content in policies.items():
+        signatures[bullet_id] = hasher.signature(content)
+        index.add(bullet_id, signatures[bullet_id])
+
+    parent = {bullet_id: bullet_id for bullet_id in policies}
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for left, right in index.candidate_pairs():
+        if hasher.similarity(signatures[left], signatures[right]) >= threshold:
+            parent[find(left)] = find(right)
+
+    groups: dict[int, list[int]] = {}
+    for bullet_id in policies:
+        groups.setdefault(find(bullet_id), []).append(bullet_id)
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+class CompactionReport(BaseModel):
+    merged: list[tuple[int, list[int]]] = Field(default_factory=list, description="保留的策略序号及被合并的重复策略")
+    retired: list[tuple[int, str]] = Field(default_factory=list, description="退役的策略序号及原因")
+
+    def __str__(self) -> str:
+        lines = [f"合并重复策略 {len(self.merged)} 组，退役策略 {len(self.retired)} 条"]
+        lines += [f"  保留 {keep}，合并 {dropped}" for keep, dropped in self.merged]
+        lines += [f"  退役 {bullet_id}：{reason}" for bullet_id, reason in self.retired]
+        return '\n'.join(lines)
+
+
+class PlaybookCompactor:
+    """
+    策略剧本压缩：合并近似重复的策略，退役有害或长期无用的策略
+    """
+
+    def __init__(
+        self,
+        store: PlaybookStore,
+        duplicate_threshold: float = 0.7,
+        min_harmful: int = 2,
+        stale_days: int = 30,
+        max_policies: int = 50,
+        min_evaluations: int = 3,
+    ):
+        self.store = store
+        self.duplicate_threshold = duplicate_threshold
+        self.min_harmful = min_harmful
+        self.stale_days = stale_days
+        self.max_policies = max_policies
+        # 按相关性检索时很多策略从未被注入、也从未被评估，评估次数不足的策略不按过期退役
+        self.min_evaluations = min_evaluations
+
+    @staticmethod
+    def _score(record: PolicyRecord) -> tuple[int, str, int]:
+        # 净评估分数优先，其次是最近修改时间，最后是内容长度
+        return record.helpful - record.harmful, record.updated_at, len(record.content)
+
+    def _retire_reason(self, record: PolicyRecord, now: datetime) -> str | None:
+        if record.harmful >= self.min_harmful and record.harmful > record.helpful:
+            return f"harmful {record.harmful} > helpful {record.helpful}"
+        if record.helpful + record.harmful + record.neutral < self.min_evaluations:
+            return None
+        last_useful = datetime.fromisoformat(record.last_helpful_at or record.created_at)
+        if now - last_useful > timedelta(days=self.stale_days):
+            return f"stale since {last_useful.date()}"
+        return None
+
+    def compact(self, dry_run: bool = False) -> CompactionReport:
+        report = CompactionReport()
+        records = {record.bullet_id: record for record in self.store.records()}
+
+        groups = find_near_duplicates(
+            {bullet_id: record.content for bullet_id, record in records.items()},
+            threshold=self.duplicate_threshold,
+        )
+        for group in groups:
+            keep = max(group, key=lambda bullet_id: self._score(records[bullet_id]))
+            dropped = [bullet_id for bullet_id in group if bullet_id != keep]
+            report.merged.append((keep, dropped))
+            if not dry_run:
+                self.store.merge(keep, dropped)
+
+        if not dry_run and groups:
+            records = {record.bullet_id: record for record in self.store.records()}
+        merged_away = {bullet_id for _, dropped in report.merged for bullet_id in dropped}
+        now = datetime.now()
+        for bullet_id, record in records.items():
+            if bullet_id in merged_away:
+                continue
+            reason = self._retire_reason(record, now)
+            if reason is None:
+                continue
+            report.retired.append((bullet_id, reason))
+            if not dry_run:
+                self.store.retire(bullet_id, reason)
+        return report
+
+    def maybe_compact(self) -> CompactionReport | None:
+        """策略条数超过阈值时自动压缩"""
+        if len(self.store.ids()) <= self.max_policies:
+            return None
+        return self.compact()
@@ -0,0 +1,136 @@
+import hashlib
+import zlib
+
+import numpy as np
+
+from playbook import Playbook, PlaybookStore
+from text_utils import estimate_tokens, normalize_text
+
+
+class HashedNgramEmbedder:
+    """
+    基于哈希字符n-gram的本地向量化，无需网络和GPU
+
+    文本归一化后取1~3字的字符n-gram，用crc32哈希到固定维度（带符号以抵消碰撞偏差），
+    词频取对数后做L2归一化，余弦相似度即为向量内积
+    """
+
+    def __init__(self, dim: int = 4096, ngram_range: tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def ngrams(self, text: str) -> list[str]:
+        text = normalize_text(text)
+        low, high = self.ngram_range
+        return [text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1)]
+
+    def embed(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(gram.encode('utf-8')) for gram in self.ngrams(text)),
+            dtype=np.uint32,
+        )
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if hashes.size == 0:
+            return vector
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, (hashes % self.dim).astype(np.intp), signs)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class PlaybookRetriever:
+    """
+    从策略剧本中检索与问题相关的策略
+
+    向量按策略内容的哈希缓存，策略剧本修订号变化时只对新增或修改的策略重新向量化，
+    被删除的策略同时移出索引
+    """
+
+    def __init__(
+        self,
+        store: PlaybookStore,
+        embedder: HashedNgramEmbedder | None = None,
+        top_k: int = 5,
+        token_budget: int = 2000,
+        min_score: float = 0.1,
+    ):
+        self.store = store
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self._revision: int | None = None
+        self._entries: dict[int, tuple[str, np.ndarray]] = {}
+        self._policies: dict[int, Playbook] = {}
+        self._ids: list[int] = []
+        self._matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+
+    @staticmethod
+    def _digest(content: str) -> str:
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def sync(self) -> int:
+        """
+        与策略剧本同步向量索引
+
+        Returns:
+            int: 本次重新向量化的策略条数
+        """
+        # 评估计数的变化不影响向量索引
+        revision = self.store.content_revision
+        if revision == self._revision:
+            return 0
+        policies = {policy.bullet_id: policy for policy in self.store.policies()}
+        embedded = 0
+        for bullet_id in list(self._entries):
+            if bullet_id not in policies:
+                del self._entries[bullet_id]
+        for bullet_id, policy in policies.items():
+            digest = self._digest(policy.content)
+            cached = self._entries.get(bullet_id)
+            if cached is None or cached[0] != digest:
+                self._entries[bullet_id] = (digest, self.embedder.embed(policy.content))
+                embedded += 1
+        self._policies = policies
+        self._ids = sorted(self._entries)
+        if self._ids:
+            self._matrix = np.stack([self._entries[bullet_id][1] for bullet_id in self._ids])
+        else:
+            self._matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._revision = revision
+        return embedded
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int | None = None,
+        token_budget: int | None = None,
+    ) -> list[Playbook]:
+        """
+        返回与问题最相关的策略，按相似度从高到低排列
+
+        Args:
+            query (str): 用户问题
+            top_k (int, optional): 最多返回的策略条数
+            token_budget (int, optional): 返回策略内容的token总预算
+        """
+        self.sync()
+        if not self._ids:
+            return []
+        top_k = self.top_k if top_k is None else top_k
+        token_budget = self.token_budget if token_budget is None else token_budget
+
+        scores = self._matrix @ self.embedder.embed(query)
+        selected = []
+        used_tokens = 0
+        for row in np.argsort(-scores, kind='stable'):
+            if len(selected) >= top_k or scores[row] < self.min_score:
+                break
+            policy = self._policies[self._ids[row]]
+            tokens = estimate_tokens(policy.content)
+            if used_tokens + tokens > token_budget:
+                continue
+            selected.append(policy)
+            used_tokens += tokens
+        return selected
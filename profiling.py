@@ -0,0 +1,170 @@
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from typing import Any, ContextManager, Iterator
+
+
+@dataclass
+class StageSample:
+    stage: str
+    label: str
+    index: int
+    seconds: float
+    # 与其他正在采样的阶段重叠时只记录耗时
+    profiled: bool = False
+    profile_path: str | None = None
+    peak_bytes: int = 0
+    retained_bytes: int = 0
+    allocations: list[dict[str, Any]] = field(default_factory=list)
+
+
+class StageProfiler:
+    """
+    按阶段采集cProfile调用统计和tracemalloc内存分配
+
+    每个阶段（一份PDF的转换、一份文档的摘要、一轮问答）单独保存.prof文件，
+    结束时按阶段汇总热点函数和内存分配，写入summary.json和summary.txt。
+    every大于1时每个阶段只采样第1、every+1、2*every+1…次，降低大批量运行时的开销；
+    tracemalloc只在采样期间开启。
+    """
+
+    def __init__(self, output_dir: str = "./profile", every: int = 1, top_n: int = 20, frames: int = 5):
+        self.output_dir = output_dir
+        self.every = max(1, every)
+        self.top_n = top_n
+        self.frames = frames
+        self.samples: list[StageSample] = []
+        self._counts: dict[str, int] = defaultdict(int)
+        self._active = False
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, stage: str, label: str = "") -> Iterator[None]:
+        """
+        采集一次阶段执行，非采样的执行直接运行
+
+        cProfile和tracemalloc都是进程级的，同一时刻只采样一个阶段；
+        并发执行（如多个文档同时摘要）时，重叠的采样只记录耗时，调用统计中也会包含同时运行的其他任务
+        """
+        index = self._counts[stage]
+        self._counts[stage] += 1
+        if index % self.every:
+            yield
+            return
+
+        sample = StageSample(stage=stage, label=label, index=index, seconds=0.0)
+        if self._active:
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                sample.seconds = time.perf_counter() - started
+                self.samples.append(sample)
+            return
+
+        self._active = True
+        profile = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sample.seconds = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+            sample.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+            self._active = False
+
+            sample.profiled = True
+            sample.profile_path = os.path.join(self.output_dir, f"{stage}-{index:04d}.prof")
+            profile.dump_stats(sample.profile_path)
+            diff = after.compare_to(before, "lineno")
+            sample.retained_bytes = sum(stat.size_diff for stat in diff)
+            sample.allocations = [
+                {"location": str(stat.traceback[0]), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in diff[:self.top_n] if stat.size_diff > 0
+            ]
+            self.samples.append(sample)
+
+    def _hotspots(self, profile_paths: list[str], sort: str) -> list[dict[str, Any]]:
+        stats = pstats.Stats(*profile_paths)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2 if sort == "tottime" else 3], reverse=True)
+        hotspots = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in rows[:self.top_n]:
+            hotspots.append({
+                "function": f"{filename}:{line}({function})",
+                "calls": calls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            })
+        return hotspots
+
+    def summary(self) -> dict[str, Any]:
+        """按阶段汇总所有采样"""
+        stages: dict[str, Any] = {}
+        for stage in self._counts:
+            samples = [sample for sample in self.samples if sample.stage == stage]
+            profiled = [sample for sample in samples if sample.profiled]
+            allocations: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+            for sample in profiled:
+                for allocation in sample.allocations:
+                    allocations[allocation["location"]][0] += allocation["size_diff"]
+                    allocations[allocation["location"]][1] += allocation["count_diff"]
+            seconds = [sample.seconds for sample in samples]
+            stages[stage] = {
+                "runs": self._counts[stage],
+                "sampled": len(samples),
+                "profiled": len(profiled),
+                "seconds_total": sum(seconds),
+                "seconds_max": max(seconds, default=0.0),
+                "peak_bytes_max": max((sample.peak_bytes for sample in profiled), default=0),
+                "slowest": max(samples, key=lambda sample: sample.seconds).label if samples else None,
+                "hotspots_tottime": self._hotspots([s.profile_path for s in profiled], "tottime") if profiled else [],
+                "hotspots_cumtime": self._hotspots([s.profile_path for s in profiled], "cumtime") if profiled else [],
+                "allocations": [
+                    {"location": location, "size_diff": size, "count_diff": count}
+                    for location, (size, count) in sorted(allocations.items(), key=lambda item: item[1][0], reverse=True)
+                ][:self.top_n],
+            }
+        return {"every": self.every, "stages": stages, "samples": [asdict(sample) for sample in self.samples]}
+
+    def write_summary(self) -> str:
+        """写入summary.json和summary.txt，返回summary.txt的路径"""
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        lines = []
+        for stage, result in summary["stages"].items():
+            lines.append(f"== {stage}：执行{result['runs']}次，采样{result['sampled']}次，"
+                         f"总耗时{result['seconds_total']:.3f}s，最慢{result['seconds_max']:.3f}s（{result['slowest']}），"
+                         f"峰值内存{result['peak_bytes_max'] / 1024 / 1024:.1f}MiB")
+            lines.append(f"-- 热点函数（按自身耗时，前{self.top_n}）")
+            for row in result["hotspots_tottime"]:
+                lines.append(f"{row['tottime']:10.4f}s {row['cumtime']:10.4f}s {row['calls']:>8} {row['function']}")
+            lines.append(f"-- 内存分配（采样期间新增并保留，前{self.top_n}）")
+            for row in result["allocations"]:
+                lines.append(f"{row['size_diff'] / 1024:10.1f}KiB {row['count_diff']:>8} {row['location']}")
+            lines.append("")
+        path = os.path.join(self.output_dir, "summary.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        return path
+
+
+def profile_stage(profiler: StageProfiler | None, stage: str, label: str = "") -> ContextManager[None]:
+    """未开启分析时返回空的上下文管理器"""
+    return profiler.stage(stage, label) if profiler else nullcontext()
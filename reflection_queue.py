@@ -0,0 +1,283 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Any, Callable, Coroutine
+import uuid
+
+from pydantic_ai import ModelMessage
+from pydantic_ai.messages import ModelMessagesTypeAdapter
+
+logger = logging.getLogger(__name__)
+
+HandleAfterConversation = Callable[[str, list[ModelMessage]], Coroutine[None, Any, None]]
+
+QUEUE_DIR = './reflector/queue'
+
+
+class ReflectionQueue:
+    """
+    对话后反思与整编的持久化有界队列
+
+    - 每个任务落盘为 queue 目录下的一个json文件，处理完成后删除，重启后自动恢复
+    - 同一会话中尚未开始处理的多轮对话合并为一个任务，只触发一次反思
+    - 内存中最多保留maxsize个待处理任务（以及worker正在处理的任务），超出部分在内存中只保留任务ID，
+      任务内容只保存在磁盘上，等队列空闲后再加载
+    - 固定数量的worker在后台执行，不阻塞前台问答
+    - 失败的任务按指数退避（retry_delay * 2^(已失败次数-1)秒）后重试，模型或网络短暂不可用时不会立即耗尽重试次数
+    - 无法解析的任务文件直接改名为.failed，不会让worker退出或阻塞后面的任务
+    - 多个进程（如--question与--serve）共用同一队列目录时，worker先把任务文件改名为.running认领任务，
+      已被其他进程认领的任务直接跳过，每个任务只执行一次；进程异常退出遗留的.running文件
+      超过claim_timeout秒后在下次启动时恢复为待处理任务
+    """
+
+    def __init__(
+        self,
+        handler: HandleAfterConversation,
+        directory: str = QUEUE_DIR,
+        workers: int = 1,
+        maxsize: int = 16,
+        max_attempts: int = 3,
+        retry_delay: float = 5.0,
+        claim_timeout: float = 3600.0,
+    ):
+        self.handler = handler
+        self.directory = Path(directory)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.claim_timeout = claim_timeout
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=maxsize)
+        # 在内存队列中或正在处理的任务内容
+        self._jobs: dict[str, dict[str, Any]] = {}
+        # 所有未完成的任务ID，包括只保存在磁盘上的溢出任务
+        self._pending_ids: set[str] = set()
+        # 会话ID -> 尚未被worker取走的任务ID，用于合并同一会话的多轮对话
+        self._pending_by_session: dict[str, str] = {}
+        self._spilled: deque[str] = deque()
+        self._tasks: list[asyncio.Task] = []
+        # 等待退避时间结束后重新入队的任务
+        self._retries: set[asyncio.Task] = set()
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def _save(self, job: dict[str, Any]):
+        path = self._job_path(job["job_id"])
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id: str) -> dict[str, Any]:
+        with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _running_path(self, job_id: str) -> Path:
+        return self._job_path(job_id).with_suffix('.running')
+
+    def _claim(self, job_id: str) -> bool:
+        """把任务文件改名为.running，返回是否认领成功；改名是原子操作，多个进程中只有一个能成功"""
+        try:
+            os.replace(self._job_path(job_id), self._running_path(job_id))
+        except FileNotFoundError:
+            return False
+        # 改名保留了提交时的mtime，刷新后才能按mtime判断认领是否过期
+        os.utime(self._running_path(job_id))
+        return True
+
+    def _recover_stale_claims(self):
+        """恢复异常退出的进程遗留的认领"""
+        for path in self.directory.glob('*.running'):
+            try:
+                if time.time() - path.stat().st_mtime > self.claim_timeout:
+                    os.replace(path, path.with_suffix('.json'))
+            except FileNotFoundError:
+                # 其他进程同时恢复或已完成该任务
+                continue
+
+    def _discard_failed(self, job_id: str, path: Path | None = None):
+        """任务不再重试，文件改名为.failed保留以便排查"""
+        path = path or self._job_path(job_id)
+        try:
+            os.replace(path, self._job_path(job_id).with_suffix('.failed'))
+        except OSError:
+            logger.exception("无法保留失败的反思任务 %s", job_id)
+        self._forget(job_id)
+
+    def _forget(self, job_id: str):
+        self._jobs.pop(job_id, None)
+        self._pending_ids.discard(job_id)
+        for session_id, pending_id in list(self._pending_by_session.items()):
+            if pending_id == job_id:
+                del self._pending_by_session[session_id]
+
+    def _enqueue(self, job_id: str, job: dict[str, Any] | None = None):
+        self._pending_ids.add(job_id)
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            # 溢出的任务只保留ID，内容在worker处理时从磁盘加载
+            self._spilled.append(job_id)
+        else:
+            if job is not None:
+                self._jobs[job_id] = job
+
+    def _refill(self):
+        while self._spilled and not self._queue.full():
+            self._queue.put_nowait(self._spilled.popleft())
+
+    async def start(self):
+        """加载磁盘上未完成的任务并启动worker"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._recover_stale_claims()
+        for path in sorted(self.directory.glob('*.json')):
+            if path.stem in self._pending_ids:
+                continue
+            try:
+                job = self._load(path.stem)
+            except (OSError, ValueError):
+                logger.exception("无法读取反思任务 %s", path.stem)
+                self._discard_failed(path.stem)
+                continue
+            self._pending_by_session.setdefault(job["session_id"], job["job_id"])
+            delay = job.get("not_before", 0) - time.time()
+            if delay > 0:
+                self._retry_later(job["job_id"], delay)
+            else:
+                self._enqueue(job["job_id"], job)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, session_id: str, objective: str, messages: list[ModelMessage]):
+        """
+        提交一轮对话，立即返回
+
+        Args:
+            session_id (str): 会话ID
+            objective (str): 本轮对话的问题
+            messages (list[ModelMessage]): 本轮对话新增的消息
+        """
+        serialized = ModelMessagesTypeAdapter.dump_python(messages, mode='json')
+        job_id = self._pending_by_session.get(session_id)
+        if job_id is not None and not self._job_path(job_id).exists():
+            # 已被共用队列目录的其他进程认领，本轮对话进入新的任务
+            del self._pending_by_session[session_id]
+            job_id = None
+        if job_id is not None:
+            job = self._jobs.get(job_id) or self._load(job_id)
+            job["objectives"].append(objective)
+            job["messages"].extend(serialized)
+            self._save(job)
+            return
+
+        job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        job = {
+            "job_id": job_id,
+            "session_id": session_id,
+            "objectives": [objective],
+            "messages": serialized,
+            "attempts": 0,
+        }
+        self._save(job)
+        self._pending_by_session[session_id] = job_id
+        self._enqueue(job_id, job)
+
+    def _retry_later(self, job_id: str, delay: float):
+        self._pending_ids.add(job_id)
+        task = asyncio.create_task(self._enqueue_after(job_id, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _enqueue_after(self, job_id: str, delay: float):
+        await asyncio.sleep(delay)
+        self._enqueue(job_id)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending_ids)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                # 任何异常都不能让worker退出，否则后面的任务不再处理
+                logger.exception("处理反思任务 %s 时出错", job_id)
+            finally:
+                # 先补充溢出的任务再标记完成，保证close()中的join()不会提前返回
+                self._refill()
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        if not self._claim(job_id):
+            # 已被共用队列目录的其他进程认领
+            self._forget(job_id)
+            return
+        running_path = self._running_path(job_id)
+        try:
+            with open(running_path, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+            objective = "；".join(job["objectives"])
+            messages = ModelMessagesTypeAdapter.validate_python(job["messages"])
+        except Exception:
+            logger.exception("无法读取反思任务 %s", job_id)
+            self._discard_failed(job_id, running_path)
+            return
+        self._jobs[job_id] = job
+        # 任务开始处理后，同一会话的新对话进入新的任务
+        if self._pending_by_session.get(job["session_id"]) == job_id:
+            del self._pending_by_session[job["session_id"]]
+        try:
+            await self.handler(objective, messages)
+        except asyncio.CancelledError:
+            # 交还认领，下次启动时继续处理
+            os.replace(running_path, self._job_path(job_id))
+            raise
+        except Exception:
+            job["attempts"] += 1
+            logger.exception("反思任务 %s 第%d次执行失败", job_id, job["attempts"])
+            if job["attempts"] < self.max_attempts:
+                delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                # 退避时间写入任务文件，重启后同样等待
+                job["not_before"] = time.time() + delay
+                self._save(job)
+                running_path.unlink(missing_ok=True)
+                del self._jobs[job_id]
+                self._retry_later(job_id, delay)
+                return
+            self._discard_failed(job_id, running_path)
+            return
+        running_path.unlink(missing_ok=True)
+        del self._jobs[job_id]
+        self._pending_ids.discard(job_id)
+
+    async def close(self, timeout: float | None = None):
+        """
+        等待队列处理完毕后停止worker
+
+        Args:
+            timeout (float, optional): 最长等待秒数，超时后未完成的任务保留在磁盘上，下次启动时继续处理
+        """
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            tasks = self._tasks + list(self._retries)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._tasks = []
+
+    async def _drain(self):
+        """等待队列中的任务和等待重试的任务全部完成"""
+        while True:
+            await self._queue.join()
+            if not self._retries:
+                return
+            await asyncio.wait(set(self._retries))
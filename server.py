@@ -0,0 +1,438 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+from dataclasses import dataclass, field
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Callable
+import uuid
+
+from pydantic_ai import Agent, ModelMessage
+
+from answer_cache import AnswerCache
+from chat_history import ConversationHistory
+from insurance_agent import InsuranceAgent
+from playbook import PlaybookOperator
+from reflection_queue import ReflectionQueue
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+# 卸载家庭时等待其反思任务完成的最长秒数，超时后未完成的任务保留在磁盘上
+TENANT_DRAIN_TIMEOUT = 30
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+@dataclass
+class Tenant:
+    """一个家庭（租户）的问答资源，只包含该家庭的文档映射、要素表、策略剧本和答案缓存"""
+    insurance_agent: InsuranceAgent
+    playbook_operator: PlaybookOperator
+    reflection_queue: ReflectionQueue | None = None
+    answer_cache: AnswerCache | None = None
+    # 正在回答的问题数，有问题在回答时不卸载
+    active: int = 0
+
+
+# 按租户ID创建Tenant；租户ID不合法时抛出ValueError，租户不存在时抛出FileNotFoundError
+TenantLoader = Callable[[str], Tenant]
+
+
+@dataclass
+class Session:
+    session_id: str
+    tenant_id: str | None = None
+    history: ConversationHistory = field(default_factory=ConversationHistory)
+    # 同一会话的问题按顺序回答，不同会话之间并发
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_active: float = field(default_factory=time.monotonic)
+
+
+async def stream_answer(
+    agent: Agent,
+    prompt: str,
+    message_history: list[ModelMessage] | None = None,
+) -> AsyncIterator[tuple[str, Any]]:
+    """
+    流式执行一次问答
+
+    Yields:
+        ("delta", str): 新增的回答文本
+        ("result", AgentRunResult): 运行结束后的结果
+    """
+    async with agent.iter(prompt, message_history=message_history) as agent_run:
+        async for node in agent_run:
+            if Agent.is_model_request_node(node):
+                async with node.stream(agent_run.ctx) as handle_stream:
+                    sent = ''
+                    async for content in handle_stream.stream_output(debounce_by=None):
+                        content = str(content)
+                        if content.startswith(sent) and len(content) > len(sent):
+                            yield "delta", content[len(sent):]
+                            sent = content
+        assert agent_run.result is not None
+        yield "result", agent_run.result
+
+
+class InsuranceServer:
+    """
+    本地HTTP/SSE问答服务
+
+    进程常驻，保险代理、文件映射、grep缓存和策略剧本索引都保留在内存中，
+    文件映射与策略剧本在文件变化时自动重新加载。
+
+    提供tenant_loader时服务多个家庭：创建会话或无会话提问时在body中指定tenant，
+    每个家庭的资源在首次使用时通过tenant_loader加载，内存中最多保留max_loaded_tenants个，
+    超出时卸载最久未使用的家庭，单次问答的开销与家庭数量无关。
+
+    接口：
+    - GET    /health                    服务状态
+    - POST   /sessions                  创建会话，返回session_id，多家庭服务时body为{"tenant": "..."}
+    - DELETE /sessions/{id}             删除会话
+    - POST   /sessions/{id}/ask         在会话中提问，body为{"question": "..."}，以SSE流式返回
+    - POST   /ask                       无会话的单次提问，返回格式同上，多家庭服务时body中包含tenant
+    """
+
+    def __init__(
+        self,
+        insurance_agent: InsuranceAgent | None,
+        playbook_operator: PlaybookOperator | None,
+        reflection_queue: ReflectionQueue | None = None,
+        max_sessions: int = 100,
+        session_ttl: float = 3600,
+        answer_cache: AnswerCache | None = None,
+        tenant_loader: TenantLoader | None = None,
+        max_loaded_tenants: int = 8,
+    ):
+        if insurance_agent is None and tenant_loader is None:
+            raise ValueError("需要提供insurance_agent或tenant_loader")
+        # 单户部署的资源，请求中不指定tenant时使用
+        self.default_tenant = (
+            Tenant(insurance_agent, playbook_operator, reflection_queue, answer_cache)
+            if insurance_agent is not None else None
+        )
+        self.tenant_loader = tenant_loader
+        self.max_loaded_tenants = max_loaded_tenants
+        # 已加载的家庭，按最近使用排序
+        self.tenants: OrderedDict[str, Tenant] = OrderedDict()
+        # 已卸载、反思队列仍在收尾的家庭，收尾完成前不重新加载
+        self._draining: dict[str, asyncio.Task] = {}
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.sessions: dict[str, Session] = {}
+        self.stats = {"requests": 0, "questions": 0, "errors": 0, "tenant_loads": 0, "tenant_evictions": 0}
+
+    @staticmethod
+    def _warm_up(tenant: Tenant):
+        tenant.insurance_agent.reload_if_changed()
+        tenant.playbook_operator.relevant_policies("")
+
+    def warm_up(self):
+        """预先加载文件映射和策略剧本向量索引，避免首个请求承担加载开销"""
+        if self.default_tenant:
+            self._warm_up(self.default_tenant)
+
+    async def _tenant(self, tenant_id: str | None) -> Tenant:
+        """返回请求对应的家庭资源，未加载的家庭在此时加载"""
+        if tenant_id is None:
+            if self.default_tenant is None:
+                raise HTTPError(400, "缺少tenant字段")
+            return self.default_tenant
+        if self.tenant_loader is None:
+            raise HTTPError(400, "单户服务不支持tenant字段")
+        if tenant_id in self._draining:
+            await asyncio.shield(self._draining[tenant_id])
+        tenant = self.tenants.get(tenant_id)
+        if tenant is not None:
+            self.tenants.move_to_end(tenant_id)
+            return tenant
+        try:
+            tenant = self.tenant_loader(tenant_id)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        except FileNotFoundError:
+            raise HTTPError(404, "租户不存在")
+        # 先登记再启动反思队列，同一家庭的并发请求不会重复加载
+        self.tenants[tenant_id] = tenant
+        self.stats["tenant_loads"] += 1
+        self._warm_up(tenant)
+        if tenant.reflection_queue:
+            await tenant.reflection_queue.start()
+        self._evict(keep=tenant_id)
+        return tenant
+
+    def _evict(self, keep: str):
+        """超出max_loaded_tenants时卸载最久未使用、且没有问题在回答的家庭"""
+        for tenant_id, tenant in list(self.tenants.items()):
+            if len(self.tenants) <= self.max_loaded_tenants:
+                return
+            if tenant_id == keep or tenant.active:
+                continue
+            del self.tenants[tenant_id]
+            self.stats["tenant_evictions"] += 1
+            if tenant.answer_cache is not None:
+                tenant.answer_cache.flush()
+            if tenant.reflection_queue:
+                # 在后台等待反思任务完成，不中断正在执行的整编
+                task = asyncio.create_task(tenant.reflection_queue.close(timeout=TENANT_DRAIN_TIMEOUT))
+                self._draining[tenant_id] = task
+                task.add_done_callback(lambda done, tenant_id=tenant_id: self._drained(tenant_id, done))
+
+    def _drained(self, tenant_id: str, task: asyncio.Task):
+        if self._draining.get(tenant_id) is task:
+            del self._draining[tenant_id]
+
+    def _loaded_tenants(self) -> list[Tenant]:
+        return ([self.default_tenant] if self.default_tenant else []) + list(self.tenants.values())
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_active > self.session_ttl and not session.lock.locked():
+                del self.sessions[session_id]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        """预热并开始监听，port为0时由系统分配端口"""
+        self.warm_up()
+        if self.default_tenant and self.default_tenant.reflection_queue:
+            await self.default_tenant.reflection_queue.start()
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765):
+        server = await self.start(host, port)
+        print(f"服务已启动：http://{host}:{server.sockets[0].getsockname()[1]}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for tenant in self._loaded_tenants():
+                if tenant.answer_cache is not None:
+                    tenant.answer_cache.flush()
+                if tenant.reflection_queue:
+                    await tenant.reflection_queue.close(timeout=TENANT_DRAIN_TIMEOUT)
+            await asyncio.gather(*self._draining.values(), return_exceptions=True)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "请求头过大")
+        if len(head) > MAX_HEADER_BYTES:
+            raise HTTPError(413, "请求头过大")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "无效的请求行")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HTTPError(400, "无效的Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path.split("?", 1)[0], headers, body
+
+    @staticmethod
+    async def _send_json(writer: asyncio.StreamWriter, status: int, payload: dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    async def _send_event(writer: asyncio.StreamWriter, event: str, payload: dict[str, Any]):
+        data = json.dumps(payload, ensure_ascii=False)
+        writer.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["requests"] += 1
+        try:
+            method, path, _, body = await self._read_request(reader)
+            await self._route(method, path, body, writer)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {"error": e.message})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.exception("处理请求时出错")
+            self.stats["errors"] += 1
+            try:
+                await self._send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"] and method == "GET":
+            payload = {"status": "ok", "sessions": len(self.sessions)}
+            if self.default_tenant:
+                payload.update(self._tenant_status(self.default_tenant))
+            payload.update(self.stats)
+            if self.tenant_loader:
+                payload["tenants"] = {tenant_id: self._tenant_status(tenant) for tenant_id, tenant in self.tenants.items()}
+            await self._send_json(writer, 200, payload)
+        elif parts == ["sessions"] and method == "POST":
+            self._expire_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                raise HTTPError(429, "会话数已达上限")
+            tenant_id = self._parse_tenant(self._parse_json(body))
+            await self._tenant(tenant_id)
+            session = Session(session_id=uuid.uuid4().hex, tenant_id=tenant_id)
+            self.sessions[session.session_id] = session
+            await self._send_json(writer, 201, {"session_id": session.session_id})
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            if self.sessions.pop(parts[1], None) is None:
+                raise HTTPError(404, "会话不存在")
+            await self._send_json(writer, 200, {"deleted": parts[1]})
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "ask" and method == "POST":
+            session = self.sessions.get(parts[1])
+            if session is None:
+                raise HTTPError(404, "会话不存在")
+            question = self._parse_question(self._parse_json(body))
+            await self._ask(question, writer, await self._tenant(session.tenant_id), session)
+        elif parts == ["ask"] and method == "POST":
+            payload = self._parse_json(body)
+            question = self._parse_question(payload)
+            await self._ask(question, writer, await self._tenant(self._parse_tenant(payload)))
+        elif parts and parts[0] in ("health", "sessions", "ask"):
+            raise HTTPError(405, "不支持的请求方法")
+        else:
+            raise HTTPError(404, "接口不存在")
+
+    @staticmethod
+    def _tenant_status(tenant: Tenant) -> dict[str, Any]:
+        tenant.insurance_agent.reload_if_changed()
+        return {
+            "documents": len(tenant.insurance_agent.file_map),
+            "playbook_revision": tenant.playbook_operator.store.revision,
+            "answer_cache": tenant.answer_cache.stats if tenant.answer_cache is not None else None,
+        }
+
+    @staticmethod
+    def _parse_json(body: bytes) -> dict[str, Any]:
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            raise HTTPError(400, "请求体必须是json对象")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "请求体必须是json对象")
+        return payload
+
+    @staticmethod
+    def _parse_question(payload: dict[str, Any]) -> str:
+        question = payload.get("question", "")
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(400, "缺少question字段")
+        return question.strip()
+
+    @staticmethod
+    def _parse_tenant(payload: dict[str, Any]) -> str | None:
+        tenant_id = payload.get("tenant")
+        if tenant_id is not None and not isinstance(tenant_id, str):
+            raise HTTPError(400, "tenant字段必须是字符串")
+        return tenant_id
+
+    async def _ask(self, question: str, writer: asyncio.StreamWriter, tenant: Tenant, session: Session | None = None):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        self.stats["questions"] += 1
+        tenant.active += 1
+        try:
+            if session is None:
+                await self._answer(question, writer, tenant, ConversationHistory(), uuid.uuid4().hex)
+                return
+            async with session.lock:
+                await self._answer(question, writer, tenant, session.history, session.session_id)
+                session.last_active = time.monotonic()
+        finally:
+            tenant.active -= 1
+
+    async def _answer(
+        self,
+        question: str,
+        writer: asyncio.StreamWriter,
+        tenant: Tenant,
+        history: ConversationHistory,
+        session_id: str,
+    ):
+        started = time.perf_counter()
+        message_history = history.for_model()
+        answer_cache = tenant.answer_cache
+        # 缓存的答案不依赖对话上下文，只用于无会话的请求和会话中的第一个问题
+        use_cache = answer_cache is not None and not message_history
+        cache_version = answer_cache.version() if use_cache else None
+        cached = answer_cache.get(question) if use_cache else None
+        if cached:
+            history.add_answer(question, cached.answer)
+            await self._send_event(writer, "delta", {"text": cached.answer})
+            await self._send_event(writer, "done", {
+                "answer": cached.answer,
+                "latency_seconds": round(time.perf_counter() - started, 3),
+                "requests": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cached": True,
+            })
+            return
+        policies = tenant.playbook_operator.relevant_policies(question)
+        prompt = f"执行策略：{policies}\n\n{question}" if policies else question
+        try:
+            async with aclosing(stream_answer(tenant.insurance_agent.agent, prompt, message_history)) as events:
+                async for kind, value in events:
+                    if kind == "delta":
+                        await self._send_event(writer, "delta", {"text": value})
+                        continue
+                    new_messages = value.all_messages()[len(message_history):]
+                    history.add_turn(question, new_messages)
+                    if use_cache:
+                        answer_cache.put(question, str(value.output), cache_version)
+                    if tenant.reflection_queue:
+                        tenant.reflection_queue.submit(session_id, question, new_messages)
+                    usage = value.usage()
+                    await self._send_event(writer, "done", {
+                        "answer": str(value.output),
+                        "latency_seconds": round(time.perf_counter() - started, 3),
+                        "requests": usage.requests,
+                        "input_tokens": usage.input_tokens,
+                        "output_tokens": usage.output_tokens,
+                        "cached": False,
+                    })
+        except ConnectionError:
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.exception("回答问题时出错")
+            await self._send_event(writer, "error", {"error": f"{type(e).__name__}: {e}"})
@@ -0,0 +1,136 @@
+import re
+import time
+
+from rich.live import Live
+from rich.markdown import Markdown
+
+_FENCE_RE = re.compile(r'^\s{0,3}(```|~~~)')
+_LIST_ITEM_RE = re.compile(r'^\s{0,3}([-*+]|\d{1,9}[.)])(\s|$)')
+# 可能开始缩进或列表项的首字符
+_LIST_START_CHARS = ' \t-*+0123456789'
+
+
+def _continues_list(line: str) -> bool:
+    """空行之后的这一行是否仍属于前面的列表（缩进的续行或新的列表项）"""
+    return line[:1] in (' ', '\t') or bool(_LIST_ITEM_RE.match(line))
+
+
+def find_commit_boundary(text: str) -> int:
+    """
+    返回text中最后一个可以安全提交的位置
+
+    提交位置必须位于代码块之外的空行之后，之前的内容已经是完整的markdown块，
+    之后追加的内容不会改变它们的渲染结果；找不到时返回0。
+    列表中的空行（松散列表）要等到下一行不再是缩进或列表项时才能提交，
+    否则同一个列表会被拆成多个列表渲染
+    """
+    boundary = 0
+    # 列表中空行之后的位置，等下一行确定列表是否结束后再提交
+    pending = 0
+    in_fence = False
+    in_list = False
+    after_blank = False
+    fence = ''
+    offset = 0
+    lines = text.split('\n')
+    for i, line in enumerate(lines):
+        # 最后一行可能还没有写完，只有首字符已经不可能开始缩进或列表项时才用来判断列表结束
+        complete = i < len(lines) - 1
+        if pending and line.strip() and (complete or line[0] not in _LIST_START_CHARS):
+            if not _continues_list(line):
+                boundary = pending
+            pending = 0
+        if not complete:
+            break
+        offset += len(line) + 1
+        if not in_fence and line.strip():
+            if _LIST_ITEM_RE.match(line):
+                in_list = True
+            elif after_blank and not _continues_list(line):
+                in_list = False
+            after_blank = False
+        match = _FENCE_RE.match(line)
+        if match:
+            if not in_fence:
+                in_fence, fence = True, match.group(1)
+            elif match.group(1) == fence:
+                in_fence = False
+            continue
+        if not in_fence and not line.strip():
+            after_blank = True
+            if in_list:
+                pending = offset
+            else:
+                boundary = offset
+    return boundary
+
+
+class IncrementalMarkdownRenderer:
+    """
+    流式回答的增量markdown渲染
+
+    已经完整的markdown块只渲染一次并打印到Live区域上方，Live区域只重新渲染尾部未完成的块；
+    尾部的重新解析间隔根据上一次解析耗时自适应调整，回答越长、解析越慢，刷新越稀疏
+    """
+
+    def __init__(
+        self,
+        live: Live,
+        code_theme: str,
+        min_interval: float = 1 / 30,
+        max_interval: float = 0.5,
+        cost_factor: float = 4.0,
+    ):
+        self.live = live
+        self.code_theme = code_theme
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cost_factor = cost_factor
+        self._text = ''
+        self._committed = 0
+        self._rendered_tail: str | None = None
+        self._last_render = 0.0
+        self._interval = min_interval
+
+    def _markdown(self, text: str) -> Markdown:
+        return Markdown(text, code_theme=self.code_theme)
+
+    def _render_tail(self):
+        tail = self._text[self._committed:]
+        if tail == self._rendered_tail:
+            return
+        started = time.perf_counter()
+        self.live.update(self._markdown(tail))
+        cost = time.perf_counter() - started
+        self._rendered_tail = tail
+        self._last_render = time.perf_counter()
+        self._interval = min(self.max_interval, max(self.min_interval, cost * self.cost_factor))
+
+    def update(self, text: str):
+        """
+        接收截至目前的完整回答文本
+
+        Args:
+            text (str): 累积的回答文本（stream_output的输出）
+        """
+        self._text = text
+
+        boundary = self._committed + find_commit_boundary(text[self._committed:])
+        if boundary > self._committed:
+            block = text[self._committed:boundary].strip('\n')
+            self._committed = boundary
+            if block:
+                self.live.console.print(self._markdown(block))
+            self._rendered_tail = None
+            self._render_tail()
+        elif time.perf_counter() - self._last_render >= self._interval:
+            self._render_tail()
+
+    def finish(self):
+        """提交剩余的全部内容，并清空Live区域"""
+        tail = self._text[self._committed:].strip('\n')
+        self.live.update('')
+        if tail:
+            self.live.console.print(self._markdown(tail))
+        self._committed = len(self._text)
+        self._rendered_tail = ''
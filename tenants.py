@@ -0,0 +1,161 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+import re
+
+TENANTS_DIR = './tenants'
+# 租户ID用作目录名，只允许字母、数字、汉字、下划线和连字符
+_TENANT_ID_RE = re.compile(r'[\w-]{1,64}')
+
+
+@dataclass(frozen=True)
+class TenantPaths:
+    """
+    一个家庭（租户）的存储分片：保险合同、处理后的文档与要素表、文档映射、策略剧本、反思队列和答案缓存
+
+    tenant_id为None时对应单户部署，即当前目录下的insurance-docs、processed-docs、map.json等
+    """
+
+    root: Path
+    tenant_id: str | None = None
+
+    @property
+    def pdf_directory(self) -> Path:
+        return self.root / 'insurance-docs'
+
+    @property
+    def output_directory(self) -> Path:
+        return self.root / 'processed-docs'
+
+    @property
+    def map_file(self) -> Path:
+        return self.root / 'map.json'
+
+    @property
+    def playbook_directory(self) -> Path:
+        return self.root / 'playbook'
+
+    @property
+    def reflector_directory(self) -> Path:
+        return self.root / 'reflector'
+
+    @property
+    def reflection_queue_directory(self) -> Path:
+        return self.reflector_directory / 'queue'
+
+    @property
+    def answer_cache_directory(self) -> Path:
+        return self.root / 'answer-cache'
+
+    @property
+    def label(self) -> str:
+        return self.tenant_id or '默认'
+
+
+def validate_tenant_id(tenant_id: str) -> str:
+    if not isinstance(tenant_id, str) or not _TENANT_ID_RE.fullmatch(tenant_id):
+        raise ValueError(f"无效的租户ID：{tenant_id!r}，只能包含字母、数字、汉字、下划线和连字符")
+    return tenant_id
+
+
+def tenant_paths(tenant_id: str | None = None, tenants_directory: str = TENANTS_DIR) -> TenantPaths:
+    """
+    返回租户的存储分片路径，tenant_id为None时返回单户部署的路径
+
+    Raises:
+        ValueError: 租户ID不合法（防止通过ID访问其他目录）
+    """
+    if tenant_id is None:
+        return TenantPaths(Path('.'))
+    return TenantPaths(Path(tenants_directory) / validate_tenant_id(tenant_id), tenant_id)
+
+
+def list_tenants(tenants_directory: str = TENANTS_DIR) -> list[str]:
+    """列出已有保险合同或文档映射的租户"""
+    base = Path(tenants_directory)
+    if not base.is_dir():
+        return []
+    return sorted(
+        path.name for path in base.iterdir()
+        if path.is_dir() and _TENANT_ID_RE.fullmatch(path.name)
+        and ((path / 'insurance-docs').is_dir() or (path / 'map.json').exists())
+    )
+
+
+def resolve_document_path(map_file: Path, txt_path: str) -> Path:
+    """
+    map.json中的txt_path相对于map.json所在目录（即租户根目录），绝对路径原样返回
+
+    单户部署时map.json位于工作目录，与原来相对于工作目录的行为一致
+    """
+    path = Path(txt_path)
+    return path if path.is_absolute() else map_file.parent / path
+
+
+class TenantScheduler:
+    """
+    多个租户共享的全局并发上限
+
+    名额空闲时按租户轮转分配给等待中的任务，文档多的家庭不会长时间占满名额，
+    其他家庭的摘要和要素提取不必等它全部完成。
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._running = 0
+        # 租户ID -> 等待中的任务，字典顺序即轮转顺序
+        self._waiters: dict[str, deque[asyncio.Future]] = {}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    async def acquire(self, tenant_id: str):
+        if self._running < self.concurrency and not self._waiters:
+            self._running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(tenant_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分到名额后被取消，转交给下一个任务
+                self.release()
+            else:
+                waiters = self._waiters.get(tenant_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[tenant_id]
+            raise
+
+    def release(self):
+        while self._waiters:
+            tenant_id = next(iter(self._waiters))
+            waiters = self._waiters.pop(tenant_id)
+            future = waiters.popleft()
+            if waiters:
+                # 移到末尾，下一个名额分给其他租户
+                self._waiters[tenant_id] = waiters
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def limiter(self, tenant_id: str) -> 'TenantLimiter':
+        """返回租户的限流器，用法与asyncio.Semaphore相同"""
+        return TenantLimiter(self, tenant_id)
+
+
+class TenantLimiter:
+    def __init__(self, scheduler: TenantScheduler, tenant_id: str):
+        self.scheduler = scheduler
+        self.tenant_id = tenant_id
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.tenant_id)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler.release()
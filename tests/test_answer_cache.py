@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from answer_cache import AnswerCache, normalize_question
+from batch import run_batch
+from chat_history import ConversationHistory
+from insurance_agent import InsuranceAgent
+from playbook import PlaybookEvaluation, PlaybookOperator, PlaybookStore
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.versions = {"catalog": "v1", "playbook": 1}
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_cache(self, **kwargs) -> AnswerCache:
+        return AnswerCache(
+            lambda: self.versions["catalog"],
+            lambda: self.versions["playbook"],
+            directory=os.path.join(self.tmp.name, "cache"),
+            **kwargs,
+        )
+
+    def test_normalized_forms_share_an_entry(self):
+        self.assertEqual(normalize_question(" 我的重疾險保額是多少？ "), normalize_question("我的重疾险保额是多少"))
+        self.cache.put("我的重疾险保额是多少", "50万元")
+        for question in ["我的重疾险保额是多少？", "我的 重疾險 保額是多少?", "我的重疾险保额是多少！！"]:
+            cached = self.cache.get(question)
+            self.assertIsNotNone(cached, question)
+            self.assertEqual(cached.answer, "50万元")
+        self.assertIsNone(self.cache.get("我的医疗险保额是多少"))
+        self.assertEqual(self.cache.stats["hits"], 3)
+        self.assertEqual(self.cache.stats["misses"], 1)
+
+    def test_version_change_invalidates_entries(self):
+        self.cache.put("重疾险保额", "50万元")
+        self.versions["playbook"] = 2
+        self.assertIsNone(self.cache.get("重疾险保额"))
+        self.assertEqual(self.cache.stats["invalidated"], 1)
+
+        self.cache.put("重疾险保额", "50万元")
+        self.versions["catalog"] = "v2"
+        self.assertIsNone(self.cache.get("重疾险保额"))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_answer_from_previous_version_is_not_stored(self):
+        version = self.cache.version()
+        self.assertIsNone(self.cache.get("重疾险保额"))
+        # 回答期间重新提取了要素，答案依据的是旧版本的数据
+        self.versions["catalog"] = "v2"
+        self.cache.put("重疾险保额", "50万元", version)
+        self.assertIsNone(self.cache.get("重疾险保额"))
+        self.assertEqual(self.cache.stats["stale"], 1)
+
+        version = self.cache.version()
+        self.cache.put("重疾险保额", "80万元", version)
+        self.assertEqual(self.cache.get("重疾险保额").answer, "80万元")
+
+    def test_entries_persist_across_instances(self):
+        self.cache.put("重疾险保额", "50万元")
+        # 写入在后台合并执行，flush()之前不落盘
+        self.assertFalse(os.path.exists(self.cache.path))
+        self.cache.flush()
+        other = self.make_cache()
+        self.assertEqual(other.get("重疾险保额").answer, "50万元")
+        self.versions["catalog"] = "v2"
+        self.assertIsNone(self.make_cache().get("重疾险保额"))
+
+    def test_background_flush_coalesces_writes(self):
+        cache = self.make_cache(flush_delay=0.05)
+        for i in range(5):
+            cache.put(f"问题{i}", f"答案{i}")
+        deadline = time.monotonic() + 2
+        while not os.path.exists(cache.path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with open(cache.path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)["entries"]), 5)
+
+    def test_reflection_keeps_entries(self):
+        store = PlaybookStore(os.path.join(self.tmp.name, "playbook"))
+        bullet_id = store.create("先查询要素表")
+        cache = AnswerCache(lambda: "v1", lambda: store.content_revision, directory=os.path.join(self.tmp.name, "cache"))
+        cache.put("重疾险保额", "50万元")
+        # 反思只累加评估计数，策略内容不变
+        store.record_evaluations([PlaybookEvaluation(bullet_id=bullet_id, impact="helpful")])
+        self.assertEqual(cache.get("重疾险保额").answer, "50万元")
+        store.update(bullet_id, "先grep合同")
+        self.assertIsNone(cache.get("重疾险保额"))
+
+    def test_similarity_threshold(self):
+        self.cache.put("我的重疾险保额是多少", "50万元")
+        self.assertIsNone(self.cache.get("我的重疾险的保额是多少呀"))
+        self.cache.flush()
+        similar = self.make_cache(similarity_threshold=0.7)
+        cached = similar.get("我的重疾险的保额是多少呀")
+        self.assertIsNotNone(cached)
+        self.assertLess(cached.similarity, 1.0)
+        self.assertEqual(cached.question, "我的重疾险保额是多少")
+        self.assertIsNone(similar.get("家里的车险什么时候到期"))
+        self.assertEqual(similar.stats["similar_hits"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = self.make_cache(max_entries=2)
+        cache.put("问题一", "答案一")
+        cache.put("问题二", "答案二")
+        cache.get("问题一")
+        cache.put("问题三", "答案三")
+        self.assertIsNone(cache.get("问题二"))
+        self.assertIsNotNone(cache.get("问题一"))
+
+    def test_history_records_cached_answer(self):
+        history = ConversationHistory()
+        history.add_answer("重疾险保额", "50万元")
+        messages = history.for_model()
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[-1].text, "50万元")
+
+
+class TestCatalogVersion(unittest.TestCase):
+    def test_changes_with_map_and_facts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            map_file = os.path.join(tmp, "map.json")
+            docs = os.path.join(tmp, "processed-docs")
+            os.makedirs(docs)
+            agent = InsuranceAgent(map_file, docs)
+            empty = agent.catalog_version()
+            with open(map_file, "w", encoding="utf-8") as f:
+                json.dump({"合同": {"txt_path": "processed-docs/合同.txt"}}, f, ensure_ascii=False)
+            with_map = agent.catalog_version()
+            self.assertNotEqual(empty, with_map)
+            self.assertEqual(agent.catalog_version(), with_map)
+            with open(os.path.join(docs, "facts.json"), "w", encoding="utf-8") as f:
+                json.dump({"format": 1, "columns": {}}, f)
+            self.assertNotEqual(agent.catalog_version(), with_map)
+
+
+class TestBatchAnswerCache(unittest.IsolatedAsyncioTestCase):
+    async def test_repeated_questions_hit_cache(self):
+        calls = []
+
+        async def answer(messages, info: AgentInfo) -> ModelResponse:
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ModelResponse(parts=[TextPart(content="保额50万元")])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            input_path = os.path.join(tmp, "questions.jsonl")
+            output_path = os.path.join(tmp, "answers.jsonl")
+            with open(input_path, "w", encoding="utf-8") as f:
+                for question in ["我的重疾险保额是多少", "我的重疾險保額是多少？", "我的重疾险 保额是多少"]:
+                    f.write(json.dumps({"question": question}, ensure_ascii=False) + "\n")
+            operator = PlaybookOperator(PlaybookStore(os.path.join(tmp, "playbook")))
+            cache = AnswerCache(lambda: "v1", lambda: operator.store.content_revision, directory=os.path.join(tmp, "cache"))
+            with redirect_stderr(StringIO()):
+                stats = await run_batch(Agent(FunctionModel(answer)), operator, input_path, output_path,
+                                        concurrency=1, answer_cache=cache)
+            with open(output_path, "r", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(stats["cache_hits"], 2)
+        self.assertEqual([r["cached"] for r in records], [False, True, True])
+        self.assertTrue(all(r["answer"] == "保额50万元" for r in records))
+
+
+if __name__ == "__main__":
+    unittest.main()
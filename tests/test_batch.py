@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from batch import run_batch
+from playbook import PlaybookOperator, PlaybookStore
+
+
+class TestBatch(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp.name, "questions.jsonl")
+        self.output_path = os.path.join(self.tmp.name, "answers.jsonl")
+        with open(self.input_path, "w", encoding="utf-8") as f:
+            for i in range(8):
+                f.write(json.dumps({"question": f"问题{i}", "household": "张家"}, ensure_ascii=False) + "\n")
+        self.operator = PlaybookOperator(PlaybookStore(os.path.join(self.tmp.name, "playbook")))
+        self.active, self.peak = 0, 0
+        self.agent = Agent(FunctionModel(self.slow_answer))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def slow_answer(self, messages, info: AgentInfo) -> ModelResponse:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.05)
+        self.active -= 1
+        if "出错" in messages[-1].parts[-1].content:
+            raise RuntimeError("模型不可用")
+        return ModelResponse(parts=[TextPart(content="保额50万元")])
+
+    def read_records(self) -> list[dict]:
+        with open(self.output_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    async def test_concurrent_batch(self):
+        stats = await run_batch(self.agent, self.operator, self.input_path, self.output_path, concurrency=4)
+
+        # 同时进行的问答数达到并发上限，且不超过上限
+        self.assertEqual(self.peak, 4)
+        self.assertEqual(stats["questions"], 8)
+        self.assertEqual(stats["errors"], 0)
+        records = self.read_records()
+        self.assertEqual(sorted(r["id"] for r in records), list(range(1, 9)))
+        for record in records:
+            self.assertEqual(record["answer"], "保额50万元")
+            self.assertEqual(record["household"], "张家")
+            self.assertEqual(record["requests"], 1)
+            self.assertGreater(record["input_tokens"], 0)
+            self.assertGreater(record["latency_seconds"], 0)
+
+    async def test_invalid_lines_and_errors_do_not_stop_batch(self):
+        with open(self.input_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"question": "保额多少"}, ensure_ascii=False) + "\n")
+            f.write("{\"question\": \n")
+            f.write(json.dumps({"household": "张家"}, ensure_ascii=False) + "\n")
+            f.write(json.dumps({"question": "出错的问题"}, ensure_ascii=False) + "\n")
+        stats = await run_batch(self.agent, self.operator, self.input_path, self.output_path)
+
+        self.assertEqual(stats["questions"], 4)
+        self.assertEqual(stats["errors"], 3)
+        records = {record["id"]: record for record in self.read_records()}
+        self.assertEqual(records[1]["answer"], "保额50万元")
+        self.assertIn("第2行", records[2]["error"])
+        self.assertIn("第3行", records[3]["error"])
+        self.assertTrue(records[4]["error"].startswith("RuntimeError"))
+        # 所有记录的字段相同，出错记录的token用量为0
+        keys = {"id", "answer", "latency_seconds", "requests", "input_tokens", "output_tokens", "cached", "error"}
+        for record in records.values():
+            self.assertLessEqual(keys, set(record))
+        self.assertEqual(records[4]["input_tokens"], 0)
+        self.assertIsNone(records[2]["latency_seconds"])
+
+
+if __name__ == '__main__':
+    unittest.main()
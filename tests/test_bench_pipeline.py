@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.bench_pipeline import compare, run
+from benchmarks.corpus import generate_corpus
+from pdf_converter import PDFToTxtConverter
+
+
+class TestSyntheticCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_generated_pdf_converts_to_chinese_text(self):
+        corpus = generate_corpus(self.root / "insurance-docs", documents=3, pages=2, seed=1)
+        self.assertEqual(corpus["pages"], 6)
+
+        map_file = self.root / "processed-docs" / "map.json"
+        converter = PDFToTxtConverter(str(self.root / "insurance-docs"), str(self.root / "processed-docs"), str(map_file))
+        converter.process_all_pdfs()
+
+        with open(map_file, 'r', encoding='utf-8') as f:
+            file_map = json.load(f)
+        self.assertEqual(len(file_map), 3)
+        for contract in corpus["contracts"]:
+            entry = file_map[contract["title"]]
+            self.assertEqual(len(entry["sha1_hash"]), 40)
+            text = (self.root / "processed-docs" / f"{contract['title']}.txt").read_text(encoding="utf-8")
+            self.assertIn(f"投保人：{contract['holder']}", text)
+            self.assertIn(f"保险金额：{contract['sum_insured']}元", text)
+
+    def test_same_seed_generates_same_corpus(self):
+        first = generate_corpus(self.root / "a", documents=2, pages=1, seed=7)
+        second = generate_corpus(self.root / "b", documents=2, pages=1, seed=7)
+        for a, b in zip(first["contracts"], second["contracts"]):
+            self.assertEqual(Path(a["pdf_path"]).read_bytes(), Path(b["pdf_path"]).read_bytes())
+
+
+class TestBenchPipeline(unittest.TestCase):
+    def test_run_reports_every_stage(self):
+        cwd = os.getcwd()
+        results = run(documents=2, pages=1, model_delay=0, turns=2)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(set(results["stages"]), {"convert", "search", "abstract", "question"})
+        self.assertGreater(results["stages"]["convert"]["pages_per_second"], 0)
+        self.assertEqual(results["stages"]["abstract"]["model_requests"], 2)
+        self.assertEqual(results["stages"]["question"]["turns"], 2)
+        # 结果必须可以序列化为JSON，以便与其他提交的结果对比
+        ratios = compare(json.loads(json.dumps(results)), results)
+        self.assertAlmostEqual(ratios["convert"]["pages_per_second"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from chat_history import ConversationHistory
+
+
+def turn(question: str, tool_output: str, answer: str, call_id: str):
+    return [
+        ModelRequest(parts=[UserPromptPart(content=f"执行策略：[很长的策略列表]\n\n{question}")]),
+        ModelResponse(parts=[ToolCallPart(tool_name="grep", args={"query": "保额"}, tool_call_id=call_id)]),
+        ModelRequest(parts=[ToolReturnPart(tool_name="grep", content=tool_output, tool_call_id=call_id)]),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ]
+
+
+class TestConversationHistory(unittest.TestCase):
+    def test_strip_playbook_prefix_and_truncate_tool_output(self):
+        history = ConversationHistory(max_tool_chars=100)
+        messages = turn("重疾险保额是多少", "保险金额" * 500, "50万元", "call-1")
+        history.add_turn("重疾险保额是多少", messages)
+
+        compacted = history.for_model()
+        self.assertEqual(compacted[0].parts[0].content, "重疾险保额是多少")
+        tool_return = compacted[2].parts[0]
+        self.assertLess(len(tool_return.content), 200)
+        self.assertIn("call-1", tool_return.content)
+        # 完整轨迹保持不变
+        self.assertEqual(history.trace, messages)
+        self.assertEqual(len(history.trace[2].parts[0].content), 2000)
+
+    def test_fold_old_turns_over_budget(self):
+        history = ConversationHistory(token_budget=300, max_tool_chars=200, keep_recent_turns=1)
+        for i in range(5):
+            history.add_turn(f"问题{i}", turn(f"问题{i}", "条款内容" * 100, f"回答{i}", f"call-{i}"))
+
+        compacted = history.for_model()
+        self.assertIn("此前对话摘要", compacted[0].parts[0].content)
+        self.assertIn("回答3", compacted[0].parts[0].content)
+        self.assertEqual(compacted[2].parts[0].content, "问题4")
+        self.assertLessEqual(history.tokens, 300)
+        self.assertEqual(len(history.trace), 20)
+
+    def test_within_budget_keeps_all_turns(self):
+        history = ConversationHistory()
+        for i in range(3):
+            history.add_turn(f"问题{i}", turn(f"问题{i}", "短输出", f"回答{i}", f"call-{i}"))
+        self.assertEqual(len(history.for_model()), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from fact_agent import FactAgent
+from fact_table import FactFilter, FactTable, PolicyFacts
+from insurance_agent import InsuranceAgent
+
+
+def sample_table(directory: str) -> FactTable:
+    table = FactTable(directory)
+    table.replace_document("张三重疾险", "a" * 40, [
+        PolicyFacts(policy_holder="张三", insured="张三", product="重疾险", sum_insured=500000,
+                    premium=12000, payment_frequency="年交", payment_years=20, expiry_date="终身"),
+    ])
+    table.replace_document("李四医疗险", "b" * 40, [
+        PolicyFacts(policy_holder="张三", insured="李四", product="医疗险", sum_insured=2000000,
+                    premium=100, payment_frequency="月交", payment_years=1, expiry_date="2026-03-01"),
+        PolicyFacts(policy_holder="张三", insured="李四", product="意外险附加险", sum_insured=100000,
+                    premium=300, payment_frequency="趸交", payment_years=1, expiry_date="2025-12-31"),
+    ])
+    return table
+
+
+class TestFactTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.table = sample_table(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_total_annual_premium(self):
+        result = self.table.query(aggregate="sum", value_column="annual_premium")
+        # 月交按12期折算，趸交不计入年缴保费
+        self.assertEqual(result, [{"sum(annual_premium)": 12000 + 1200 + 0, "count": 3}])
+
+    def test_group_by_insured(self):
+        result = self.table.query(group_by="insured", aggregate="count")
+        self.assertEqual(result, [{"insured": "张三", "count": 1}, {"insured": "李四", "count": 2}])
+
+    def test_filter_and_order_by_expiry_date(self):
+        rows = self.table.query(
+            filters=[FactFilter(column="expiry_date", op="<", value="2026-12-31")],
+            columns=["product", "expiry_date"],
+            order_by="expiry_date",
+        )
+        self.assertEqual(rows, [
+            {"product": "意外险附加险", "expiry_date": "2025-12-31"},
+            {"product": "医疗险", "expiry_date": "2026-03-01"},
+        ])
+        rows = self.table.query(filters=[FactFilter(column="sum_insured", op=">=", value="1000000")], columns=["title"])
+        self.assertEqual(rows, [{"title": "李四医疗险"}])
+
+    def test_replace_document_and_reload(self):
+        self.table.replace_document("李四医疗险", "c" * 40, [PolicyFacts(insured="李四", product="医疗险")])
+        self.table.save()
+        reloaded = FactTable(self.tmp.name)
+        self.assertEqual(len(reloaded), 2)
+        self.assertEqual(reloaded.sha1_hashes(), {"a" * 40, "c" * 40})
+
+    def test_empty_documents_and_prune(self):
+        self.table.replace_document("免责声明", "d" * 40, [])
+        self.table.save()
+        reloaded = FactTable(self.tmp.name)
+        self.assertEqual(len(reloaded), 3)
+        self.assertIn("d" * 40, reloaded.sha1_hashes())
+
+        self.assertEqual(reloaded.prune(["张三重疾险"]), 3)
+        self.assertEqual(reloaded.sha1_hashes(), {"a" * 40})
+        self.assertEqual(reloaded.query(columns=["title"]), [{"title": "张三重疾险"}])
+
+    def test_invalid_queries(self):
+        with self.assertRaises(ValueError):
+            self.table.query(columns=["premium_total"])
+        with self.assertRaises(ValueError):
+            self.table.query(aggregate="sum")
+        with self.assertRaises(ValueError):
+            self.table.query(filters=[FactFilter(column="premium", op=">", value="很多")])
+
+
+class TestFactExtraction(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.docs = os.path.join(self.tmp.name, "processed-docs")
+        os.makedirs(self.docs)
+        self.map_file = os.path.join(self.tmp.name, "map.json")
+        file_map = {}
+        for i, (holder, amount) in enumerate([("张三", "50万元"), ("李四", "30万元")]):
+            path = os.path.join(self.docs, f"合同{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"投保人：{holder}\n保险金额：{amount}\n" + "条款内容。\n" * 2000 + "保险期间：终身\n")
+            file_map[f"合同{i}"] = {"txt_path": path, "title": f"合同{i}", "abstract": "", "sha1_hash": str(i) * 40}
+        with open(self.map_file, "w", encoding="utf-8") as f:
+            json.dump(file_map, f, ensure_ascii=False)
+        self.prompts = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def extract(self, messages, info: AgentInfo) -> ModelResponse:
+        prompt = messages[-1].parts[-1].content
+        self.prompts.append(prompt)
+        holder = re.search(r"投保人：(\S+)", prompt).group(1)
+        amount = int(re.search(r"保险金额：(\d+)万元", prompt).group(1)) * 10000
+        facts = [{"policy_holder": holder, "insured": holder, "sum_insured": amount,
+                  "premium": 1000, "payment_frequency": "年交", "expiry_date": "终身"}]
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"response": facts})])
+
+    def test_extract_then_query_from_insurance_agent(self):
+        agent = FactAgent(self.map_file, self.docs)
+        agent.agent.model = FunctionModel(self.extract)
+        with redirect_stdout(StringIO()):
+            asyncio.run(agent.process_all_documents())
+        self.assertEqual(len(agent.table), 2)
+        # 只发送合同开头和包含关键词的行
+        self.assertTrue(all("保险期间：终身" in prompt and len(prompt) < 5000 for prompt in self.prompts))
+
+        # 再次运行时跳过已提取的文档
+        agent = FactAgent(self.map_file, self.docs)
+        agent.agent.model = FunctionModel(self.extract)
+        with redirect_stdout(StringIO()):
+            asyncio.run(agent.process_all_documents())
+        self.assertEqual(len(self.prompts), 2)
+
+        insurance_agent = InsuranceAgent(self.map_file, self.docs)
+        result = json.loads(insurance_agent.query_facts(aggregate="sum", value_column="sum_insured"))
+        self.assertEqual(result, [{"sum(sum_insured)": 800000, "count": 2}])
+        self.assertIn("query_facts", insurance_agent._instructions())
+        self.assertTrue(insurance_agent.query_facts(columns=["unknown"]).startswith("查询出错"))
+
+    def test_documents_without_facts_and_removed_documents(self):
+        def extract(messages, info: AgentInfo) -> ModelResponse:
+            prompt = messages[-1].parts[-1].content
+            self.prompts.append(prompt)
+            # 合同1不是保单，没有要素
+            facts = [{"policy_holder": "张三"}] if "张三" in prompt else []
+            return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"response": facts})])
+
+        for _ in range(2):
+            agent = FactAgent(self.map_file, self.docs)
+            agent.agent.model = FunctionModel(extract)
+            with redirect_stdout(StringIO()):
+                asyncio.run(agent.process_all_documents())
+        # 没有要素的文档也只提取一次
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(len(agent.table), 1)
+
+        with open(self.map_file, "w", encoding="utf-8") as f:
+            json.dump({}, f)
+        agent = FactAgent(self.map_file, self.docs)
+        with redirect_stdout(StringIO()):
+            asyncio.run(agent.process_all_documents())
+        table = FactTable(self.docs)
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.sha1_hashes(), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
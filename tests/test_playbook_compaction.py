@@ -0,0 +1,95 @@
+import os
+import tempfile
+import time
+import unittest
+
+from playbook import PlaybookEvaluation, PlaybookStore
+from playbook_compaction import PlaybookCompactor, find_near_duplicates
+
+POLICY = (
+    "# 目的：查询重疾险保额\n"
+    "## 思考（Reasoning）\n需要在file map中找到重大疾病保险的合同文本。\n"
+    "## 行动步骤（Actions）\n### 步骤1：grep保险金额，context_lines设置为10。\n"
+)
+
+
+class TestPlaybookCompaction(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = PlaybookStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_find_near_duplicates(self):
+        groups = find_near_duplicates({
+            1: POLICY,
+            2: POLICY.replace("10", "20"),
+            3: "# 目的：列出所有保单\n按照file map的信息，列出已知的所有保单。",
+        })
+        self.assertEqual(groups, [[1, 2]])
+
+    def test_record_evaluations(self):
+        bullet_id = self.store.create(POLICY)
+        recorded = self.store.record_evaluations([
+            PlaybookEvaluation(bullet_id=bullet_id, impact="helpful"),
+            PlaybookEvaluation(bullet_id=bullet_id, impact="harmful"),
+            PlaybookEvaluation(bullet_id=999, impact="helpful"),
+        ])
+        self.assertEqual(recorded, 2)
+        record = self.store.records()[0]
+        self.assertEqual((record.helpful, record.harmful), (1, 1))
+        self.assertIsNotNone(record.last_helpful_at)
+
+    def test_compact_merges_and_retires(self):
+        first = self.store.create(POLICY)
+        second = self.store.create(POLICY.replace("10", "20"))
+        harmful = self.store.create("# 目的：直接回答\n不要使用grep工具，凭经验回答即可。")
+        self.store.record_evaluations(
+            [PlaybookEvaluation(bullet_id=second, impact="helpful")]
+            + [PlaybookEvaluation(bullet_id=first, impact="helpful")] * 2
+            + [PlaybookEvaluation(bullet_id=harmful, impact="harmful")] * 2
+        )
+
+        report = PlaybookCompactor(self.store).compact()
+        self.assertEqual(report.merged, [(first, [second])])
+        self.assertEqual([bullet_id for bullet_id, _ in report.retired], [harmful])
+        records = self.store.records()
+        self.assertEqual([record.bullet_id for record in records], [first])
+        self.assertEqual(records[0].helpful, 3)
+
+    def test_unevaluated_policies_are_not_stale(self):
+        # 旧版策略文件的创建时间取自文件mtime，导入后没有任何评估
+        with open(os.path.join(self.tmp.name, "00000001.txt"), "w", encoding="utf-8") as f:
+            f.write(POLICY)
+        old = time.time() - 90 * 86400
+        os.utime(os.path.join(self.tmp.name, "00000001.txt"), (old, old))
+        store = PlaybookStore(self.tmp.name)
+        neutral = store.create("# 目的：列出所有保单\n按照file map的信息，列出已知的所有保单。")
+        store.record_evaluations([PlaybookEvaluation(bullet_id=neutral, impact="neutral")] * 3)
+
+        report = PlaybookCompactor(store, stale_days=30).compact()
+        self.assertEqual(report.retired, [])
+        self.assertEqual(store.ids(), [1, neutral])
+        # 评估次数足够且长期没有帮助的策略才会退役
+        report = PlaybookCompactor(store, stale_days=-1).compact()
+        self.assertEqual([bullet_id for bullet_id, _ in report.retired], [neutral])
+
+    def test_dry_run_does_not_modify(self):
+        self.store.create(POLICY)
+        self.store.create(POLICY)
+        revision = self.store.revision
+        report = PlaybookCompactor(self.store).compact(dry_run=True)
+        self.assertEqual(len(report.merged), 1)
+        self.assertEqual(self.store.revision, revision)
+
+    def test_maybe_compact_threshold(self):
+        self.store.create(POLICY)
+        self.store.create(POLICY)
+        self.assertIsNone(PlaybookCompactor(self.store, max_policies=2).maybe_compact())
+        self.assertIsNotNone(PlaybookCompactor(self.store, max_policies=1).maybe_compact())
+        self.assertEqual(len(self.store.ids()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from playbook import PlaybookStore
+from playbook_retrieval import HashedNgramEmbedder, PlaybookRetriever
+
+
+class TestPlaybookRetrieval(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = PlaybookStore(self.tmp.name)
+        self.retriever = PlaybookRetriever(self.store, top_k=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_embedding_is_normalized_and_deterministic(self):
+        embedder = HashedNgramEmbedder(dim=256)
+        vector = embedder.embed("重疾险的保额是多少？")
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+        np.testing.assert_array_equal(vector, embedder.embed("重疾险的保额是多少"))
+
+    def test_retrieve_most_relevant(self):
+        self.store.create("# 目的：查询重疾险保额\n先在file map中找到重大疾病保险，再grep保险金额")
+        self.store.create("# 目的：列出所有保单\n按照file map列出已知保单")
+        self.store.create("# 目的：计算年缴保费合计\n逐个保单grep保费并求和")
+
+        results = self.retriever.retrieve("我的重疾险保额是多少")
+        self.assertEqual(results[0].bullet_id, 1)
+        self.assertLessEqual(len(results), 2)
+
+    def test_token_budget(self):
+        self.store.create("重疾险保额" + "说明" * 500)
+        self.store.create("重疾险保额查询步骤")
+        results = self.retriever.retrieve("重疾险保额", token_budget=50)
+        self.assertEqual([p.bullet_id for p in results], [2])
+
+    def test_incremental_sync(self):
+        first = self.store.create("查询重疾险保额")
+        self.store.create("列出所有保单")
+        self.assertEqual(self.retriever.sync(), 2)
+        self.assertEqual(self.retriever.sync(), 0)
+
+        self.store.update(first, "查询医疗险免赔额")
+        self.assertEqual(self.retriever.sync(), 1)
+        self.store.delete(first)
+        self.assertEqual(self.retriever.sync(), 0)
+        self.assertNotIn(first, [p.bullet_id for p in self.retriever.retrieve("医疗险免赔额")])
+
+
+if __name__ == '__main__':
+    unittest.main()
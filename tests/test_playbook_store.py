@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from playbook import PlaybookOperator, PlaybookStore
+
+
+class TestPlaybookStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_import_legacy_files(self):
+        for bullet_id, content in [(1, "策略一"), (7, "策略七")]:
+            with open(os.path.join(self.directory, f"{bullet_id:08d}.txt"), "w", encoding="utf-8") as f:
+                f.write(content)
+
+        store = PlaybookStore(self.directory)
+        self.assertEqual(store.ids(), [1, 7])
+        self.assertEqual(store.get(7), "策略七")
+        self.assertEqual(store.next_id(), 8)
+
+    def test_create_is_visible_to_list(self):
+        operator = PlaybookOperator(PlaybookStore(self.directory))
+        bullet_id = operator.create_policy("# 目的：列出所有保单")
+        self.assertEqual(bullet_id, 1)
+        self.assertEqual([p.bullet_id for p in operator.list_policies()], [1])
+        self.assertEqual(operator.get_next_bullet_id(), 2)
+
+    def test_reload_on_external_write(self):
+        reader = PlaybookStore(self.directory)
+        writer = PlaybookStore(self.directory)
+        bullet_id = writer.create("原始内容")
+        self.assertEqual(reader.get(bullet_id), "原始内容")
+        writer.update(bullet_id, "修改后的内容")
+        self.assertEqual(reader.get(bullet_id), "修改后的内容")
+        writer.delete(bullet_id)
+        self.assertEqual(reader.policies(), [])
+
+    def test_concurrent_writers_get_unique_ids(self):
+        stores = [PlaybookStore(self.directory) for _ in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            ids = list(pool.map(lambda i: stores[i % 4].create(f"策略{i}"), range(40)))
+        self.assertEqual(sorted(ids), list(range(1, 41)))
+        self.assertEqual(len(PlaybookStore(self.directory).policies()), 40)
+
+    def test_grep_with_context(self):
+        store = PlaybookStore(self.directory)
+        store.create("第一行\n第二行\n保单文件\n第四行")
+        results = store.grep("保单文件", context_lines=1)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].content, "第二行\n保单文件\n第四行")
+
+    def test_grep_invalid_regex_matches_literally(self):
+        operator = PlaybookOperator(PlaybookStore(self.directory))
+        operator.create_policy("免赔额(每年")
+        results = operator.grep("免赔额(", context_lines=0)
+        self.assertEqual([result.content for result in results], ["免赔额(每年"])
+        self.assertEqual(operator.grep("[未闭合"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
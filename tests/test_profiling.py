@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks.corpus import generate_corpus
+from pdf_converter import PDFToTxtConverter
+from profiling import StageProfiler, profile_stage
+
+
+def build_table(rows: int) -> list[str]:
+    return [f"第{i}行" * 10 for i in range(rows)]
+
+
+class TestStageProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_dir = os.path.join(self.tmp.name, "profile")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_samples_every_nth_run_and_writes_summary(self):
+        profiler = StageProfiler(self.output_dir, every=2, top_n=5)
+        kept = []
+        for i in range(5):
+            with profiler.stage("convert", f"doc{i}"):
+                kept.append(build_table(2000))
+
+        summary = profiler.summary()["stages"]["convert"]
+        self.assertEqual(summary["runs"], 5)
+        self.assertEqual(summary["sampled"], 3)
+        self.assertEqual([s.label for s in profiler.samples], ["doc0", "doc2", "doc4"])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "convert-0002.prof")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "convert-0001.prof")))
+        self.assertTrue(any("build_table" in row["function"] for row in summary["hotspots_cumtime"]))
+        self.assertTrue(any("test_profiling.py" in row["location"] for row in summary["allocations"]))
+        self.assertGreater(summary["peak_bytes_max"], 0)
+
+        path = profiler.write_summary()
+        with open(path, "r", encoding="utf-8") as f:
+            self.assertIn("== convert", f.read())
+        with open(os.path.join(self.output_dir, "summary.json"), "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["stages"]["convert"]["profiled"], 3)
+
+    def test_overlapping_async_stages_only_record_time(self):
+        profiler = StageProfiler(self.output_dir)
+
+        async def summarize(label: str):
+            with profiler.stage("abstract", label):
+                await asyncio.sleep(0.01)
+
+        async def run_all():
+            await asyncio.gather(*(summarize(f"doc{i}") for i in range(3)))
+
+        asyncio.run(run_all())
+        self.assertEqual(len(profiler.samples), 3)
+        self.assertEqual(sum(sample.profiled for sample in profiler.samples), 1)
+        # 下一次采样不受之前重叠的影响
+        with profiler.stage("abstract", "doc3"):
+            pass
+        self.assertTrue(profiler.samples[-1].profiled)
+
+    def test_profile_stage_without_profiler_is_noop(self):
+        with profile_stage(None, "question"):
+            pass
+
+    def test_converter_profiles_each_document(self):
+        generate_corpus(os.path.join(self.tmp.name, "pdf"), documents=3, pages=1)
+        profiler = StageProfiler(self.output_dir, every=2)
+        converter = PDFToTxtConverter(
+            os.path.join(self.tmp.name, "pdf"),
+            os.path.join(self.tmp.name, "txt"),
+            os.path.join(self.tmp.name, "map.json"),
+            profiler,
+        )
+        converter.process_all_pdfs()
+        summary = profiler.summary()["stages"]["convert"]
+        self.assertEqual(summary["runs"], 3)
+        self.assertEqual(summary["profiled"], 2)
+        self.assertTrue(any("pdfplumber" in row["function"] or "pdfminer" in row["function"]
+                            for row in summary["hotspots_cumtime"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+from reflection_queue import ReflectionQueue
+
+
+def turn(question: str, answer: str):
+    return [
+        ModelRequest(parts=[UserPromptPart(content=question)]),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ]
+
+
+class TestReflectionQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def handler(self, objective, messages):
+        self.calls.append((objective, len(messages)))
+
+    async def test_coalesce_same_session(self):
+        queue = ReflectionQueue(self.handler, self.directory)
+        queue.submit("s1", "问题一", turn("问题一", "回答一"))
+        queue.submit("s1", "问题二", turn("问题二", "回答二"))
+        queue.submit("s2", "问题三", turn("问题三", "回答三"))
+        await queue.start()
+        await queue.close(timeout=5)
+
+        self.assertEqual(self.calls, [("问题一；问题二", 4), ("问题三", 2)])
+        self.assertEqual(list(Path(self.directory).glob("*.json")), [])
+
+    async def test_resume_after_restart(self):
+        blocked = asyncio.Event()
+
+        async def slow_handler(objective, messages):
+            await blocked.wait()
+
+        queue = ReflectionQueue(slow_handler, self.directory)
+        await queue.start()
+        queue.submit("s1", "问题一", turn("问题一", "回答一"))
+        await queue.close(timeout=0.05)
+        self.assertEqual(len(list(Path(self.directory).glob("*.json"))), 1)
+
+        resumed = ReflectionQueue(self.handler, self.directory)
+        await resumed.start()
+        await resumed.close(timeout=5)
+        self.assertEqual(self.calls, [("问题一", 2)])
+
+    async def test_bounded_queue_spills_and_drains(self):
+        queue = ReflectionQueue(self.handler, self.directory, workers=2, maxsize=1)
+        for i in range(5):
+            queue.submit(f"s{i}", f"问题{i}", turn(f"问题{i}", f"回答{i}"))
+        await queue.start()
+        await queue.close(timeout=5)
+        self.assertEqual(sorted(objective for objective, _ in self.calls), [f"问题{i}" for i in range(5)])
+
+    async def test_spilled_jobs_are_not_kept_in_memory(self):
+        queue = ReflectionQueue(self.handler, self.directory, maxsize=2)
+        for i in range(10):
+            queue.submit(f"s{i}", f"问题{i}", turn(f"问题{i}", f"回答{i}"))
+        # 溢出任务的追加对话写入磁盘上的任务
+        queue.submit("s9", "追问", turn("追问", "回答"))
+        self.assertEqual(queue.pending, 10)
+        self.assertEqual(len(queue._jobs), 2)
+        await queue.start()
+        await queue.close(timeout=5)
+        self.assertEqual(len(self.calls), 10)
+        self.assertIn(("问题9；追问", 4), self.calls)
+        self.assertEqual(queue._jobs, {})
+
+    async def test_failed_job_is_kept(self):
+        attempts = []
+
+        async def failing_handler(objective, messages):
+            attempts.append(asyncio.get_running_loop().time())
+            raise RuntimeError("模型调用失败")
+
+        queue = ReflectionQueue(failing_handler, self.directory, max_attempts=3, retry_delay=0.05)
+        await queue.start()
+        with self.assertLogs("reflection_queue", level="ERROR"):
+            queue.submit("s1", "问题一", turn("问题一", "回答一"))
+            await queue.close(timeout=5)
+        self.assertEqual(len(list(Path(self.directory).glob("*.failed"))), 1)
+        self.assertEqual(queue.pending, 0)
+        # 两次重试之间的等待时间依次翻倍
+        self.assertEqual(len(attempts), 3)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.05)
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.1)
+
+    async def test_backoff_survives_restart(self):
+        async def failing_handler(objective, messages):
+            raise RuntimeError("模型调用失败")
+
+        queue = ReflectionQueue(failing_handler, self.directory, retry_delay=60)
+        await queue.start()
+        with self.assertLogs("reflection_queue", level="ERROR"):
+            queue.submit("s1", "问题一", turn("问题一", "回答一"))
+            await queue.close(timeout=0.1)
+
+        resumed = ReflectionQueue(self.handler, self.directory)
+        await resumed.start()
+        await resumed.close(timeout=0.1)
+        # 退避时间未到，任务保留在磁盘上
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len(list(Path(self.directory).glob("*.json"))), 1)
+
+    async def test_corrupt_job_does_not_stop_worker(self):
+        with open(Path(self.directory) / "00000000-bad.json", "w", encoding="utf-8") as f:
+            json.dump({"job_id": "00000000-bad", "session_id": "s0", "objectives": ["坏任务"],
+                       "messages": [{"kind": "bogus"}], "attempts": 0}, f)
+        with open(Path(self.directory) / "00000001-broken.json", "w", encoding="utf-8") as f:
+            f.write("{")
+
+        queue = ReflectionQueue(self.handler, self.directory)
+        with self.assertLogs("reflection_queue", level="ERROR"):
+            await queue.start()
+            queue.submit("s1", "问题一", turn("问题一", "回答一"))
+            await asyncio.wait_for(queue.close(), timeout=5)
+
+        self.assertEqual(self.calls, [("问题一", 2)])
+        self.assertEqual(queue.pending, 0)
+        self.assertEqual(sorted(path.name for path in Path(self.directory).iterdir()),
+                         ["00000000-bad.failed", "00000001-broken.failed"])
+
+    async def test_shared_directory_runs_each_job_once(self):
+        # 两个进程共用同一个队列目录，都在启动时加载了对方提交的任务
+        first = ReflectionQueue(self.handler, self.directory)
+        second = ReflectionQueue(self.handler, self.directory)
+        for i in range(4):
+            first.submit(f"s{i}", f"问题{i}", turn(f"问题{i}", f"回答{i}"))
+        await second.start()
+        await first.start()
+        await asyncio.wait_for(asyncio.gather(first.close(), second.close()), timeout=5)
+
+        self.assertEqual(sorted(objective for objective, _ in self.calls), [f"问题{i}" for i in range(4)])
+        self.assertEqual((first.pending, second.pending), (0, 0))
+        self.assertEqual(list(Path(self.directory).iterdir()), [])
+
+    async def test_stale_claim_is_recovered(self):
+        queue = ReflectionQueue(self.handler, self.directory)
+        queue.submit("s1", "问题一", turn("问题一", "回答一"))
+        queue.submit("s2", "问题二", turn("问题二", "回答二"))
+        # 模拟正在处理时异常退出的进程：一个认领已过期，一个仍在处理
+        stale, active = sorted(Path(self.directory).glob("*.json"))
+        os.replace(stale, stale.with_suffix(".running"))
+        os.utime(stale.with_suffix(".running"), (time.time() - 7200, time.time() - 7200))
+        os.replace(active, active.with_suffix(".running"))
+
+        resumed = ReflectionQueue(self.handler, self.directory)
+        await resumed.start()
+        await resumed.close(timeout=5)
+        self.assertEqual(self.calls, [("问题一", 2)])
+        self.assertEqual(list(Path(self.directory).iterdir()), [active.with_suffix(".running")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from insurance_agent import InsuranceAgent
+from playbook import PlaybookOperator, PlaybookStore
+from server import InsuranceServer
+
+
+async def answer(messages, info: AgentInfo) -> ModelResponse:
+    await asyncio.sleep(0.1)
+    return ModelResponse(parts=[TextPart(content=f"已收到{len(messages)}条消息")])
+
+
+async def stream_answer(messages, info: AgentInfo):
+    await asyncio.sleep(0.1)
+    for chunk in ["重疾险", "保额", "50万元"]:
+        yield chunk
+
+
+async def request(port: int, method: str, path: str, payload: dict | None = None) -> tuple[int, str]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    response = (await reader.read()).decode("utf-8")
+    writer.close()
+    head, _, content = response.partition("\r\n\r\n")
+    return int(head.split(" ")[1]), content
+
+
+def parse_events(content: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in content.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestInsuranceServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        map_file = os.path.join(self.tmp.name, "map.json")
+        with open(map_file, "w", encoding="utf-8") as f:
+            json.dump({"保单A": {"txt_path": "processed-docs/a.txt", "title": "保单A"}}, f, ensure_ascii=False)
+        self.insurance_agent = InsuranceAgent(map_file, self.tmp.name)
+        self.insurance_agent.agent.model = FunctionModel(answer, stream_function=stream_answer)
+        operator = PlaybookOperator(PlaybookStore(os.path.join(self.tmp.name, "playbook")))
+        self.server = InsuranceServer(self.insurance_agent, operator)
+        self.listener = await self.server.start("127.0.0.1", 0)
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.tmp.cleanup()
+
+    async def test_health(self):
+        status, content = await request(self.port, "GET", "/health")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content)["documents"], 1)
+
+    async def test_session_ask_streams_answer(self):
+        status, content = await request(self.port, "POST", "/sessions")
+        self.assertEqual(status, 201)
+        session_id = json.loads(content)["session_id"]
+
+        status, content = await request(self.port, "POST", f"/sessions/{session_id}/ask", {"question": "重疾险保额是多少"})
+        self.assertEqual(status, 200)
+        events = parse_events(content)
+        self.assertEqual("".join(data["text"] for kind, data in events if kind == "delta"), "重疾险保额50万元")
+        self.assertEqual(events[-1][0], "done")
+        self.assertEqual(events[-1][1]["answer"], "重疾险保额50万元")
+        self.assertEqual(len(self.server.sessions[session_id].history.trace), 2)
+
+    async def test_concurrent_sessions(self):
+        session_ids = []
+        for _ in range(5):
+            _, content = await request(self.port, "POST", "/sessions")
+            session_ids.append(json.loads(content)["session_id"])
+
+        started = asyncio.get_running_loop().time()
+        results = await asyncio.gather(*(
+            request(self.port, "POST", f"/sessions/{session_id}/ask", {"question": "保额"})
+            for session_id in session_ids
+        ))
+        elapsed = asyncio.get_running_loop().time() - started
+        self.assertTrue(all(status == 200 for status, _ in results))
+        # 每个回答需要0.1秒，5个会话并发执行
+        self.assertLess(elapsed, 0.4)
+
+    async def test_errors(self):
+        status, _ = await request(self.port, "POST", "/sessions/unknown/ask", {"question": "保额"})
+        self.assertEqual(status, 404)
+        status, _ = await request(self.port, "POST", "/ask", {})
+        self.assertEqual(status, 400)
+        status, _ = await request(self.port, "GET", "/ask")
+        self.assertEqual(status, 405)
+
+    async def test_catalog_hot_reload(self):
+        with open(self.insurance_agent.map_file, "w", encoding="utf-8") as f:
+            json.dump({"保单A": {}, "保单B": {}}, f, ensure_ascii=False)
+        os.utime(self.insurance_agent.map_file, ns=(1, 1))
+        status, _ = await request(self.port, "POST", "/ask", {"question": "有哪些保单"})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(self.insurance_agent.file_map), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
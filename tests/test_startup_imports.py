@@ -0,0 +1,81 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(REPO_DIR, "main.py")
+
+_IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)")
+
+# 各模式的导入耗时上限（毫秒），留有足够余量，只用于发现把重量级依赖重新放回启动路径的回归
+STARTUP_BUDGET_MS = {
+    "help": 400,
+    "convert": 1500,
+    "compact": 4000,
+    "agent2cli": 4000,
+}
+
+
+def import_profile(args: list[str], cwd: str) -> tuple[float, set[str]]:
+    """以 -X importtime 运行，返回导入耗时总和（毫秒）和加载过的顶层包"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        env={**os.environ, "PYTHONPATH": REPO_DIR},
+        timeout=120,
+    )
+    if proc.returncode != 0:
+        raise AssertionError(f"{args} 运行失败：\n{proc.stderr[-2000:]}")
+    total_us = 0
+    packages = set()
+    for line in proc.stderr.splitlines():
+        match = _IMPORT_TIME_RE.match(line)
+        if match:
+            total_us += int(match.group(1))
+            packages.add(match.group(2).split(".")[0])
+    return total_us / 1000, packages
+
+
+class TestStartupImports(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp.name, "insurance-docs"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertStartup(self, mode: str, args: list[str], forbidden: set[str]):
+        elapsed_ms, packages = import_profile(args, self.tmp.name)
+        self.assertFalse(packages & forbidden, f"{mode} 模式不应导入 {sorted(packages & forbidden)}")
+        self.assertLess(elapsed_ms, STARTUP_BUDGET_MS[mode], f"{mode} 模式导入耗时 {elapsed_ms:.0f}ms")
+        return packages
+
+    def test_help_loads_no_llm_stack(self):
+        self.assertStartup("help", [MAIN, "--help"],
+                           {"pydantic_ai", "openai", "rich", "prompt_toolkit", "numpy", "pdfplumber", "ace"})
+
+    def test_convert_loads_only_pdf_converter(self):
+        try:
+            import pdfplumber  # noqa: F401
+        except ImportError:
+            self.skipTest("pdfplumber未安装")
+        packages = self.assertStartup("convert", [MAIN, "--convert"],
+                                      {"pydantic_ai", "openai", "prompt_toolkit", "numpy", "ace"})
+        self.assertIn("pdfplumber", packages)
+
+    def test_compact_playbook_builds_no_agents(self):
+        self.assertStartup("compact", [MAIN, "--compact-playbook"],
+                           {"pydantic_ai", "openai", "prompt_toolkit", "pdfplumber", "ace"})
+
+    def test_agent2cli_defers_terminal_ui(self):
+        self.assertStartup("agent2cli", ["-c", "import agent2cli"], {"prompt_toolkit", "pyperclip", "numpy"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import io
+import unittest
+
+from rich.console import Console
+from rich.live import Live
+
+from stream_render import IncrementalMarkdownRenderer, find_commit_boundary
+
+
+class TestStreamRender(unittest.TestCase):
+    def test_commit_boundary(self):
+        self.assertEqual(find_commit_boundary("# 标题\n\n正文还没写完"), len("# 标题\n\n"))
+        self.assertEqual(find_commit_boundary("只有一段"), 0)
+        # 代码块内部的空行不能作为提交位置
+        text = "说明\n\n```python\nx = 1\n\ny = 2\n"
+        self.assertEqual(find_commit_boundary(text), len("说明\n\n"))
+        self.assertEqual(find_commit_boundary(text + "```\n\n结论"), len(text + "```\n\n"))
+
+    def test_loose_list_is_not_split(self):
+        intro = "保单如下：\n\n"
+        items = "1. 重疾险\n\n   保额50万元\n\n2. 医疗险\n\n"
+        # 列表项之间的空行不能提交，否则同一个列表会被拆成多个列表渲染
+        self.assertEqual(find_commit_boundary(intro + items), len(intro))
+        self.assertEqual(find_commit_boundary(intro + items + "3"), len(intro))
+        self.assertEqual(find_commit_boundary(intro + items + "3. 意外险\n\n"), len(intro))
+        # 列表之后出现不缩进的段落，整个列表才能提交
+        self.assertEqual(find_commit_boundary(intro + items + "合计"), len(intro + items))
+        self.assertEqual(find_commit_boundary(intro + items + "合计两份\n\n以上"), len(intro + items + "合计两份\n\n"))
+
+    def test_blocks_committed_once(self):
+        output = io.StringIO()
+        console = Console(file=output, width=80, force_terminal=False)
+        with Live('', console=console, auto_refresh=False) as live:
+            renderer = IncrementalMarkdownRenderer(live, 'ansi_dark', min_interval=0)
+            content = ''
+            for delta in ["# 保单", "汇总\n\n- 重疾险", "：50万\n", "\n合计", "保额50万"]:
+                content += delta
+                renderer.update(content)
+            renderer.finish()
+
+        text = output.getvalue()
+        self.assertEqual(text.count("保单汇总"), 1)
+        self.assertEqual(text.count("重疾险：50万"), 1)
+        self.assertIn("合计保额50万", text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from fact_agent import FactAgent
+from insurance_agent import InsuranceAgent
+from playbook import PlaybookOperator, PlaybookStore
+from server import InsuranceServer, Tenant
+from tenants import TenantScheduler, list_tenants, resolve_document_path, tenant_paths
+from tests.test_server import request
+
+
+def write_tenant(base: str, tenant_id: str, holders: list[str]):
+    """在tenants/<ID>下写入与--convert相同布局的文档映射，txt_path相对于家庭根目录"""
+    paths = tenant_paths(tenant_id, base)
+    paths.output_directory.mkdir(parents=True)
+    file_map = {}
+    for i, holder in enumerate(holders):
+        title = f"{tenant_id}合同{i}"
+        with open(paths.output_directory / f"{title}.txt", "w", encoding="utf-8") as f:
+            f.write(f"投保人：{holder}\n保险金额：50万元\n")
+        file_map[title] = {"txt_path": f"processed-docs/{title}.txt", "title": title, "abstract": "", "sha1_hash": f"{tenant_id}-{i}"}
+    with open(paths.map_file, "w", encoding="utf-8") as f:
+        json.dump(file_map, f, ensure_ascii=False)
+    return paths
+
+
+class TestTenantPaths(unittest.TestCase):
+    def test_layout(self):
+        default = tenant_paths()
+        self.assertEqual(default.map_file, Path("map.json"))
+        self.assertEqual(default.playbook_directory, Path("playbook"))
+        paths = tenant_paths("张家", "/data/tenants")
+        self.assertEqual(paths.output_directory, Path("/data/tenants/张家/processed-docs"))
+        self.assertEqual(paths.reflection_queue_directory, Path("/data/tenants/张家/reflector/queue"))
+        self.assertEqual(resolve_document_path(paths.map_file, "processed-docs/a.txt"),
+                         Path("/data/tenants/张家/processed-docs/a.txt"))
+
+    def test_invalid_tenant_id(self):
+        for tenant_id in ["..", "a/b", "", "a b", "zhang\n"]:
+            with self.assertRaises(ValueError):
+                tenant_paths(tenant_id)
+
+    def test_list_tenants(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_tenant(tmp, "zhang", ["张三"])
+            os.makedirs(os.path.join(tmp, "li", "insurance-docs"))
+            os.makedirs(os.path.join(tmp, "empty"))
+            self.assertEqual(list_tenants(tmp), ["li", "zhang"])
+            self.assertEqual(list_tenants(os.path.join(tmp, "missing")), [])
+
+
+class TestTenantScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_round_robin_within_limit(self):
+        scheduler = TenantScheduler(2)
+        order, running = [], []
+
+        async def task(tenant_id: str):
+            async with scheduler.limiter(tenant_id):
+                running.append(scheduler.running)
+                order.append(tenant_id)
+                await asyncio.sleep(0.01)
+
+        # a家庭的任务先提交，名额空闲后仍在a、b之间轮转
+        await asyncio.gather(*[task("a") for _ in range(6)], *[task("b") for _ in range(2)])
+        self.assertLessEqual(max(running), 2)
+        self.assertEqual(order, ["a", "a", "a", "b", "a", "b", "a", "a"])
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_cancelled_waiter_releases_slot(self):
+        scheduler = TenantScheduler(1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        scheduler.release()
+        self.assertEqual(scheduler.running, 0)
+
+
+class TestTenantExtraction(unittest.TestCase):
+    def test_facts_extracted_per_tenant_within_global_limit(self):
+        active, peak = [0], [0]
+
+        async def extract(messages, info: AgentInfo) -> ModelResponse:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.01)
+            active[0] -= 1
+            holder = re.search(r"投保人：(\S+)", messages[-1].parts[-1].content).group(1)
+            facts = [{"policy_holder": holder, "sum_insured": 500000}]
+            return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"response": facts})])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tenants = [write_tenant(tmp, "zhang", ["张三"] * 5), write_tenant(tmp, "li", ["李四"] * 3)]
+            scheduler = TenantScheduler(2)
+            agents = []
+            for paths in tenants:
+                agent = FactAgent(str(paths.map_file), str(paths.output_directory), limiter=scheduler.limiter(paths.tenant_id))
+                agent.agent.model = FunctionModel(extract)
+                agents.append(agent)
+
+            async def process_all():
+                await asyncio.gather(*(agent.process_all_documents() for agent in agents))
+
+            with redirect_stdout(StringIO()):
+                asyncio.run(process_all())
+
+            self.assertLessEqual(peak[0], 2)
+            holders = [
+                json.loads(InsuranceAgent(str(paths.map_file), str(paths.output_directory)).query_facts(group_by="policy_holder", aggregate="count"))
+                for paths in tenants
+            ]
+        self.assertEqual(holders, [[{"policy_holder": "张三", "count": 5}], [{"policy_holder": "李四", "count": 3}]])
+
+    def test_grep_is_confined_to_tenant_documents(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            zhang = write_tenant(tmp, "zhang", ["张三"])
+            write_tenant(tmp, "li", ["李四"])
+            agent = InsuranceAgent(str(zhang.map_file), str(zhang.output_directory))
+            result = agent.grep("投保人", "../li/processed-docs/li合同0.txt")
+        self.assertTrue(result.startswith("只能搜索文档目录中的文件"))
+
+
+async def answer(messages, info: AgentInfo) -> ModelResponse:
+    return ModelResponse(parts=[TextPart(content="有保单")])
+
+
+class SlowQueue:
+    """close时等待正在执行的反思任务完成，记录每次调用的超时"""
+
+    def __init__(self, release: asyncio.Event):
+        self.release = release
+        self.close_timeouts = []
+        self.closed = False
+
+    async def start(self):
+        pass
+
+    def submit(self, session_id: str, question: str, messages: list):
+        pass
+
+    async def close(self, timeout: float):
+        self.close_timeouts.append(timeout)
+        await self.release.wait()
+        self.closed = True
+
+
+class TestMultiTenantServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_tenant(self.tmp.name, "zhang", ["张三", "张三"])
+        write_tenant(self.tmp.name, "li", ["李四"])
+        self.loaded = []
+        self.queues = {}
+        # 家庭ID -> 放行回答的事件，用于模拟回答中的请求
+        self.gates = {}
+        self.answering = asyncio.Event()
+
+        def load(tenant_id: str) -> Tenant:
+            paths = tenant_paths(tenant_id, self.tmp.name)
+            if not paths.root.is_dir():
+                raise FileNotFoundError(paths.root)
+            self.loaded.append(tenant_id)
+            agent = InsuranceAgent(str(paths.map_file), str(paths.output_directory))
+            gate = self.gates.get(tenant_id)
+
+            async def gated_stream_answer(messages, info: AgentInfo):
+                if gate is not None:
+                    self.answering.set()
+                    await gate.wait()
+                yield "有保单"
+
+            agent.agent.model = FunctionModel(answer, stream_function=gated_stream_answer)
+            return Tenant(agent, PlaybookOperator(PlaybookStore(str(paths.playbook_directory))), self.queues.get(tenant_id))
+
+        self.server = InsuranceServer(None, None, tenant_loader=load, max_loaded_tenants=1)
+        self.listener = await self.server.start("127.0.0.1", 0)
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.listener.close()
+        await self.listener.wait_closed()
+        self.tmp.cleanup()
+
+    async def test_sessions_load_only_their_tenant(self):
+        status, content = await request(self.port, "POST", "/sessions", {"tenant": "zhang"})
+        self.assertEqual(status, 201)
+        session_id = json.loads(content)["session_id"]
+        self.assertEqual(self.loaded, ["zhang"])
+        self.assertEqual(len(self.server.tenants["zhang"].insurance_agent.file_map), 2)
+
+        status, _ = await request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "li"})
+        self.assertEqual(status, 200)
+        # 最多保留1个家庭，zhang被卸载
+        self.assertEqual(list(self.server.tenants), ["li"])
+
+        status, content = await request(self.port, "POST", f"/sessions/{session_id}/ask", {"question": "有哪些保单"})
+        self.assertEqual(status, 200)
+        self.assertIn("有保单", content)
+        self.assertEqual(self.loaded, ["zhang", "li", "zhang"])
+
+        _, content = await request(self.port, "GET", "/health")
+        health = json.loads(content)
+        self.assertEqual(health["tenants"]["zhang"]["documents"], 2)
+        self.assertEqual(health["tenant_evictions"], 2)
+
+    async def test_busy_tenant_is_not_evicted(self):
+        gate = self.gates["zhang"] = asyncio.Event()
+        pending = asyncio.create_task(request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "zhang"}))
+        await self.answering.wait()
+        status, _ = await request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "li"})
+        self.assertEqual(status, 200)
+        # zhang仍在回答问题，暂时超出上限
+        self.assertEqual(list(self.server.tenants), ["zhang", "li"])
+        gate.set()
+        status, content = await pending
+        self.assertEqual(status, 200)
+        self.assertIn("有保单", content)
+        await request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "li"})
+        self.assertEqual(self.loaded, ["zhang", "li"])
+
+    async def test_reload_waits_for_evicted_queue(self):
+        release = asyncio.Event()
+        queue = self.queues["zhang"] = SlowQueue(release)
+        await request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "zhang"})
+        await request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "li"})
+        self.assertEqual(list(self.server.tenants), ["li"])
+        self.assertGreater(queue.close_timeouts[0], 0)
+
+        reload = asyncio.create_task(request(self.port, "POST", "/ask", {"question": "有哪些保单", "tenant": "zhang"}))
+        await asyncio.sleep(0.05)
+        # 反思任务完成前不重新加载zhang
+        self.assertEqual(self.loaded, ["zhang", "li"])
+        release.set()
+        status, _ = await reload
+        self.assertEqual(status, 200)
+        self.assertTrue(queue.closed)
+        self.assertEqual(self.loaded, ["zhang", "li", "zhang"])
+
+    async def test_tenant_errors(self):
+        status, _ = await request(self.port, "POST", "/ask", {"question": "保额"})
+        self.assertEqual(status, 400)
+        status, _ = await request(self.port, "POST", "/sessions", {"tenant": "../zhang"})
+        self.assertEqual(status, 400)
+        status, _ = await request(self.port, "POST", "/sessions", {"tenant": "wang"})
+        self.assertEqual(status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
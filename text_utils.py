@@ -0,0 +1,46 @@
+import re
+import unicodedata
+
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数，不依赖具体模型的分词器
+
+    中文字符大约每个字一个token，其余字符大约每4个字符一个token
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def normalize_text(text: str) -> str:
+    """统一全角/半角、大小写，去掉空白和标点，便于相似度计算"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(
+        ch for ch in text
+        if not ch.isspace() and not unicodedata.category(ch).startswith(('P', 'S'))
+    )
+
+
+# 常用繁体字到简体字的对照（覆盖保险问答中的常见用字），足以让繁简两种写法的同一问题归一到同一个键
+_TRADITIONAL = (
+    "險額費醫療壽終們這個麼麽幾時間單號過給傷殘種與為說請問題還裡裏後會對經購買賣價錢萬億貸帳賬戶齡歲兒媽爺孫婦親屬關係"
+    "聯絡電話郵證書條約規則責權義務賠償報銷續繳納應該並將從認識計劃資產財稅車輛駕駛蓋範圍內滿開結復變換轉讓錄紀記擇選項"
+    "類別優點現實際處辦機構銀腫臟腦齒診斷術藥護傳歷曆聲補貼領觀猶寬嗎誰樣沒無雙總數據統當長達負擔盡級線標準團體學習業職"
+    "員僱國華東訂閱讀寫簽頁檔裝載網貨幣兌儲預頭門來見覺愛歸檢驗紹詢諮餘遞區縣鄉鎮陽狀態況確廣層屆禮儀壞舊齊贈減稱災難溫"
+    "濕癥瘧癱瘓聾啞眾夥圖畫輕緊"
+)
+_SIMPLIFIED = (
+    "险额费医疗寿终们这个么么几时间单号过给伤残种与为说请问题还里里后会对经购买卖价钱万亿贷账账户龄岁儿妈爷孙妇亲属关系"
+    "联络电话邮证书条约规则责权义务赔偿报销续缴纳应该并将从认识计划资产财税车辆驾驶盖范围内满开结复变换转让录纪记择选项"
+    "类别优点现实际处办机构银肿脏脑齿诊断术药护传历历声补贴领观犹宽吗谁样没无双总数据统当长达负担尽级线标准团体学习业职"
+    "员雇国华东订阅读写签页档装载网货币兑储预头门来见觉爱归检验绍询咨余递区县乡镇阳状态况确广层届礼仪坏旧齐赠减称灾难温"
+    "湿症疟瘫痪聋哑众伙图画轻紧"
+)
+_TO_SIMPLIFIED = str.maketrans(_TRADITIONAL, _SIMPLIFIED)
+
+
+def to_simplified(text: str) -> str:
+    """把常用繁体字转换为简体字"""
+    return text.translate(_TO_SIMPLIFIED)